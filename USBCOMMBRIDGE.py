@@ -27,6 +27,8 @@ import threading
 from colorama import Fore, Style
 import json
 import logging
+import secrets
+import sqlite3
 import time
 from kivy.uix.spinner import Spinner  # Import Spinner
 from kivy.properties import StringProperty  # Import StringProperty
@@ -36,6 +38,19 @@ from kivy.uix.floatlayout import FloatLayout  # Import FloatLayout
 from kivy.app import App  # Import App
 from kivy.uix.image import Image  # Import Image
 
+from hostlink import HostLink, HostLinkError  # Omron Host Link framing engine
+from cip_client import CipClient, CipError  # EtherNet/IP tag reads
+from port_bridge import PortBridge  # Transparent forwarding between two serial ports
+from bus_sniffer import BusSniffer  # Passive RS485 frame capture with Modbus RTU / Host Link decoding
+from frames import LatencyStats, read_frame, write_frame  # monotonic_ns-stamped frames
+from capture import CaptureHandler, torn_tail  # Binary traffic capture files
+from archive import ArchiveWriter  # Capture files with a seek index sidecar
+from replay import Replayer, capture_ports  # Timed playback of capture files
+from mqtt_sink import MqttSink  # Batched MQTT publishing of bridged traffic
+from store_forward import StoreAndForwardQueue  # Holds MQTT messages on disk while the broker is down
+from ws_stream import WebSocketStreamServer  # Live traffic to browser / WebSocket clients
+from report_by_exception import ReportByExceptionSink  # Publish tag values only when they change
+
 
 
 
@@ -70,6 +85,8 @@ check_and_install('colorama')
 logging.basicConfig(filename='usb_converter.log', level=logging.INFO, 
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+latency = LatencyStats()  # Request write completion to first response byte, across all send_* functions
+
 # Function to display the banner with key parameters and examples
 def display_banner():
     banner = r"""
@@ -116,7 +133,7 @@ def display_banner():
     **           PLC Communication Settings           **
     *******************************************************
         - Omron: A communication protocol used for Omron PLCs.
-            - Protocols: Modbus RTU, FINS, Ethernet/IP, and EtherCAT.
+            - Protocols: Modbus RTU, FINS, Ethernet/IP, EtherCAT, and Host Link.
         - Modicon: A communication protocol used for Modicon PLCs.
             - Protocols: Modbus TCP/IP, Modbus RTU, and Ethernet/IP.
     """
@@ -264,13 +281,16 @@ def choose_data_type():
     print("7. Control Command (e.g., Start/Stop)")
     print("8. OMRON PLC")
     print("9. MODICON PLC")
+    print("11. Port-to-port bridge (forward between two serial ports)")
+    print("12. RS485 bus sniffer (listen only)")
+    print("13. Replay a capture file into a port")
 
     while True:
         choice = input("Enter the number corresponding to your choice (default: 1): ").strip()
-        if choice in ['1', '2', '3', '4', '5', '6', '7', '8', '9']:
+        if choice in ['1', '2', '3', '4', '5', '6', '7', '8', '9', '11', '12', '13']:
             break
         else:
-            print(Fore.RED + "Invalid choice! Please select a valid option between 1 and 9." + Style.RESET_ALL)
+            print(Fore.RED + "Invalid choice! Please select a valid option from the list." + Style.RESET_ALL)
 
     return choice
 
@@ -280,6 +300,7 @@ def choose_omron_protocol():
     print("2. FINS")
     print("3. Ethernet/IP")
     print("4. EtherCAT")
+    print("5. Host Link (C-mode)")
     # Add more protocols as needed
     return input("Enter the number corresponding to your choice: ")
 
@@ -291,42 +312,125 @@ def choose_modicon_protocol():
     # Add more protocols as needed
     return input("Enter the number corresponding to your choice: ")
 
+# Traffic sink that hands every frame and tag set to each open sink (MqttSink, WebSocketStreamServer)
+class Sinks:
+    def __init__(self, *sinks):
+        self.sinks = [sink for sink in sinks if sink is not None]
+
+    def publish_frame(self, port, data, direction='rx'):
+        for sink in self.sinks:
+            sink.publish_frame(port, data, direction)
+
+    def publish_tags(self, source, tags):
+        for sink in self.sinks:
+            if hasattr(sink, 'publish_tags'):
+                sink.publish_tags(source, tags)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+# Function to publish frames to the traffic sink (Sinks), skipping missing ones
+def publish(sink, *frames):
+    if sink is None:
+        return
+    for frame in frames:
+        if frame is not None:
+            sink.publish_frame(frame.port, frame.data, frame.direction)
+
+# Function to open the MQTT sink named in the settings file, or ask for a broker
+def open_mqtt_sink(settings):
+    settings = settings or {}
+    broker = settings.get('mqtt_broker')
+    if broker is None:
+        broker = input("Publish traffic to an MQTT broker (host[:port], blank for none): ").strip()
+    if not broker:
+        return None
+    host, _, mqtt_port = broker.partition(':')
+    store_path = settings.get('mqtt_store', 'store_forward.db')  # Blank turns store-and-forward off
+    store = None
+    try:
+        store = StoreAndForwardQueue(store_path) if store_path else None
+        sink = MqttSink(host, int(mqtt_port or 1883), store=store).start()
+    except (OSError, ValueError, sqlite3.Error) as e:
+        if store is not None:
+            store.close()
+        print(Fore.RED + f"Cannot connect to MQTT broker {broker}: {e}" + Style.RESET_ALL)
+        logging.error(f"Cannot connect to MQTT broker {broker}: {e}")
+        return None
+    logging.info(f"Publishing traffic to MQTT broker {broker}")
+    if store is not None:
+        logging.info(f"MQTT messages wait in {store_path} while the broker is unreachable")
+    return sink
+
+# Function to start the WebSocket traffic stream named in the settings file, or ask for a port
+def open_ws_stream(settings):
+    settings = settings or {}
+    ws_port = settings.get('ws_port')
+    if ws_port is None:
+        ws_port = input("Stream traffic to WebSocket clients (port, blank for none): ").strip()
+    if not ws_port:
+        return None
+    host = settings.get('ws_host', '127.0.0.1')  # Loopback unless the settings file opens it up
+    token = settings.get('ws_token') or secrets.token_urlsafe(16)
+    origins = settings.get('ws_origins', [])  # Web pages allowed to open the stream, e.g. http://localhost:3000
+    try:
+        stream = WebSocketStreamServer(host, int(ws_port), token=token, allowed_origins=origins).start()
+    except (OSError, ValueError) as e:
+        print(Fore.RED + f"Cannot start WebSocket stream on {host}:{ws_port}: {e}" + Style.RESET_ALL)
+        logging.error(f"Cannot start WebSocket stream on {host}:{ws_port}: {e}")
+        return None
+    print(Fore.GREEN + f"Streaming traffic on ws://{host}:{stream.port}/ (write token: {token})" + Style.RESET_ALL)
+    return stream
+
+# Function to read the report-by-exception deadbands for published tags from the settings file
+def report_options(settings):
+    settings = settings or {}
+    return {
+        'deadband': float(settings.get('rbe_deadband', 0.0)),  # Any change is reported by default
+        'percent': bool(settings.get('rbe_percent', False)),
+        'min_deadband': float(settings.get('rbe_min_deadband', 1.0)),  # Floor for percent deadbands near 0
+        'max_silence': float(settings.get('rbe_max_silence', 60.0)),  # Heartbeat for unchanged tags
+    }
+
+# Function to send bytes written by a WebSocket client to the open serial port
+def write_from_stream(ser, port, data, sink=None):
+    if port != ser.port:
+        logging.warning(f"WebSocket write to {port} ignored: only {ser.port} is open")
+        return
+    sent = write_frame(ser, data)
+    logging.info(f"Sent WebSocket data: {data.hex(' ')} ({sent.timing()})", extra={'frame': sent})  # Log sent data
+    publish(sink, sent)  # The response arrives through read_device_responses
+
 # Function to read responses from the connected device
-def read_device_responses(ser, timeout=1):
-    start_time = time.time()
+def read_device_responses(ser, timeout=1, sink=None):
     while True:
-        if ser.in_waiting > 0:  # Check if there is data waiting to be read
-            response = ser.read(ser.in_waiting).decode('utf-8')  # Read and decode the response
-            logging.info(f"Received data: {response}")  # Log received data
-            print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
-        elif time.time() - start_time > timeout:
+        frame = read_frame(ser, timeout)
+        if frame is None:
             print(Fore.YELLOW + "No response received within the timeout period." + Style.RESET_ALL)
             break
+        publish(sink, frame)  # Forward the raw frame, e.g. to an MqttSink or WebSocketStreamServer
+        response = frame.data.decode('utf-8', 'replace')  # Decode the response
+        logging.info(f"Received data: {response} ({frame.timing()})", extra={'frame': frame})  # Log received data
+        print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
 
 # Function to send text data with input validity
-def send_text_data(ser, timeout, retries=3):
+def send_text_data(ser, timeout, retries=3, sink=None):
     while retries > 0:
         text = input("Enter the text to send (ASCII or Unicode): ")
         if text.strip() != "":  # Check for empty text input
-            ser.write(text.encode('utf-8'))  # Send the text as bytes for UART
-            logging.info(f"Sent data: {text}")  # Log sent data
-            print(Fore.GREEN + "Data sent. Waiting for response..." + Style.RESET_ALL)
+            sent = write_frame(ser, text.encode('utf-8'))  # Send the text as bytes for UART
+            frame = read_frame(ser, timeout)  # Read before logging or printing, which could delay it
+            logging.info(f"Sent data: {text} ({sent.timing()})", extra={'frame': sent})  # Log sent data
+            print(Fore.GREEN + "Data sent." + Style.RESET_ALL)
             response_received = False
-            
-            # Wait for a response with a timeout
-            start_time = time.time()
-            while time.time() - start_time < timeout:  # Use the defined timeout
-                if ser.in_waiting > 0:
-                    response = ser.read(ser.in_waiting).decode('utf-8')  # Read and decode the response
-            # Wait for a response with a timeout
-            start_time = time.time()
-            while time.time() - start_time < timeout:  # Use the defined timeout
-                if ser.in_waiting > 0:
-                    response = ser.read(ser.in_waiting).decode('utf-8')  # Read and decode the response
-                    logging.info(f"Received data: {response}")  # Log received data
-                    print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
-                    response_received = True
-                    break
+            publish(sink, sent, frame)
+            if frame is not None:
+                latency.add_exchange(sent, frame)
+                response = frame.data.decode('utf-8', 'replace')
+                logging.info(f"Received data: {response} ({frame.timing(sent)})", extra={'frame': frame})  # Log received data
+                print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
+                response_received = True
             
             if not response_received:
                 retries -= 1
@@ -338,26 +442,24 @@ def send_text_data(ser, timeout, retries=3):
             print(Fore.RED + "Text cannot be empty. Please enter valid text." + Style.RESET_ALL)
 
 # Function to send I2C data
-def send_i2c_data(ser, timeout, retries=3):
+def send_i2c_data(ser, timeout, retries=3, sink=None):
 
     while retries > 0:
         data = input("Enter the I2C data to send (in hex format, e.g., 0xFF): ")
         try:
             data_bytes = bytes.fromhex(data.replace("0x", ""))
-            ser.write(data_bytes)
-            logging.info(f"Sent I2C data: {data}")  # Log sent data
-            print(Fore.GREEN + "I2C data sent. Waiting for response..." + Style.RESET_ALL)
+            sent = write_frame(ser, data_bytes)
+            frame = read_frame(ser, timeout)  # Read before logging or printing, which could delay it
+            logging.info(f"Sent I2C data: {data} ({sent.timing()})", extra={'frame': sent})  # Log sent data
+            print(Fore.GREEN + "I2C data sent." + Style.RESET_ALL)
             response_received = False
-            
-            # Wait for a response with a timeout
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                if ser.in_waiting > 0:
-                    response = ser.read(ser.in_waiting).decode('utf-8')
-                    logging.info(f"Received data: {response}")  # Log received data
-                    print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
-                    response_received = True
-                    break
+            publish(sink, sent, frame)
+            if frame is not None:
+                latency.add_exchange(sent, frame)
+                response = frame.data.decode('utf-8', 'replace')
+                logging.info(f"Received data: {response} ({frame.timing(sent)})", extra={'frame': frame})  # Log received data
+                print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
+                response_received = True
             
             if not response_received:
                 retries -= 1
@@ -369,26 +471,24 @@ def send_i2c_data(ser, timeout, retries=3):
             print(Fore.RED + "Invalid input! Please enter valid hex data." + Style.RESET_ALL)
 
 # Function to send SPI data
-def send_spi_data(ser, timeout, retries=3):
+def send_spi_data(ser, timeout, retries=3, sink=None):
 
     while retries > 0:
         data = input("Enter the SPI data to send (in hex format, e.g., 0xFF): ")
         try:
             data_bytes = bytes.fromhex(data.replace("0x", ""))
-            ser.write(data_bytes)
-            logging.info(f"Sent SPI data: {data}")  # Log sent data
-            print(Fore.GREEN + "SPI data sent. Waiting for response..." + Style.RESET_ALL)
+            sent = write_frame(ser, data_bytes)
+            frame = read_frame(ser, timeout)  # Read before logging or printing, which could delay it
+            logging.info(f"Sent SPI data: {data} ({sent.timing()})", extra={'frame': sent})  # Log sent data
+            print(Fore.GREEN + "SPI data sent." + Style.RESET_ALL)
             response_received = False
-            
-            # Wait for a response with a timeout
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                if ser.in_waiting > 0:
-                    response = ser.read(ser.in_waiting).decode('utf-8')
-                    logging.info(f"Received data: {response}")  # Log received data
-                    print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
-                    response_received = True
-                    break
+            publish(sink, sent, frame)
+            if frame is not None:
+                latency.add_exchange(sent, frame)
+                response = frame.data.decode('utf-8', 'replace')
+                logging.info(f"Received data: {response} ({frame.timing(sent)})", extra={'frame': frame})  # Log received data
+                print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
+                response_received = True
             
             if not response_received:
                 retries -= 1
@@ -400,25 +500,23 @@ def send_spi_data(ser, timeout, retries=3):
             print(Fore.RED + "Invalid input! Please enter valid hex data." + Style.RESET_ALL)
 
 # Function to send RS232 data
-def send_rs232_data(ser, timeout, retries=3):
+def send_rs232_data(ser, timeout, retries=3, sink=None):
 
     while retries > 0:
         data = input("Enter the RS232 data to send: ")
         if data.strip() != "":
-            ser.write(data.encode('utf-8'))
-            logging.info(f"Sent RS232 data: {data}")  # Log sent data
-            print(Fore.GREEN + "RS232 data sent. Waiting for response..." + Style.RESET_ALL)
+            sent = write_frame(ser, data.encode('utf-8'))
+            frame = read_frame(ser, timeout)  # Read before logging or printing, which could delay it
+            logging.info(f"Sent RS232 data: {data} ({sent.timing()})", extra={'frame': sent})  # Log sent data
+            print(Fore.GREEN + "RS232 data sent." + Style.RESET_ALL)
             response_received = False
-            
-            # Wait for a response with a timeout
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                if ser.in_waiting > 0:
-                    response = ser.read(ser.in_waiting).decode('utf-8')
-                    logging.info(f"Received data: {response}")  # Log received data
-                    print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
-                    response_received = True
-                    break
+            publish(sink, sent, frame)
+            if frame is not None:
+                latency.add_exchange(sent, frame)
+                response = frame.data.decode('utf-8', 'replace')
+                logging.info(f"Received data: {response} ({frame.timing(sent)})", extra={'frame': frame})  # Log received data
+                print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
+                response_received = True
             
             if not response_received:
                 retries -= 1
@@ -430,25 +528,23 @@ def send_rs232_data(ser, timeout, retries=3):
             print(Fore.RED + "Data cannot be empty. Please enter valid data." + Style.RESET_ALL)
 
 # Function to send RS485 data
-def send_rs485_data(ser, timeout, retries=3):
+def send_rs485_data(ser, timeout, retries=3, sink=None):
 
     while retries > 0:
         data = input("Enter the RS485 data to send: ")
         if data.strip() != "":
-            ser.write(data.encode('utf-8'))
-            logging.info(f"Sent RS485 data: {data}")  # Log sent data
-            print(Fore.GREEN + "RS485 data sent. Waiting for response..." + Style.RESET_ALL)
+            sent = write_frame(ser, data.encode('utf-8'))
+            frame = read_frame(ser, timeout)  # Read before logging or printing, which could delay it
+            logging.info(f"Sent RS485 data: {data} ({sent.timing()})", extra={'frame': sent})  # Log sent data
+            print(Fore.GREEN + "RS485 data sent." + Style.RESET_ALL)
             response_received = False
-            
-            # Wait for a response with a timeout
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                if ser.in_waiting > 0:
-                    response = ser.read(ser.in_waiting).decode('utf-8')
-                    logging.info(f"Received data: {response}")  # Log received data
-                    print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
-                    response_received = True
-                    break
+            publish(sink, sent, frame)
+            if frame is not None:
+                latency.add_exchange(sent, frame)
+                response = frame.data.decode('utf-8', 'replace')
+                logging.info(f"Received data: {response} ({frame.timing(sent)})", extra={'frame': frame})  # Log received data
+                print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
+                response_received = True
             
             if not response_received:
                 retries -= 1
@@ -460,25 +556,23 @@ def send_rs485_data(ser, timeout, retries=3):
             print(Fore.RED + "Data cannot be empty. Please enter valid data." + Style.RESET_ALL)
 
 # Function to send TTL data
-def send_ttl_data(ser, timeout, retries=3):
+def send_ttl_data(ser, timeout, retries=3, sink=None):
 
     while retries > 0:
         data = input("Enter the TTL data to send: ")
         if data.strip() != "":
-            ser.write(data.encode('utf-8'))
-            logging.info(f"Sent TTL data: {data}")  # Log sent data
-            print(Fore.GREEN + "TTL data sent. Waiting for response..." + Style.RESET_ALL)
+            sent = write_frame(ser, data.encode('utf-8'))
+            frame = read_frame(ser, timeout)  # Read before logging or printing, which could delay it
+            logging.info(f"Sent TTL data: {data} ({sent.timing()})", extra={'frame': sent})  # Log sent data
+            print(Fore.GREEN + "TTL data sent." + Style.RESET_ALL)
             response_received = False
-            
-            # Wait for a response with a timeout
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                if ser.in_waiting > 0:
-                    response = ser.read(ser.in_waiting).decode('utf-8')
-                    logging.info(f"Received data: {response}")  # Log received data
-                    print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
-                    response_received = True
-                    break
+            publish(sink, sent, frame)
+            if frame is not None:
+                latency.add_exchange(sent, frame)
+                response = frame.data.decode('utf-8', 'replace')
+                logging.info(f"Received data: {response} ({frame.timing(sent)})", extra={'frame': frame})  # Log received data
+                print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
+                response_received = True
             
             if not response_received:
                 retries -= 1
@@ -490,25 +584,23 @@ def send_ttl_data(ser, timeout, retries=3):
             print(Fore.RED + "Data cannot be empty. Please enter valid data." + Style.RESET_ALL)
 
 # Function to send Control Command data
-def send_control_command(ser, timeout, retries=3):
+def send_control_command(ser, timeout, retries=3, sink=None):
 
     while retries > 0:
         command = input("Enter the control command to send: ")
         if command.strip() != "":
-            ser.write(command.encode('utf-8'))
-            logging.info(f"Sent control command: {command}")  # Log sent data
-            print(Fore.GREEN + "Control command sent. Waiting for response..." + Style.RESET_ALL)
+            sent = write_frame(ser, command.encode('utf-8'))
+            frame = read_frame(ser, timeout)  # Read before logging or printing, which could delay it
+            logging.info(f"Sent control command: {command} ({sent.timing()})", extra={'frame': sent})  # Log sent data
+            print(Fore.GREEN + "Control command sent." + Style.RESET_ALL)
             response_received = False
-            
-            # Wait for a response with a timeout
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                if ser.in_waiting > 0:
-                    response = ser.read(ser.in_waiting).decode('utf-8')
-                    logging.info(f"Received data: {response}")  # Log received data
-                    print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
-                    response_received = True
-                    break
+            publish(sink, sent, frame)
+            if frame is not None:
+                latency.add_exchange(sent, frame)
+                response = frame.data.decode('utf-8', 'replace')
+                logging.info(f"Received data: {response} ({frame.timing(sent)})", extra={'frame': frame})  # Log received data
+                print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
+                response_received = True
             
             if not response_received:
                 retries -= 1
@@ -519,6 +611,164 @@ def send_control_command(ser, timeout, retries=3):
         else:
             print(Fore.RED + "Command cannot be empty. Please enter a valid command." + Style.RESET_ALL)
 
+# Function to send Omron Host Link commands
+def send_hostlink_command(ser, timeout, retries=3, fins=False, sink=None):
+    host_link = HostLink(ser, timeout=timeout)
+    while retries > 0:
+        if fins:
+            command = input("Enter the FINS command and text in hex (e.g., 0101 82006400 0001): ")
+        else:
+            command = input("Enter the Host Link command (e.g., RD 0100 0010, WD 0100 1234, MS): ")
+        parts = command.split()
+        if not parts:
+            print(Fore.RED + "Command cannot be empty. Please enter a valid command." + Style.RESET_ALL)
+            continue
+        try:
+            if fins:
+                text = bytes.fromhex(''.join(parts))
+                response = host_link.fins(text[:2], text[2:]).hex().upper()
+            elif parts[0].upper() in ('RD', 'RR', 'RH', 'RL', 'RJ') and len(parts) == 3:
+                area = {'RD': 'DM', 'RR': 'CIO', 'RH': 'HR', 'RL': 'LR', 'RJ': 'AR'}[parts[0].upper()]
+                response = host_link.read_words(area, int(parts[1]), int(parts[2]))
+                if sink is not None:
+                    sink.publish_tags(ser.port, {f"{area}{int(parts[1]) + i}": value for i, value in enumerate(response)})
+            else:
+                response = host_link.command(parts[0].upper(), ''.join(parts[1:]))
+            logging.info(f"Sent Host Link command: {command}")  # Log sent data
+            logging.info(f"Received data: {response}")  # Log received data
+            print(Fore.GREEN + f"Response from device: {response}" + Style.RESET_ALL)
+            break
+        except ValueError:
+            print(Fore.RED + "Invalid input! Please enter a valid command." + Style.RESET_ALL)
+        except HostLinkError as e:
+            retries -= 1
+            logging.error(f"Host Link error: {e}")
+            print(Fore.RED + f"Host Link error: {e}. You have {retries} retries left." + Style.RESET_ALL)
+
+# Function to read EtherNet/IP tags, batched into Multiple Service Packets
+def send_enip_read(timeout, retries=3):
+    host = input("Enter the PLC IP address: ").strip()
+    slot = input("Enter the controller slot (blank for none, e.g. Omron NJ/NX): ").strip()
+    client = None
+    while retries > 0:
+        tags = input("Enter the tag names separated by spaces: ").split()
+        if not tags:
+            print(Fore.RED + "Tag names cannot be empty. Please enter at least one tag." + Style.RESET_ALL)
+            continue
+        try:
+            if client is None:
+                client = CipClient(host, slot=int(slot) if slot else None, timeout=timeout).connect()
+            values = client.read(tags)
+            logging.info(f"Read EtherNet/IP tags: {values}")  # Log received data
+            for name, value in values.items():
+                print(Fore.GREEN + f"{name} = {value}" + Style.RESET_ALL)
+            break
+        except ValueError as e:
+            print(Fore.RED + f"Invalid input! {e}" + Style.RESET_ALL)
+        except (CipError, OSError) as e:
+            retries -= 1
+            logging.error(f"EtherNet/IP error: {e}")
+            print(Fore.RED + f"EtherNet/IP error: {e}. You have {retries} retries left." + Style.RESET_ALL)
+            if client is not None:
+                client.close()
+                client = None
+    if client is not None:
+        client.close()
+
+# Function to forward bytes both ways between two serial ports until Enter is pressed
+def run_port_bridge(port, baudrate, capture=None, sink=None):
+    print("Available serial ports:")
+    for device, description in list_serial_ports():
+        print(f"- {device}: {description}")
+    while True:
+        other = input("Enter the second serial port to bridge to: ").strip()
+        if other and other != port:
+            break
+        print(Fore.RED + "Enter a serial port other than the first one." + Style.RESET_ALL)
+    settings_b = {'baudrate': baudrate}
+    try:
+        settings_b['baudrate'] = int(input(f"Enter baud rate for {other} (default: {baudrate}): ") or baudrate)
+        framing = input("Enter framing for it, e.g. 8N1, 7E1, 8E2 (default: 8N1): ").strip().upper() or '8N1'
+        settings_b.update(bytesize=int(framing[0]), parity=framing[1], stopbits=float(framing[2:]))
+        bridge = PortBridge(port, other, {'baudrate': baudrate}, settings_b, sink=sink, capture=capture).start()
+    except (ValueError, IndexError) as e:
+        print(Fore.RED + f"Invalid bridge settings: {e}" + Style.RESET_ALL)
+        return
+    except serial.SerialException as e:
+        print(Fore.RED + f"Error opening serial port: {e}" + Style.RESET_ALL)
+        return
+    print(Fore.GREEN + f"Bridging {port} <-> {other}. Press Enter to stop." + Style.RESET_ALL)
+    try:
+        input()
+    except KeyboardInterrupt:
+        pass
+    bridge.close()
+    print(Fore.YELLOW + f"Bridge stopped: {bridge.stats['a_to_b']} bytes {port} -> {other}, "
+          f"{bridge.stats['b_to_a']} bytes {other} -> {port}." + Style.RESET_ALL)
+
+# Function to listen to an RS485 line and print decoded request/response pairs until Enter is pressed
+def run_bus_sniffer(port, baudrate, capture=None, sink=None):
+    def show_transaction(request, response, latency_ns):
+        fields = response.fields
+        what = fields.get('function', fields.get('header'))
+        color = Fore.RED if 'exception' in fields else Fore.GREEN
+        print(color + f"{fields['protocol']} unit {fields['unit']} {what}: {request.data.hex(' ')} -> "
+              f"{response.data.hex(' ')} ({latency_ns / 1e6:.2f} ms)" + Style.RESET_ALL)
+
+    try:
+        sniffer = BusSniffer(port, baudrate, on_transaction=show_transaction, sink=sink,
+                             capture=capture).start()
+    except serial.SerialException as e:
+        print(Fore.RED + f"Error opening serial port: {e}" + Style.RESET_ALL)
+        return
+    print(Fore.GREEN + f"Sniffing {port} at {baudrate} baud. Press Enter to stop." + Style.RESET_ALL)
+    try:
+        input()
+    except KeyboardInterrupt:
+        pass
+    sniffer.close()
+    stats = sniffer.stats
+    print(Fore.YELLOW + f"Sniffer stopped: {stats['frames']} frames, {stats['transactions']} transactions, "
+          f"{stats['undecoded']} undecoded, drops {sniffer.drop_report()}." + Style.RESET_ALL)
+
+# Function to replay recorded traffic into a serial port or a new pty
+def run_replay():
+    path = input("Enter the capture file to replay: ").strip()
+    try:
+        counts = capture_ports(path)
+    except (OSError, IOError) as e:
+        print(Fore.RED + f"Cannot read capture file: {e}" + Style.RESET_ALL)
+        return
+    for (port, direction), count in sorted(counts.items()):
+        print(f"- {port} {direction}: {count} frames")
+    torn = torn_tail(path)
+    if torn:
+        print(Fore.YELLOW + f"The capture ends with {torn} bytes of a torn record (cut short by a crash?); "
+              f"every complete frame before it will be replayed." + Style.RESET_ALL)
+    ports = input("Enter the recorded port(s) to replay, separated by spaces (blank for all): ").split()
+    directions = input("Enter the direction(s) to replay, rx and/or tx (default: rx): ").split() or ['rx']
+    target = input("Enter the serial port to replay into (blank for a new pty): ").strip() or None
+    speed_input = input("Enter the speed factor, e.g. 1, 2, 0.5, or 0 for as fast as possible (default: 1): ").strip()
+    try:
+        speed = float(speed_input or 1) or None
+        settings = {'baudrate': int(input("Enter baud rate (default: 115200): ") or 115200)} if target else None
+        replayer = Replayer(path, target, ports=ports, directions=directions, speed=speed, settings=settings)
+    except ValueError as e:
+        print(Fore.RED + f"Invalid input! {e}" + Style.RESET_ALL)
+        return
+    except serial.SerialException as e:
+        print(Fore.RED + f"Error opening serial port: {e}" + Style.RESET_ALL)
+        return
+    if target is None:
+        input(Fore.GREEN + f"Replay pty is {replayer.port}. Open it in the software under test, then press Enter." + Style.RESET_ALL)
+    print(Fore.GREEN + "Replaying..." + Style.RESET_ALL)
+    try:
+        report = replayer.run()
+    except KeyboardInterrupt:
+        report = replayer.drift_report()
+    replayer.close()
+    print(Fore.YELLOW + f"Replay finished: {report}" + Style.RESET_ALL)
+
 # Main function to handle program flow with validation
 def main():
     print(r"""
@@ -552,6 +802,7 @@ Feature/Protocol Overview:
 
 """)
     
+    loaded_settings = None
     load_settings_prompt = input("Do you want to load the settings file? (y/n): ").strip().lower()
     if load_settings_prompt == 'y':
         loaded_settings = load_settings()
@@ -566,6 +817,9 @@ Feature/Protocol Overview:
 
     display_banner()
     protocol = choose_data_type()
+    if protocol == '13':
+        run_replay()  # Replay needs no live port settings
+        return
     retries = 3  # Initialize retries with a default value
     retries = int(input("Enter the number of retries (default: 3): ") or retries)
 
@@ -575,6 +829,27 @@ Feature/Protocol Overview:
         port, baudrate, timeout = get_serial_settings(protocol)
         save_settings(port, baudrate, timeout)
 
+    capture = None
+    capture_path = input("Record traffic to a capture file (path, blank for none): ").strip()
+    if capture_path:
+        capture = ArchiveWriter(capture_path)  # Appends, and keeps capture_path + '.idx' for seeking
+        logging.info(f"Recording traffic to {capture_path} (search it with: python traffic_query.py {capture_path} --help)")
+
+    stream = open_ws_stream(loaded_settings)
+    sink = ReportByExceptionSink(Sinks(open_mqtt_sink(loaded_settings), stream), **report_options(loaded_settings))
+
+    if protocol in ('11', '12'):
+        if protocol == '11':
+            run_port_bridge(port, baudrate, capture, sink)  # The bridge opens both ports itself
+        else:
+            run_bus_sniffer(port, baudrate, capture, sink)  # Listen only: never write to a shared RS485 line
+        if capture is not None:
+            capture.close()
+        sink.close()
+        return
+    if capture is not None:
+        logging.getLogger().addHandler(CaptureHandler(capture))  # Records every frame logged with extra={'frame': ...}
+
     while True:
         try:
             ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)
@@ -588,36 +863,55 @@ Feature/Protocol Overview:
                     print(Fore.RED + "Serial port cannot be empty. Please enter a valid serial port. Type 'help' for more information." + Style.RESET_ALL)
                     continue
 
-    response_thread = threading.Thread(target=read_device_responses, args=(ser, timeout))
+    if stream is not None:
+        stream.on_command = lambda write_port, data: write_from_stream(ser, write_port, data, sink)
+    response_thread = threading.Thread(target=read_device_responses, args=(ser, timeout, sink))
     response_thread.daemon = True
     response_thread.start()
 
     while True:
         if protocol in ['1', '2', '3', '4', '5', '6', '7']:
 
-            send_text_data(ser, timeout, retries)
+            send_text_data(ser, timeout, retries, sink)
         elif protocol == '2':
-            send_i2c_data(ser, timeout, retries)
+            send_i2c_data(ser, timeout, retries, sink)
         elif protocol == '3':
-            send_spi_data(ser, timeout, retries)
+            send_spi_data(ser, timeout, retries, sink)
         elif protocol == '4':
-            send_rs232_data(ser, timeout, retries)
+            send_rs232_data(ser, timeout, retries, sink)
         elif protocol == '5':
-            send_rs485_data(ser, timeout, retries)
+            send_rs485_data(ser, timeout, retries, sink)
         elif protocol == '6':
-            send_ttl_data(ser, timeout, retries)
+            send_ttl_data(ser, timeout, retries, sink)
         elif protocol == '7':
-            send_control_command(ser, timeout, retries)
+            send_control_command(ser, timeout, retries, sink)
         elif protocol == '8':
-            send_text_data(ser, timeout, retries)  # Example for additional functionality
+            omron_protocol = choose_omron_protocol().strip()
+            if omron_protocol == '5':
+                send_hostlink_command(ser, timeout, retries, sink=sink)
+            elif omron_protocol == '2':
+                send_hostlink_command(ser, timeout, retries, fins=True, sink=sink)  # FINS over serial Host Link
+            elif omron_protocol == '3':
+                send_enip_read(timeout, retries)
+            else:
+                send_text_data(ser, timeout, retries, sink)  # Example for additional functionality
         elif protocol == '9':
-            send_i2c_data(ser, timeout, retries)  # Example for additional functionality
+            modicon_protocol = choose_modicon_protocol().strip()
+            if modicon_protocol == '3':
+                send_enip_read(timeout, retries)
+            else:
+                send_i2c_data(ser, timeout, retries, sink)  # Raw hex frames, e.g. Modbus RTU
         elif protocol == '10':
-            send_spi_data(ser, timeout, retries)  # Example for additional functionality
+            send_spi_data(ser, timeout, retries, sink)  # Example for additional functionality
 
 
         again = input("Do you want to send more data? (y/n): ").strip().lower()
         if again != 'y':
+            if latency.count:
+                print(Fore.YELLOW + f"Response latency (ms): {latency.report()}" + Style.RESET_ALL)
+            if capture is not None:
+                capture.close()
+            sink.close()  # Flush queued MQTT messages and disconnect WebSocket clients
             print(Fore.YELLOW + "Exiting program." + Style.RESET_ALL)
             break
 
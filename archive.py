@@ -0,0 +1,367 @@
+import datetime
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from capture import (CHECKPOINT, HAS_DONE, MAGIC, MAX_DATA, PORT_NAME, RECORD, SESSION, SESSION_START, TX,
+                     CaptureError, CaptureWriter, iter_capture)
+from frames import Frame
+
+INDEX_MAGIC = b'UCBIDX\x00\x01'
+INDEX_HEADER = struct.Struct('<8sII')  # Magic, stride, reserved
+INDEX_ENTRY = struct.Struct('<QqQ')  # Frame number, wall-clock ns of that frame, byte offset of its checkpoint
+INDEX_DTYPE = np.dtype([('frame', '<u8'), ('wall_ns', '<i8'), ('offset', '<u8')])
+FRAME_NUMBER = struct.Struct('<Q')
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+class ArchiveWriter(CaptureWriter):
+    """Capture writer that keeps a seek index next to the archive.
+
+    Before the first frame of every run and then every stride frames, a
+    CHECKPOINT record carrying the next frame's number is written,
+    followed by the session clock record and a declaration of every port
+    seen so far, so a reader dropped at that offset has all the state it
+    needs without looking further back. Each checkpoint also adds a
+    fixed-size entry to the index sidecar (path + '.idx'): frame number,
+    wall-clock time of that frame, and the checkpoint's byte offset. Both
+    columns grow monotonically, so the sidecar can be binary searched by
+    frame number or by time. Restating the ports costs a few dozen bytes
+    per checkpoint, well under 1% at the default stride.
+
+    Appending to an existing archive continues its frame numbering; a
+    missing index is rebuilt from the checkpoints first. A record torn by
+    a crash is cut off before appending (see CaptureWriter), along with
+    index entries that point at or past the cut and a torn index entry.
+    """
+
+    def __init__(self, path, stride=1024, buffer_size=1 << 20, flush_interval=1.0):
+        self.path = path
+        self.stride = stride
+        self.next_frame = 0
+        if os.path.exists(path) and os.path.getsize(path) > len(MAGIC):
+            if not os.path.exists(index_path(path)) or os.path.getsize(index_path(path)) < INDEX_HEADER.size:
+                rebuild_index(path, stride)  # The writer owns the index, so it may rewrite it
+            self._truncate_torn_tail(path)
+            _trim_index(path, os.path.getsize(path))
+            with ArchiveReader(path) as reader:
+                self.next_frame = len(reader)
+        elif os.path.exists(index_path(path)):
+            os.remove(index_path(path))
+        self._since_checkpoint = None  # None: checkpoint before the next frame
+        self._index = open(index_path(path), 'ab', buffering=64 * 1024)
+        if self._index.tell() == 0:
+            self._index.write(INDEX_HEADER.pack(INDEX_MAGIC, stride, 0))
+        super().__init__(path, buffer_size, flush_interval)
+        wall_ns, mono_ns = SESSION.unpack(self._session[RECORD.size:])
+        self._offset_ns = wall_ns - mono_ns
+
+    def _resume_offset(self, data):
+        """The last indexed checkpoint inside data, so cutting a torn tail walks at most one stride."""
+        offsets = load_index(self.path)[1]['offset']
+        offsets = offsets[offsets < len(data)]
+        return int(offsets[-1]) if len(offsets) else len(MAGIC)
+
+    def _checkpoint(self, frame):
+        offset = self._file.tell()
+        self._file.write(RECORD.pack(0, 0, 0, FRAME_NUMBER.size, 0, CHECKPOINT) + FRAME_NUMBER.pack(self.next_frame))
+        self._file.write(self._session)
+        for port, port_id in self._ports.items():
+            name = str(port).encode('utf-8')
+            self._file.write(RECORD.pack(0, 0, 0, len(name), port_id, PORT_NAME) + name)
+        self._index.write(INDEX_ENTRY.pack(self.next_frame, frame.first_ns + self._offset_ns, offset))
+        self._since_checkpoint = 0
+
+    def _append(self, frame):
+        if self._since_checkpoint is None or self._since_checkpoint >= self.stride:
+            self._port_id(frame.port)  # Declare a new port before the checkpoint so it is restated there
+            self._checkpoint(frame)
+        records = max(1, -(-len(frame.data) // MAX_DATA))
+        super()._append(frame)
+        self.next_frame += records
+        self._since_checkpoint += records
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+            self._index.flush()  # After the data, so the index never points past what is on disk
+
+    def close(self):
+        super().close()
+        self._index.close()
+
+
+def index_entries(data):
+    """Yield (frame number, wall ns, offset) index entries from the CHECKPOINT records of mapped archive data."""
+    offset, size = len(MAGIC), len(data)
+    header_size = RECORD.size
+    checkpoint = None
+    offset_ns = 0
+    while offset + header_size <= size:
+        first_ns, _, _, length, _, flags = RECORD.unpack_from(data, offset)
+        if offset + header_size + length > size:
+            return  # Torn last record
+        if flags & CHECKPOINT:
+            checkpoint = (FRAME_NUMBER.unpack_from(data, offset + header_size)[0], offset)
+        elif flags & SESSION_START:
+            wall_ns, mono_ns = SESSION.unpack_from(data, offset + header_size)
+            offset_ns = wall_ns - mono_ns
+        elif not flags & PORT_NAME and checkpoint is not None:
+            yield checkpoint[0], first_ns + offset_ns, checkpoint[1]
+            checkpoint = None
+        offset += header_size + length
+
+
+def rebuild_index(path, stride=1024):
+    """Write path's index sidecar from the CHECKPOINT records in the archive itself."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:len(MAGIC)] != MAGIC:
+            raise CaptureError(f"{path} is not a capture file")
+        with open(index_path(path), 'wb') as index:
+            index.write(INDEX_HEADER.pack(INDEX_MAGIC, stride, 0))
+            for entry in index_entries(data):
+                index.write(INDEX_ENTRY.pack(*entry))
+
+
+def load_index(path):
+    """(stride, entries) from path's index sidecar, the entries memory-mapped; a torn last entry is left out."""
+    raw = np.memmap(index_path(path), dtype=np.uint8, mode='r')
+    magic, stride, _ = INDEX_HEADER.unpack(raw[:INDEX_HEADER.size].tobytes())
+    if magic != INDEX_MAGIC:
+        raise CaptureError(f"{index_path(path)} is not an archive index")
+    count = (len(raw) - INDEX_HEADER.size) // INDEX_DTYPE.itemsize
+    return stride, np.ndarray(count, dtype=INDEX_DTYPE, buffer=raw, offset=INDEX_HEADER.size)
+
+
+def _trim_index(path, size):
+    """Cut index entries for checkpoints at or past byte size of the archive, and a torn last entry."""
+    entries = load_index(path)[1]
+    keep = int(np.searchsorted(entries['offset'], size))
+    del entries
+    end = INDEX_HEADER.size + keep * INDEX_DTYPE.itemsize
+    if os.path.getsize(index_path(path)) != end:
+        os.truncate(index_path(path), end)
+
+
+def scan_records(data, offset=len(MAGIC), number=-1, ports=None, directions=None, since_ns=None, until_ns=None,
+                 pattern=None, slack_ns=1_000_000_000, end=None):
+    """Yield (frame number, Frame, wall-clock ns) for the records of a mapped capture from offset on.
+
+    number is the number of the frame before the first one at offset.
+    ports (names), directions ('rx'/'tx') and the wall-clock window
+    since_ns..until_ns are checked against the record header, and pattern
+    (bytes the data must contain) against the mapped data, before any
+    Frame is built or any data copied, which is what keeps a filtered scan
+    cheap. The scan ends once frames are more than slack_ns past until_ns;
+    the slack covers frames from concurrent writers landing slightly out
+    of time order. end, if given, is the offset to stop at instead of the
+    end of data.
+    """
+    size = len(data) if end is None else end
+    header_size = RECORD.size
+    unpack = RECORD.unpack_from
+    names = {}
+    wanted = None if ports is None else set()
+    flag_values = None if directions is None else {TX if direction == 'tx' else 0 for direction in directions}
+    stop_ns = until_ns + slack_ns if until_ns is not None else None
+    offset_ns = 0
+    while offset + header_size <= size:
+        first_ns, last, done, length, port_id, flags = unpack(data, offset)
+        start = offset + header_size
+        offset = start + length
+        if offset > size:
+            return  # Torn last record
+        if flags & (CHECKPOINT | SESSION_START | PORT_NAME):
+            if flags & CHECKPOINT:
+                number = FRAME_NUMBER.unpack_from(data, start)[0] - 1
+            elif flags & SESSION_START:
+                wall_ns, mono_ns = SESSION.unpack_from(data, start)
+                offset_ns = wall_ns - mono_ns
+            else:
+                name = names[port_id] = data[start:offset].decode('utf-8')
+                if wanted is not None:
+                    if name in ports:
+                        wanted.add(port_id)
+                    else:
+                        wanted.discard(port_id)
+            continue
+        number += 1
+        if wanted is not None and port_id not in wanted:
+            continue
+        if flag_values is not None and flags & TX not in flag_values:
+            continue
+        wall_ns = first_ns + offset_ns
+        if since_ns is not None and wall_ns < since_ns:
+            continue
+        if stop_ns is not None and wall_ns > until_ns:
+            if wall_ns > stop_ns:
+                return
+            continue
+        if pattern is not None and data.find(pattern, start, offset) < 0:
+            continue
+        yield (number, Frame(names.get(port_id, port_id), data[start:offset], 'tx' if flags & TX else 'rx',
+                             first_ns, first_ns + last, first_ns + done if flags & HAS_DONE else None), wall_ns)
+
+
+def parse_time(text, reference_ns):
+    """Wall-clock ns for a time such as '10:42:17.300' (on reference_ns's local date) or an ISO date-time."""
+    try:
+        moment = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        clock = datetime.time.fromisoformat(text)
+        day = datetime.datetime.fromtimestamp(reference_ns / 1e9).date()
+        moment = datetime.datetime.combine(day, clock)
+    return int(moment.timestamp() * 1e9)
+
+
+class ArchiveReader:
+    """Random access to an archive through mmap and its index sidecar.
+
+    seek_frame(n) and seek_time(t) binary search the index (numpy
+    searchsorted over the memory-mapped sidecar, so only the pages the
+    search touches are read), land on a checkpoint and walk at most one
+    stride of records from there. Iteration yields (frame number, Frame,
+    wall-clock ns of the first byte) and decodes records straight out of
+    the mapped file, so reading from frame 5,000,000 costs the same as
+    reading from frame 0. Entries that point past a torn end of file are
+    ignored, and frames after the last indexed checkpoint are still
+    reached by walking on from it, since the walk follows the checkpoints
+    in the data.
+
+    A reader never writes: a missing or empty index is built in memory
+    from the checkpoints, and only written to the sidecar with
+    rebuild=True, so opening a live recording cannot clobber the index its
+    ArchiveWriter is appending to.
+    """
+
+    def __init__(self, path, rebuild=False):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise CaptureError(f"{path} is not a capture file")
+        if os.path.exists(index_path(path)) and os.path.getsize(index_path(path)) >= INDEX_HEADER.size:
+            self.stride, index = load_index(path)
+        else:
+            self.stride, index = 0, np.zeros(0, dtype=INDEX_DTYPE)
+        if not len(index):
+            if rebuild:
+                rebuild_index(path)
+                self.stride, index = load_index(path)
+            else:
+                index = np.array(list(index_entries(self._data)), dtype=INDEX_DTYPE)
+        valid = int(np.searchsorted(index['offset'], len(self._data)))  # Drop entries past a torn end of file
+        self.index = index[:valid]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.index = None
+        self._data.close()
+        self._file.close()
+
+    def __len__(self):
+        """Number of frames in the archive."""
+        if not len(self.index):
+            return 0
+        number = int(self.index['frame'][-1]) - 1
+        for number, _, _ in self._iter_from(len(self.index) - 1):
+            pass
+        return number + 1
+
+    def _iter_from(self, entry):
+        """Frames from index entry number entry onwards."""
+        return scan_records(self._data, int(self.index['offset'][entry]), int(self.index['frame'][entry]) - 1)
+
+    def seek_frame(self, number):
+        """Iterate from frame number onwards."""
+        entry = int(np.searchsorted(self.index['frame'], number, side='right')) - 1
+        if entry < 0:
+            raise IndexError(f"Frame {number} is before the start of {self.path}")
+        for item in self._iter_from(entry):
+            if item[0] >= number:
+                yield item
+
+    def seek_time(self, when):
+        """Iterate from the first frame at or after when: wall-clock ns, a datetime, or text for parse_time."""
+        if isinstance(when, str):
+            when = parse_time(when, int(self.index['wall_ns'][0]) if len(self.index) else time.time_ns())
+        elif isinstance(when, datetime.datetime):
+            when = int(when.timestamp() * 1e9)
+        entry = max(0, int(np.searchsorted(self.index['wall_ns'], when, side='right')) - 1)
+        for item in self._iter_from(entry):
+            if item[2] >= when:
+                yield item
+
+    def frame(self, number):
+        """One frame by number, as (number, Frame, wall ns)."""
+        for item in self.seek_frame(number):
+            return item
+        raise IndexError(f"Frame {number} is past the end of {self.path}")
+
+    def __iter__(self):
+        return self._iter_from(0) if len(self.index) else iter(())
+
+
+def benchmark(frames=5_200_000, rate=20000):
+    """Build a multi-million-frame archive, then time indexed seeks against a linear scan."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'traffic.ucbarc')
+    step_ns = 1_000_000_000 // rate
+    writer = ArchiveWriter(path)
+    start = time.perf_counter()
+    now = time.monotonic_ns()
+    payloads = [bytes([1 + unit, 3, 0, 100, 0, 10, 0x44, 0x0C]) for unit in range(8)]
+    ports = ['/dev/ttyUSB0', '/dev/ttyUSB1']
+    for i in range(frames):
+        frame_ns = now + i * step_ns
+        writer.write(Frame(ports[i & 1], payloads[i & 7], 'rx' if i & 2 else 'tx', frame_ns, frame_ns + 800_000))
+    writer.close()
+    write_s = time.perf_counter() - start
+    print(f"Wrote {frames} frames ({os.path.getsize(path) / 1e6:.0f} MB, index "
+          f"{os.path.getsize(index_path(path)) / 1e3:.0f} kB) in {write_s:.1f} s")
+
+    with ArchiveReader(path) as reader:
+        first_wall = next(iter(reader))[2]
+        target = 5_000_000 if frames > 5_000_000 else frames // 2
+        start = time.perf_counter()
+        number, frame, wall_ns = reader.frame(target)
+        seek_us = (time.perf_counter() - start) * 1e6
+        print(f"Frame {number}: {frame.port} {frame.direction} {frame.data.hex(' ')} found in {seek_us:.0f} us")
+
+        moment = datetime.datetime.fromtimestamp((first_wall + (wall_ns - first_wall) // 2) / 1e9)
+        text = moment.strftime('%H:%M:%S.%f')[:-3]
+        start = time.perf_counter()
+        number, frame, wall_ns = next(reader.seek_time(text))
+        seek_us = (time.perf_counter() - start) * 1e6
+        found = datetime.datetime.fromtimestamp(wall_ns / 1e9).strftime('%H:%M:%S.%f')
+        print(f"Time {text}: frame {number} at {found} found in {seek_us:.0f} us")
+
+        start = time.perf_counter()
+        count = len(reader)
+        print(f"len(): {count} frames in {(time.perf_counter() - start) * 1e6:.0f} us")
+
+    start = time.perf_counter()
+    for number, _ in enumerate(iter_capture(path)):
+        if number == target:
+            break
+    print(f"Linear scan to frame {target}: {time.perf_counter() - start:.2f} s")
+    os.remove(path)
+    os.remove(index_path(path))
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,548 @@
+import array
+import logging
+import os
+import queue
+import select
+import struct
+import threading
+import time
+
+import serial  # For serial communication
+
+from hostlink import NO_END_CODE_HEADERS, READ_HEADERS, WRITE_HEADERS, compute_fcs
+from kline import wait_until
+from frames import Frame, character_time_ns
+from port_bridge import open_port
+
+MODBUS_CHARACTER_BITS = 11  # RTU characters carry a parity bit or a second stop bit
+MODBUS_FIXED_GAP_NS = 1_750_000  # t3.5 above 19200 baud (Modbus over serial line, 2.5.1.1)
+MAX_FRAME_BYTES = 256  # Longest Modbus RTU frame; Host Link frames are shorter
+HOSTLINK_READ_HEADERS = set(READ_HEADERS.values()) | {'RC', 'RG'}  # Also timer/counter PV and status
+HOSTLINK_WRITE_HEADERS = set(WRITE_HEADERS.values()) | {'WC', 'WG'}
+HOSTLINK_STATUS_HEADERS = {'MS', 'MM'}  # Commands with no text whose responses carry an end code and data
+TIOCGICOUNT = 0x545D  # Linux ioctl number, for termios builds that do not export it
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = crc >> 1 ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def modbus_crc(data):
+    """CRC-16/MODBUS of data, as the integer sent low byte first."""
+    crc = 0xFFFF
+    table = _CRC_TABLE
+    for byte in data:
+        crc = crc >> 8 ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def silence_gap_ns(baudrate):
+    """Modbus t3.5: 3.5 character times, fixed at 1.75 ms above 19200 baud."""
+    if baudrate > 19200:
+        return MODBUS_FIXED_GAP_NS
+    return 35 * character_time_ns(baudrate, MODBUS_CHARACTER_BITS) // 10
+
+
+def decode_modbus(data):
+    """Decode a Modbus RTU frame into fields, or return None if the CRC does not match.
+
+    'kind' is 'request' or 'response' when the length settles it, and None
+    when only the conversation can (FC5/FC6 responses echo the request).
+    """
+    if len(data) < 4 or modbus_crc(data[:-2]) != data[-2] | data[-1] << 8:
+        return None
+    unit, function, size = data[0], data[1], len(data)
+    fields = {'protocol': 'modbus', 'unit': unit, 'function': function & 0x7F, 'kind': None}
+    if function & 0x80:
+        fields['kind'] = 'response'
+        fields['exception'] = data[2]
+    elif function in (1, 2, 3, 4):
+        request = size == 8
+        response = data[2] == size - 5 and (function < 3 or data[2] % 2 == 0)
+        if request and not response:
+            fields.update(kind='request', address=data[2] << 8 | data[3], count=data[4] << 8 | data[5])
+        elif response and not request:
+            fields.update(kind='response', byte_count=data[2])
+    elif function in (5, 6) and size == 8:
+        fields.update(address=data[2] << 8 | data[3], value=data[4] << 8 | data[5])
+    elif function in (15, 16):
+        if size == 8:
+            fields.update(kind='response', address=data[2] << 8 | data[3], count=data[4] << 8 | data[5])
+        elif size > 9 and data[6] == size - 9:
+            fields.update(kind='request', address=data[2] << 8 | data[3], count=data[4] << 8 | data[5])
+    return fields
+
+
+def _hostlink_kind(header, text):
+    """'request' or 'response' where the text length settles it for header, else None.
+
+    Word reads send an 8-digit address and count and get back a 2-digit
+    end code plus 4 digits per word; word writes send an address plus
+    words and get back only the end code; MS and MM send no text. Others
+    (SC, TS, FA, ...) look the same both ways and are left to the
+    conversation order.
+    """
+    size = len(text)
+    if header in HOSTLINK_READ_HEADERS:
+        return 'request' if size == 8 else 'response' if size % 4 == 2 else None
+    if header in HOSTLINK_WRITE_HEADERS:
+        return 'response' if size == 2 else 'request' if size >= 8 and size % 4 == 0 else None
+    if header in HOSTLINK_STATUS_HEADERS:
+        return 'request' if size == 0 else 'response' if size >= 2 else None
+    return None
+
+
+def decode_hostlink(data):
+    """Decode a Host Link C-mode frame into fields, or return None if it is not one.
+
+    Commands and responses mostly differ only in the length of their text,
+    so 'kind' is set where the header and length settle it (with end_code,
+    and exception when it is not '00', for responses) and left None
+    otherwise, for the conversation order to decide.
+    """
+    if len(data) < 6 or data[-1] != 0x0D or 0x0D in data[:-1] or 0x40 in data[1:]:
+        return None  # One CR at the end and '@' only at the start, so two glued frames never pass as one
+    try:
+        text = data[:-1].decode('ascii')
+    except UnicodeDecodeError:
+        return None
+    final = text.endswith('*')
+    body = text[:-1] if final else text
+    frame, fcs = body[:-2], body[-2:]
+    fields = {'protocol': 'hostlink', 'final': final, 'kind': None, 'fcs_ok': compute_fcs(frame) == fcs}
+    if frame.startswith('@') and len(frame) >= 5:
+        header, text = frame[3:5], frame[5:]
+        fields.update(unit=int(frame[1:3]) if frame[1:3].isdigit() else None, header=header, text=text)
+        kind = _hostlink_kind(header, text)
+        if kind == 'response' and all(char in '0123456789ABCDEF' for char in text[:2]):
+            fields.update(kind='response', end_code=text[:2])
+            if text[:2] != '00':
+                fields['exception'] = text[:2]
+        elif kind == 'request':
+            fields['kind'] = 'request'
+    else:
+        fields['continuation'] = True
+    return fields
+
+
+def decode_frame(data):
+    """Decoded fields of a frame as Modbus RTU or Host Link, or None if neither matches."""
+    if data[:1] == b'@' or data[-1:] == b'\r':
+        fields = decode_hostlink(data)
+        if fields is not None and fields['fcs_ok']:
+            return fields
+    return decode_modbus(data)
+
+
+def read_icount(fd):
+    """Kernel UART error counters (Linux TIOCGICOUNT), or None if the port has none."""
+    try:
+        import fcntl
+        import termios
+    except ImportError:  # Not a Unix serial port
+        return None
+    counters = array.array('i', [0] * 20)
+    try:
+        fcntl.ioctl(fd, getattr(termios, 'TIOCGICOUNT', TIOCGICOUNT), counters, True)
+    except OSError:
+        return None
+    return {'rx': counters[4], 'frame': counters[6], 'overrun': counters[7], 'parity': counters[8],
+            'brk': counters[9], 'buf_overrun': counters[10]}
+
+
+class BusSniffer:
+    """Passive RS485 listener that splits traffic into frames by line silence.
+
+    A reader thread does nothing but wait for bytes, timestamp each burst
+    with time.monotonic_ns() and cut a frame wherever the line has been
+    quiet for gap_ns (Modbus t3.5 by default). The first byte of a burst is
+    dated back by the character time of the bytes that followed it, since
+    the read only returns once the last one is in. Complete frames go to a
+    bounded queue; if the decoder falls max_queue frames behind, frames are
+    dropped and counted in stats rather than stalling the reader, and on
+    UARTs that report them the kernel's overrun counters are included too,
+    so a zero drop count covers every stage from the wire to the decoder.
+
+    The reader can wake late (another thread holding the GIL, say) and
+    take a pause inside a frame for a silence, so the decoder joins a piece
+    that fails its CRC or FCS with the burst that follows within merge_ns
+    when together they decode, and splits bursts that hold more than one
+    frame (see _resync). Pieces that never decode are counted as
+    undecoded, and drop_report() includes them with the merge and resync
+    counts, so a clean report means every byte was decoded.
+
+    The decoder thread decodes Modbus RTU and Host Link frames and pairs
+    each response with the pending request to the same unit and function
+    (or Host Link header), calling on_frame(frame) for every frame and
+    on_transaction(request, response, latency_ns) for every pair, where
+    latency is from the request's last byte to the response's first. A
+    request with no response within response_timeout seconds counts as
+    unanswered. Frames are also recorded to capture (a CaptureWriter) if
+    one is given.
+    """
+
+    def __init__(self, port, baudrate=115200, gap_ns=None, on_frame=None, on_transaction=None, sink=None,
+                 max_queue=10000, capture=None, merge_ns=20_000_000, response_timeout=1.0, **settings):
+        self.port = port
+        self.baudrate = baudrate
+        self.settings = settings
+        self.gap_ns = gap_ns or silence_gap_ns(baudrate)
+        self.merge_ns = max(merge_ns, 2 * self.gap_ns)
+        self.response_timeout_ns = int(response_timeout * 1e9)
+        self.char_ns = character_time_ns(baudrate, settings.get('bytesize', 8) + 2)
+        self.on_frame = on_frame
+        self.on_transaction = on_transaction
+        self.sink = sink
+        self.capture = capture
+        self.stats = {'bytes': 0, 'frames': 0, 'decoded': 0, 'undecoded': 0, 'transactions': 0,
+                      'unanswered': 0, 'unmatched': 0, 'exceptions': 0, 'dropped_frames': 0, 'dropped_bytes': 0,
+                      'resynced': 0, 'merged': 0}
+        self.ser = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}  # (protocol, unit, function or header) -> request frame
+        self._held = None  # Undecodable piece that may be completed by the next burst
+        self._icount_start = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.ser = open_port(self.port, dict(self.settings, baudrate=self.baudrate))
+        if getattr(self.ser, 'fd', None) is not None:
+            self._icount_start = read_icount(self.ser.fd)
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._read_loop, daemon=True),
+                         threading.Thread(target=self._decode_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        logging.info(f"Sniffing {self.port} at {self.baudrate} baud, frame gap {self.gap_ns / 1e6:.2f} ms")
+        return self
+
+    def close(self):
+        self._stop.set()
+        if getattr(self.ser, 'fd', None) is None:
+            self.ser.cancel_read()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.ser.close()
+
+    def drop_report(self):
+        """Frames and bytes lost anywhere between the UART and the decoder, and frames that did not decode.
+
+        undecoded counts bursts that stayed undecodable after merging and
+        resyncing; merged and resynced count the repairs made on the way.
+        """
+        report = {name: self.stats[name] for name in ('dropped_frames', 'dropped_bytes', 'undecoded', 'merged',
+                                                      'resynced')}
+        if self._icount_start is not None and self.ser is not None and self.ser.is_open:
+            now = read_icount(self.ser.fd)
+            for name in ('overrun', 'buf_overrun', 'frame', 'parity'):
+                report[name] = now[name] - self._icount_start[name]
+        return report
+
+    def _emit(self, data, first_ns, last_ns):
+        frame = Frame(self.port, bytes(data), 'rx', first_ns, last_ns)
+        self.stats['frames'] += 1
+        self.stats['bytes'] += len(data)
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.stats['dropped_frames'] += 1
+            self.stats['dropped_bytes'] += len(data)
+
+    def _read_loop(self):
+        fd = getattr(self.ser, 'fd', None)
+        if fd is None:
+            self.ser.timeout = self.gap_ns / 1e9
+        pending = bytearray()
+        first_ns = last_ns = 0
+        gap_ns, char_ns = self.gap_ns, self.char_ns
+        while not self._stop.is_set():
+            try:
+                if fd is not None:
+                    wait = max(0, last_ns + gap_ns - time.monotonic_ns()) / 1e9 if pending else 0.1
+                    data = os.read(fd, 4096) if select.select([fd], [], [], wait)[0] else b''
+                else:
+                    data = self.ser.read(self.ser.in_waiting or 1)
+            except (serial.SerialException, OSError) as e:
+                if self._stop.is_set():
+                    break
+                logging.error(f"Sniffer read on {self.port} failed: {e}")
+                self._stop.wait(0.5)
+                continue
+            now = time.monotonic_ns()
+            if not data:
+                if pending and now - last_ns >= gap_ns:
+                    self._emit(pending, first_ns, last_ns)
+                    pending = bytearray()
+                continue
+            burst_first = now - (len(data) - 1) * char_ns
+            if pending and burst_first - last_ns >= gap_ns:
+                self._emit(pending, first_ns, last_ns)
+                pending = bytearray()
+            if not pending:
+                first_ns = burst_first
+            pending += data
+            last_ns = now
+        if pending:
+            self._emit(pending, first_ns, last_ns)
+
+    def _decode_loop(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                frame = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                self._release_held(time.monotonic_ns())
+                continue
+            for part in self._reassemble(frame):
+                self.process(part)
+        self._release_held(None)
+
+    def _release_held(self, now_ns):
+        """Decode the held piece once nothing can complete it any more (now_ns None: at once)."""
+        if self._held is not None and (now_ns is None or now_ns - self._held.last_ns > self.merge_ns):
+            held, self._held = self._held, None
+            self.process(held)
+
+    def _reassemble(self, frame):
+        """Frames to decode from the next burst, after joining it to a held piece and splitting it up.
+
+        A burst whose last frame fails to decode is held back, in case the
+        reader cut that frame short and the next burst holds the rest.
+        """
+        held, self._held = self._held, None
+        if (held is not None and frame.first_ns - held.last_ns <= self.merge_ns
+                and len(held.data) + len(frame.data) <= 2 * MAX_FRAME_BYTES):
+            merged = Frame(frame.port, held.data + frame.data, 'rx', held.first_ns, frame.last_ns)
+            # Join when that completes the held piece, or when neither decodes on its own yet
+            if decode_frame(self._split(merged)[0].data) is not None or decode_frame(frame.data) is None:
+                self.stats['merged'] += 1
+                held, frame = None, merged
+        parts = [held] if held is not None else []
+        pieces = self._resync(frame)
+        if decode_frame(pieces[-1].data) is None and len(pieces[-1].data) < MAX_FRAME_BYTES:
+            self._held = pieces.pop()
+        return parts + pieces
+
+    def _resync(self, frame):
+        """Split a frame that fails to decode at the first point where a valid frame ends.
+
+        A response that starts sooner after its request than the reader can
+        resolve (thread wake-up jitter eats into t3.5) arrives glued to it;
+        the CRC or FCS shows where the first frame really ends.
+        """
+        parts = self._split(frame)
+        self.stats['resynced'] += len(parts) - 1
+        return parts
+
+    def _split(self, frame):
+        data = frame.data
+        if len(data) < 8 or decode_frame(data) is not None:
+            return [frame]
+        for end in range(4, len(data) - 3):
+            if decode_frame(data[:end]) is not None:
+                split_ns = frame.first_ns + (end - 1) * self.char_ns
+                return ([Frame(frame.port, data[:end], 'rx', frame.first_ns, split_ns)]
+                        + self._split(Frame(frame.port, data[end:], 'rx', split_ns + self.char_ns, frame.last_ns)))
+        return [frame]
+
+    def process(self, frame):
+        """Decode one frame and match it against pending requests."""
+        fields = frame.fields = decode_frame(frame.data)
+        if fields is None:
+            self.stats['undecoded'] += 1
+            logging.info(f"Sniffed {frame.port}: {frame.data.hex(' ')} (undecoded)")
+        else:
+            self.stats['decoded'] += 1
+            if fields.get('continuation'):
+                key = None
+            elif fields['protocol'] == 'modbus':
+                key = ('modbus', fields['unit'], fields['function'])
+            else:
+                key = ('hostlink', fields['unit'], fields['header'])
+            if key is not None:
+                request = self._pending.pop(key, None)
+                if request is not None and frame.first_ns - request.last_ns > self.response_timeout_ns:
+                    self.stats['unanswered'] += 1  # Expired: a late frame must not pair with it
+                    request = None
+                if fields['kind'] == 'request' or (fields['kind'] is None and request is None):
+                    fields['kind'] = 'request'
+                    if request is not None:
+                        self.stats['unanswered'] += 1
+                    self._pending[key] = frame
+                elif request is None:
+                    self.stats['unmatched'] += 1
+                else:
+                    fields['kind'] = 'response'
+                    self._match(request, frame)
+        if self.on_frame is not None:
+            self.on_frame(frame)
+        if self.capture is not None:
+            self.capture.write(frame)
+        if self.sink is not None:
+            self.sink.publish_frame(frame.port, frame.data, 'rx')
+
+    def _match(self, request, response):
+        fields = response.fields
+        if fields['protocol'] == 'hostlink' and 'end_code' not in fields:
+            end_code = fields['text'][:2] if fields['header'] not in NO_END_CODE_HEADERS else '00'
+            fields['end_code'] = end_code
+            if end_code != '00':
+                fields['exception'] = end_code
+        if 'exception' in fields:
+            self.stats['exceptions'] += 1
+        latency_ns = response.first_ns - request.last_ns
+        self.stats['transactions'] += 1
+        logging.info(f"Sniffed {fields['protocol']} unit {fields['unit']} "
+                     f"{fields.get('function', fields.get('header'))}: {request.data.hex(' ')} -> "
+                     f"{response.data.hex(' ')} in {latency_ns / 1e6:.2f} ms")
+        if self.on_transaction is not None:
+            self.on_transaction(request, response, latency_ns)
+
+
+def modbus_frame(unit, function, payload):
+    """Build a Modbus RTU frame with its CRC."""
+    body = bytes([unit, function]) + payload
+    crc = modbus_crc(body)
+    return body + bytes([crc & 0xFF, crc >> 8])
+
+
+def hostlink_frame(unit, header, text):
+    body = f"@{unit:02d}{header}{text}"
+    return (body + compute_fcs(body) + '*\r').encode('ascii')
+
+
+class RS485BusStandIn:
+    """A busy RS485 line on a pseudo-terminal, paced like real traffic at baudrate.
+
+    A Modbus master polls several units (FC3 reads, FC6 and FC16 writes,
+    and an illegal-address exception every so often) and a Host Link host
+    reads DM words, each request followed by its response after a short
+    turnaround. Frames are handed over fifo bytes at a time, each piece
+    held back for its time on the wire, the way a UART's receive FIFO
+    trigger delivers them. Linux only.
+    """
+
+    def __init__(self, baudrate=115200, turnaround=0.002, fifo=8):
+        self.baudrate = baudrate
+        self.fifo = fifo
+        self.turnaround_ns = int(turnaround * 1e9)
+        self.char_ns = character_time_ns(baudrate, MODBUS_CHARACTER_BITS)
+        self.gap_ns = silence_gap_ns(baudrate)
+        self.frames = 0
+        self.bytes = 0
+        self.transactions = 0
+        self.exceptions = 0
+        import tty  # Unix only, like the pseudo-terminal itself
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        tty.setraw(self._master)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop talking but keep the line open so what was sent can still be read."""
+        self._stop.set()
+        self._thread.join()
+
+    def close(self):
+        self.stop()
+        os.close(self._slave)
+        os.close(self._master)
+
+    def _conversation(self, i):
+        unit = 1 + i % 8
+        kind = i % 10
+        if kind < 5:
+            count = 1 + i % 40
+            yield modbus_frame(unit, 3, struct.pack('>HH', 100 * unit, count))
+            if i % 50 == 3:
+                yield modbus_frame(unit, 0x83, b'\x02')  # Illegal data address
+            else:
+                yield modbus_frame(unit, 3, bytes([2 * count]) + bytes(range(2 * count)))
+        elif kind < 7:
+            request = modbus_frame(unit, 6, struct.pack('>HH', 200, i & 0xFFFF))
+            yield request
+            yield request
+        elif kind < 8:
+            values = struct.pack('>4H', i & 0xFFFF, 1, 2, 3)
+            yield modbus_frame(unit, 16, struct.pack('>HHB', 300, 4, 8) + values)
+            yield modbus_frame(unit, 16, struct.pack('>HH', 300, 4))
+        else:
+            yield hostlink_frame(unit, 'RD', '01000004')
+            yield hostlink_frame(unit, 'RD', '00' + ''.join(f"{i + w & 0xFFFF:04X}" for w in range(4)))
+
+    def _run(self):
+        deadline = time.monotonic_ns()
+        i = 0
+        while not self._stop.is_set():
+            for number, frame in enumerate(self._conversation(i)):
+                for offset in range(0, len(frame), self.fifo):
+                    piece = frame[offset:offset + self.fifo]
+                    deadline += len(piece) * self.char_ns
+                    wait_until(deadline)
+                    os.write(self._master, piece)
+                self.frames += 1
+                self.bytes += len(frame)
+                if frame[:1] != b'@' and frame[1] & 0x80:
+                    self.exceptions += 1
+                deadline += max(self.gap_ns, self.turnaround_ns if number == 0 else 2 * self.gap_ns)
+            self.transactions += 1
+            i += 1
+
+
+def benchmark(duration=5.0, baudrate=115200):
+    """Sniff a line kept busy at baudrate and confirm that every frame and transaction is accounted for."""
+    bus = RS485BusStandIn(baudrate).start()
+    latencies = []
+    sniffer = BusSniffer(bus.port, baudrate,
+                         on_transaction=lambda request, response, latency: latencies.append(latency))
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    sniffer.start()
+    time.sleep(duration)
+    bus.stop()
+    time.sleep(0.1)
+    sniffer.close()
+    bus.close()
+    stats = sniffer.stats
+    print(f"Line at {baudrate} baud: stand-in sent {bus.frames} frames ({bus.exceptions} exceptions), "
+          f"{bus.bytes} bytes ({bus.bytes / duration:.0f} B/s of a possible {1e9 / bus.char_ns:.0f})")
+    print(f"Sniffer: {stats['frames']} frames, {stats['bytes']} bytes, {stats['decoded']} decoded, "
+          f"{stats['undecoded']} undecoded, {stats['resynced']} resynced, {stats['transactions']} transactions "
+          f"({stats['exceptions']} exceptions), {stats['unanswered']} unanswered, {stats['unmatched']} unmatched")
+    print(f"Drops: {sniffer.drop_report()}")
+    if latencies:
+        latencies.sort()
+        print(f"Request->response gap: p50 {latencies[len(latencies) // 2] / 1e6:.2f} ms "
+              f"(stand-in turnaround {bus.turnaround_ns / 1e6:.2f} ms)")
+
+    frames = [Frame('bench', frame, 'rx', 0, 0) for i in range(1000) for frame in bus._conversation(i)]
+    decoder = BusSniffer('bench')
+    start = time.perf_counter()
+    for frame in frames:
+        decoder.process(frame)
+    elapsed = time.perf_counter() - start
+    logger.setLevel(level)
+    print(f"Decode and match: {len(frames) / elapsed:.0f} frames/s, "
+          f"{len(frames) / elapsed / (bus.frames / duration):.0f}x what a full line at {baudrate} baud needs")
+
+
+if __name__ == '__main__':
+    benchmark()
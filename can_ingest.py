@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+
+import can  # For CAN communication
+import numpy as np  # For the array-backed latest-value cache
+
+
+class LatestValueCache:
+    """Latest frame, timestamp and counter per arbitration ID, held in numpy arrays.
+
+    Standard 11-bit IDs index the arrays directly; extended IDs are given a
+    slot after them on first sight, up to max_extended IDs.
+    """
+
+    STANDARD_IDS = 2048
+
+    def __init__(self, max_extended=1024):
+        size = self.STANDARD_IDS + max_extended
+        self.data = np.zeros((size, 8), dtype=np.uint8)
+        self.dlc = np.zeros(size, dtype=np.uint8)
+        self.timestamp = np.zeros(size, dtype=np.float64)
+        self.count = np.zeros(size, dtype=np.uint64)
+        self._extended_slots = {}
+        self._max_extended = max_extended
+
+    def slot(self, arbitration_id, is_extended=False):
+        """Return the array row for an ID, allocating one for a new extended ID."""
+        if not is_extended and arbitration_id < self.STANDARD_IDS:
+            return arbitration_id
+        slot = self._extended_slots.get(arbitration_id)
+        if slot is None:
+            if len(self._extended_slots) >= self._max_extended:
+                return None
+            slot = self._extended_slots[arbitration_id] = self.STANDARD_IDS + len(self._extended_slots)
+        return slot
+
+    def update(self, msg):
+        """Store one python-can Message; returns False when the extended ID table is full."""
+        slot = self.slot(msg.arbitration_id, msg.is_extended_id)
+        if slot is None:
+            return False
+        dlc = min(msg.dlc, 8)
+        self.data[slot, :dlc] = memoryview(msg.data)[:dlc]
+        self.dlc[slot] = dlc
+        self.timestamp[slot] = msg.timestamp
+        self.count[slot] += 1
+        return True
+
+    def get(self, arbitration_id, is_extended=False):
+        """Return (data bytes, timestamp, count) for an ID, or None if never seen."""
+        if not is_extended and arbitration_id < self.STANDARD_IDS:
+            slot = arbitration_id
+        else:
+            slot = self._extended_slots.get(arbitration_id)
+        if slot is None or not self.count[slot]:
+            return None
+        return bytes(self.data[slot, :self.dlc[slot]]), float(self.timestamp[slot]), int(self.count[slot])
+
+    def seen_ids(self):
+        """Return the standard IDs that have been received, as a numpy array."""
+        return np.flatnonzero(self.count[:self.STANDARD_IDS])
+
+
+class CanIngest:
+    """Receive CAN frames with interface-level filters and batched draining.
+
+    filters is a list of (can_id, can_mask) or (can_id, can_mask, extended)
+    tuples handed to the interface (kernel filters on socketcan), so unwanted
+    traffic never reaches Python. The receive thread drains up to batch_size
+    frames per wake-up into a LatestValueCache and passes each batch to the
+    optional on_batch callback.
+    """
+
+    def __init__(self, channel='can0', interface='socketcan', bitrate=None, filters=None,
+                 batch_size=256, on_batch=None, max_extended=1024):
+        self.channel = channel
+        self.interface = interface
+        self.bitrate = bitrate
+        self.filters = filters or []
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.cache = LatestValueCache(max_extended)
+        self.stats = {'frames': 0, 'batches': 0, 'untracked': 0, 'errors': 0}
+        self.bus = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Open the bus, install the filters and start the receive thread."""
+        options = {'interface': self.interface, 'channel': self.channel}
+        if self.bitrate:
+            options['bitrate'] = self.bitrate
+        self.bus = can.Bus(**options)
+        if self.filters:
+            self.bus.set_filters([{'can_id': f[0], 'can_mask': f[1], 'extended': f[2] if len(f) > 2 else False}
+                                  for f in self.filters])
+        self._running = True
+        self._thread = threading.Thread(target=self._receive_loop, daemon=True)
+        self._thread.start()
+        logging.info(f"CAN ingest started on {self.interface}:{self.channel} with {len(self.filters)} filters")
+        return self
+
+    def stop(self):
+        """Stop the receive thread and close the bus."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        if self.bus is not None:
+            self.bus.shutdown()
+        logging.info(f"CAN ingest stopped: {self.stats}")
+
+    def _receive_loop(self):
+        bus, cache, batch_size = self.bus, self.cache, self.batch_size
+        while self._running:
+            try:
+                msg = bus.recv(timeout=0.1)
+                if msg is None:
+                    continue
+                batch = [msg]
+                while len(batch) < batch_size:  # Drain whatever is already queued without waiting
+                    msg = bus.recv(timeout=0)
+                    if msg is None:
+                        break
+                    batch.append(msg)
+            except can.CanError as e:
+                self.stats['errors'] += 1
+                logging.error(f"CAN receive error on {self.channel}: {e}")
+                continue
+            for msg in batch:
+                if not msg.is_error_frame and not cache.update(msg):
+                    self.stats['untracked'] += 1
+            self.stats['frames'] += len(batch)
+            self.stats['batches'] += 1
+            if self.on_batch is not None:
+                self.on_batch(batch)
+
+
+def benchmark(frames=100000, ids=64):
+    """Measure frames/sec the ingest path sustains on python-can's virtual bus."""
+    ingest = CanIngest(channel='can_ingest_bench', interface='virtual',
+                       filters=[(0x100, 0x700)]).start()  # Accept 0x100-0x1FF only
+    sender = can.Bus(interface='virtual', channel='can_ingest_bench')
+    messages = [can.Message(arbitration_id=0x100 + i % ids, data=i.to_bytes(8, 'little'), is_extended_id=False)
+                for i in range(frames)]
+    messages += [can.Message(arbitration_id=0x300, data=b'\x00', is_extended_id=False)] * 1000  # Filtered out
+    start = time.perf_counter()
+    for msg in messages:
+        sender.send(msg)
+    while ingest.stats['frames'] < frames and time.perf_counter() - start < 30:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    sender.shutdown()
+    ingest.stop()
+    print(f"{ingest.stats['frames']} frames in {elapsed:.2f} s: {ingest.stats['frames'] / elapsed:.0f} frames/s "
+          f"in {ingest.stats['batches']} batches ({frames / elapsed / 1e6 * 111:.0%} of a saturated 1 Mbit/s bus "
+          f"at 111 bits per frame)")
+    print(f"{len(ingest.cache.seen_ids())} IDs cached; 0x100 count {ingest.cache.get(0x100)[2]}, "
+          f"0x300 filtered: {ingest.cache.get(0x300) is None}")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,282 @@
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from frames import Frame
+
+MAGIC = b'UCBCAP\x00\x01'  # File signature and format version
+RECORD = struct.Struct('<qIIHBB')  # first_ns, last - first, done - first, length, port id, flags
+RECORD_LENGTH = struct.Struct('<16xH')  # Just the length field of a RECORD header
+SESSION = struct.Struct('<qq')  # time.time_ns() and time.monotonic_ns() read together
+TX = 0x01  # Frame was sent (otherwise received)
+HAS_DONE = 0x02  # done_ns is present
+CHECKPOINT = 0x20  # Record carries the number of the next frame; session and ports are restated after it
+PORT_NAME = 0x40  # Record declares the name of a port id
+SESSION_START = 0x80  # Record carries a SESSION clock pair
+NO_DELTA = 0xFFFFFFFF
+MAX_DATA = 0xFFFF
+MAX_PORTS = 255
+
+
+class CaptureError(IOError):
+    """Raised when a capture file is not in this format or is cut short."""
+
+
+class CaptureWriter:
+    """Append-only writer for the binary capture format.
+
+    A file is MAGIC followed by records, each a 20-byte RECORD header and
+    its data. Frames are stored with first_ns as an absolute
+    time.monotonic_ns() and last_ns/done_ns as offsets from it; the port is
+    a one-byte id declared by a PORT_NAME record the first time the writer
+    sees it, and every writer begins with a SESSION_START record pairing
+    the wall clock with monotonic_ns, so timestamps from different runs
+    appended to one file can all be turned into wall-clock times.
+
+    Writes go into a large user-space buffer under a lock, so several ports
+    (threads) can record at once for the cost of a struct.pack and a
+    memory copy; a background thread flushes every flush_interval seconds,
+    which bounds what a crash can lose. The writer is also a sink
+    (publish_frame) and, through CaptureHandler, a logging target.
+
+    A crash can leave the last record half written. Before appending to an
+    existing file the writer cuts it back to the end of its last complete
+    record, since a torn record's length field would otherwise swallow the
+    start of the new data and misalign everything after it.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.stats = {'frames': 0, 'bytes': 0}
+        self._ports = {}  # Port name -> id
+        self._lock = threading.Lock()
+        self._truncate_torn_tail(path)
+        self._file = open(path, 'ab', buffering=buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._session = (RECORD.pack(0, 0, 0, SESSION.size, 0, SESSION_START)
+                         + SESSION.pack(time.time_ns(), time.monotonic_ns()))
+        self._file.write(self._session)
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _resume_offset(self, data):
+        """Record boundary to start looking for the end of the last complete record from."""
+        return len(MAGIC)
+
+    def _truncate_torn_tail(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(MAGIC):
+                if not MAGIC.startswith(f.read()):
+                    raise CaptureError(f"{path} is not a capture file")
+                f.truncate(0)  # Torn signature: start the file again
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(MAGIC)] != MAGIC:
+                    raise CaptureError(f"{path} is not a capture file")
+                end = record_end(data, self._resume_offset(data))
+            if end < size:
+                logging.warning(f"{path} ends with a torn record; cut {size - end} bytes at offset {end} before appending")
+                f.truncate(end)
+
+    def _port_id(self, port):
+        port_id = self._ports.get(port)
+        if port_id is None:
+            if len(self._ports) >= MAX_PORTS:
+                raise CaptureError(f"Capture already holds {MAX_PORTS} ports")
+            port_id = self._ports[port] = len(self._ports)
+            name = str(port).encode('utf-8')
+            self._file.write(RECORD.pack(0, 0, 0, len(name), port_id, PORT_NAME) + name)
+        return port_id
+
+    def write(self, frame):
+        """Append one Frame."""
+        with self._lock:
+            self._append(frame)
+
+    def _append(self, frame):
+        first_ns = frame.first_ns
+        flags = TX if frame.direction == 'tx' else 0
+        done = NO_DELTA
+        if frame.done_ns is not None:
+            flags |= HAS_DONE
+            done = min(frame.done_ns - first_ns, NO_DELTA - 1)
+        last = min(frame.last_ns - first_ns, NO_DELTA)
+        data = frame.data
+        port_id = self._port_id(frame.port)
+        for offset in range(0, max(len(data), 1), MAX_DATA):
+            chunk = data[offset:offset + MAX_DATA]
+            self._file.write(RECORD.pack(first_ns, last, done, len(chunk), port_id, flags))
+            self._file.write(chunk)
+        self.stats['frames'] += 1
+        self.stats['bytes'] += len(data)
+
+    def publish_frame(self, port, data, direction='rx'):
+        """Sink interface: record data stamped now."""
+        now = time.monotonic_ns()
+        self.write(Frame(port, data, direction, now, now))
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        self._stop.set()
+        self._flusher.join()
+        with self._lock:
+            self._file.close()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except ValueError:  # Closed underneath us
+                break
+
+
+class CaptureHandler(logging.Handler):
+    """Logging handler that records the Frame passed as extra={'frame': ...} to a CaptureWriter."""
+
+    def __init__(self, writer, level=logging.NOTSET):
+        super().__init__(level)
+        self.writer = writer
+
+    def emit(self, record):
+        frame = getattr(record, 'frame', None)
+        if frame is not None:
+            try:
+                self.writer.write(frame)
+            except Exception:
+                self.handleError(record)
+
+
+def record_end(data, offset=len(MAGIC)):
+    """Offset just past the last complete record in mapped capture data, walking from the record boundary offset."""
+    size = len(data)
+    header_size = RECORD.size
+    unpack = RECORD_LENGTH.unpack_from
+    while offset + header_size <= size:
+        end = offset + header_size + unpack(data, offset)[0]
+        if end > size:
+            break
+        offset = end
+    return offset
+
+
+def torn_tail(path):
+    """Number of bytes at the end of a capture file that do not form a complete record (0 for a clean file)."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise CaptureError(f"{path} is not a capture file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return len(data) - record_end(data)
+
+
+def read_capture(path, buffer_size=1 << 20):
+    """Yield every Frame in a capture file, in file order (see iter_capture for wall-clock times)."""
+    for frame, _ in iter_capture(path, buffer_size):
+        yield frame
+
+
+def iter_capture(path, buffer_size=1 << 20):
+    """Yield (Frame, wall-clock offset in ns) pairs; frame.first_ns + offset is time.time_ns() at the first byte.
+
+    A record cut short at the end of the file, as a crash or power loss
+    leaves it, ends the iteration with a warning; every complete frame
+    before it is still yielded.
+    """
+    header_size = RECORD.size
+    with open(path, 'rb', buffering=buffer_size) as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise CaptureError(f"{path} is not a capture file")
+        ports = {}
+        offset_ns = 0
+        offset = len(MAGIC)
+        while True:
+            header = f.read(header_size)
+            if not header:
+                return
+            if len(header) < header_size:
+                logging.warning(f"{path} ends inside a record header at offset {offset}; ignoring the torn tail")
+                return
+            first_ns, last, done, length, port_id, flags = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                logging.warning(f"{path} ends inside a record at offset {offset}; ignoring the torn tail")
+                return
+            offset += header_size + length
+            if flags & SESSION_START:
+                wall_ns, mono_ns = SESSION.unpack(data)
+                offset_ns = wall_ns - mono_ns
+            elif flags & PORT_NAME:
+                ports[port_id] = data.decode('utf-8')
+            elif not flags & CHECKPOINT:
+                yield (Frame(ports.get(port_id, port_id), data, 'tx' if flags & TX else 'rx', first_ns,
+                             first_ns + last, first_ns + done if flags & HAS_DONE else None), offset_ns)
+
+
+def benchmark(ports=4, frames_per_port=100000, size=12):
+    """Sustained recording cost from several threads, against one logging.info line per frame."""
+    payload = bytes(range(size))
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.ucbcap')
+    writer = CaptureWriter(path)
+
+    def record(port):
+        for i in range(frames_per_port):
+            now = time.monotonic_ns()
+            writer.write(Frame(port, payload, 'rx' if i % 2 else 'tx', now, now + 1000, now + 2000 if i % 2 == 0 else None))
+
+    threads = [threading.Thread(target=record, args=(f"/dev/ttyUSB{i}",)) for i in range(ports)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    elapsed = time.perf_counter() - start
+    total = ports * frames_per_port
+    size_on_disk = os.path.getsize(path)
+
+    text_path = os.path.join(directory, 'bench.log')
+    logger = logging.getLogger('capture_benchmark')
+    logger.propagate = False
+    handler = logging.FileHandler(text_path)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    text_frames = total // 10
+    start = time.perf_counter()
+    for _ in range(text_frames):
+        logger.info(f"Received data: {payload.decode('latin-1')}")
+    text_elapsed = time.perf_counter() - start
+    handler.close()
+
+    start = time.perf_counter()
+    read_back = sum(1 for _ in read_capture(path))
+    read_elapsed = time.perf_counter() - start
+
+    line_rate = 115200 / 10 / size  # Back-to-back frames per second one port can carry
+    print(f"{ports} threads wrote {total} {size}-byte frames in {elapsed:.2f} s: "
+          f"{elapsed / total * 1e6:.2f} us per frame, {total / elapsed:.0f} frames/s")
+    print(f"That is {total / elapsed / line_rate:.0f} ports' worth of back-to-back {size}-byte frames at 115200 baud")
+    print(f"On disk: {size_on_disk / total:.1f} bytes per frame (text log: "
+          f"{os.path.getsize(text_path) / text_frames:.1f}), logging.info costs {text_elapsed / text_frames * 1e6:.2f} us "
+          f"per frame")
+    print(f"Read back {read_back} frames at {read_back / read_elapsed:.0f} frames/s")
+    os.remove(path)
+    os.remove(text_path)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,497 @@
+import logging
+import os
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+ENCAPSULATION_HEADER = struct.Struct('<HHII8sI')  # Command, length, session, status, context, options
+REGISTER_SESSION = 0x65
+UNREGISTER_SESSION = 0x66
+SEND_RR_DATA = 0x6F
+SEND_UNIT_DATA = 0x70
+
+MESSAGE_ROUTER_PATH = b'\x20\x02\x24\x01'
+CONNECTION_MANAGER_PATH = b'\x20\x06\x24\x01'
+READ_TAG = 0x4C
+READ_TAG_FRAGMENTED = 0x52
+MULTIPLE_SERVICE_PACKET = 0x0A
+FORWARD_OPEN = 0x54
+LARGE_FORWARD_OPEN = 0x5B
+FORWARD_CLOSE = 0x4E
+
+STANDARD_CONNECTION_SIZE = 504  # Largest size a plain Forward Open can ask for on most targets
+VENDOR_ID = 0x1337
+ORIGINATOR_SERIAL = 0x42424242
+SEQUENCE_BYTES = 2  # Sequence count at the start of every connected data item
+TOO_LARGE_STATUSES = {0x06, 0x11}  # Partial transfer, reply data too large
+
+# Atomic CIP data types: type code -> struct format
+CIP_TYPES = {
+    0xC1: '?', 0xC2: 'b', 0xC3: 'h', 0xC4: 'i', 0xC5: 'q',
+    0xC6: 'B', 0xC7: 'H', 0xC8: 'I', 0xC9: 'Q', 0xCA: 'f', 0xCB: 'd',
+}
+STRUCTURE_TYPE = 0x02A0  # Followed by a 2-byte structure handle
+
+GENERAL_STATUS = {
+    0x01: 'Connection failure', 0x04: 'Path segment error', 0x05: 'Path destination unknown',
+    0x06: 'Partial transfer', 0x08: 'Service not supported', 0x11: 'Reply data too large',
+    0x13: 'Not enough data', 0x1E: 'Embedded service error', 0x26: 'Path size invalid',
+}
+
+
+class CipError(IOError):
+    """Raised when an encapsulation or CIP request fails."""
+
+
+def tag_path(name):
+    """Encode a tag name such as "Program:Main.Motor[3].Speed" as a symbolic EPATH."""
+    path = b''
+    for part in name.split('.'):
+        match = re.fullmatch(r'([^\[\]]+)(?:\[([\d,\s]+)\])?', part)
+        if not match:
+            raise ValueError(f"Invalid tag name: {name}")
+        symbol = match.group(1).encode('ascii')
+        path += bytes((0x91, len(symbol))) + symbol + (b'\x00' if len(symbol) % 2 else b'')
+        for index in (int(i) for i in (match.group(2) or '').split(',') if i.strip()):
+            if index < 0x100:
+                path += bytes((0x28, index))
+            elif index < 0x10000:
+                path += struct.pack('<BBH', 0x29, 0, index)
+            else:
+                path += struct.pack('<BBI', 0x2A, 0, index)
+    return path
+
+
+def read_tag_request(name, elements=1):
+    path = tag_path(name)
+    return bytes((READ_TAG, len(path) // 2)) + path + struct.pack('<H', elements)
+
+
+def multiple_service_request(requests):
+    """Wrap several CIP requests in one Multiple Service Packet to the Message Router."""
+    offset = 2 + 2 * len(requests)
+    offsets = []
+    for request in requests:
+        offsets.append(offset)
+        offset += len(request)
+    header = bytes((MULTIPLE_SERVICE_PACKET, len(MESSAGE_ROUTER_PATH) // 2)) + MESSAGE_ROUTER_PATH
+    return header + struct.pack(f'<H{len(requests)}H', len(requests), *offsets) + b''.join(requests)
+
+
+def split_multiple_service(data):
+    """Split Multiple Service Packet data (request or reply) into its embedded messages."""
+    count, = struct.unpack_from('<H', data)
+    offsets = list(struct.unpack_from(f'<{count}H', data, 2)) + [len(data)]
+    return [data[offsets[i]:offsets[i + 1]] for i in range(count)]
+
+
+def parse_reply(reply):
+    """Return (service, general status, extended status words, data) of a CIP reply."""
+    service, _, status, extended_size = reply[:4]
+    extended = struct.unpack_from(f'<{extended_size}H', reply, 4)
+    return service & 0x7F, status, extended, reply[4 + 2 * extended_size:]
+
+
+def decode_value(data, elements=1):
+    """Decode Read Tag reply data; atomic values become numbers (lists for arrays), structures stay bytes."""
+    type_code, = struct.unpack_from('<H', data)
+    if type_code == STRUCTURE_TYPE:
+        return data[4:]
+    if type_code not in CIP_TYPES:
+        return data[2:]
+    values = struct.unpack_from(f'<{elements}{CIP_TYPES[type_code]}', data, 2)
+    return values[0] if elements == 1 else list(values)
+
+
+class CipClient:
+    """EtherNet/IP explicit messaging client for Logix-style symbolic tag reads.
+
+    One TCP session and one class 3 connection stay open between calls.
+    The connection is opened with Large Forward Open at connection_size
+    bytes, falling back to a plain Forward Open at 504 bytes for targets
+    without it. read() packs as many Read Tag requests into each Multiple
+    Service Packet as fit the negotiated size in both directions, using
+    reply sizes learned from earlier reads; tags too large for one packet
+    are read with Read Tag Fragmented. slot is the backplane slot of the
+    controller, or None for targets addressed directly (e.g. Omron NJ/NX).
+    """
+
+    def __init__(self, host, port=44818, slot=0, connection_size=4002, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.slot = slot
+        self.requested_size = connection_size
+        self.connection_size = None
+        self.timeout = timeout
+        self.stats = {'requests': 0, 'tags': 0, 'errors': 0}
+        self._socket = None
+        self._session = 0
+        self._o_t_id = 0
+        self._t_o_id = int.from_bytes(os.urandom(4), 'little')
+        self._serial = int.from_bytes(os.urandom(2), 'little')  # Advanced for each Forward Open
+        self._sequence = 0
+        self._reply_sizes = {}  # (tag, elements) -> bytes of Read Tag reply data
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Open the TCP session and the class 3 connection."""
+        self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        reply = self._encapsulate(REGISTER_SESSION, struct.pack('<HH', 1, 0))
+        self._session = ENCAPSULATION_HEADER.unpack_from(reply)[2]
+        self._forward_open()
+        logging.info(f"EtherNet/IP session 0x{self._session:08X} to {self.host}:{self.port}, "
+                     f"connection size {self.connection_size}")
+        return self
+
+    def close(self):
+        if self._socket is None:
+            return
+        try:
+            if self.connection_size is not None:
+                path = self._connection_path()
+                self._send_unconnected(bytes((FORWARD_CLOSE, 2)) + CONNECTION_MANAGER_PATH + struct.pack(
+                    '<BBHHIBx', 0x0A, 0x0E, self._serial, VENDOR_ID, ORIGINATOR_SERIAL, len(path) // 2) + path)
+            header = ENCAPSULATION_HEADER.pack(UNREGISTER_SESSION, 0, self._session, 0, bytes(8), 0)
+            self._socket.sendall(header)
+        except OSError as e:
+            logging.warning(f"EtherNet/IP close of {self.host} failed: {e}")
+        finally:
+            self._socket.close()
+            self._socket = None
+            self.connection_size = None
+
+    def _recv_exactly(self, length):
+        data = b''
+        while len(data) < length:
+            chunk = self._socket.recv(length - len(data))
+            if not chunk:
+                raise ConnectionError(f"EtherNet/IP connection to {self.host} closed")
+            data += chunk
+        return data
+
+    def _encapsulate(self, command, data):
+        """Send one encapsulation packet and return the whole reply packet."""
+        self._socket.sendall(ENCAPSULATION_HEADER.pack(command, len(data), self._session, 0, bytes(8), 0) + data)
+        header = self._recv_exactly(ENCAPSULATION_HEADER.size)
+        reply_command, length, _, status, _, _ = ENCAPSULATION_HEADER.unpack(header)
+        reply = header + self._recv_exactly(length)
+        if status != 0 or reply_command != command:
+            raise CipError(f"EtherNet/IP command 0x{command:02X} failed with status 0x{status:X}")
+        return reply
+
+    def _items(self, reply):
+        """Return the common packet format items of a SendRRData/SendUnitData reply as {type: data}."""
+        offset = ENCAPSULATION_HEADER.size + 6  # Interface handle and timeout
+        count, = struct.unpack_from('<H', reply, offset)
+        offset += 2
+        items = {}
+        for _ in range(count):
+            item_type, length = struct.unpack_from('<HH', reply, offset)
+            items[item_type] = reply[offset + 4:offset + 4 + length]
+            offset += 4 + length
+        return items
+
+    def _send_unconnected(self, cip):
+        data = struct.pack('<IHHHHHH', 0, 10, 2, 0x0000, 0, 0x00B2, len(cip)) + cip
+        return self._items(self._encapsulate(SEND_RR_DATA, data))[0x00B2]
+
+    def _send_connected(self, cip):
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        data = struct.pack('<IHHHHIHHH', 0, 0, 2, 0x00A1, 4, self._o_t_id, 0x00B1, len(cip) + SEQUENCE_BYTES,
+                           self._sequence) + cip
+        self.stats['requests'] += 1
+        return self._items(self._encapsulate(SEND_UNIT_DATA, data))[0x00B1][SEQUENCE_BYTES:]
+
+    def _connection_path(self):
+        route = b'' if self.slot is None else bytes((0x01, self.slot))  # Backplane port, slot
+        return route + MESSAGE_ROUTER_PATH
+
+    def _forward_open(self):
+        attempts = [(LARGE_FORWARD_OPEN, self.requested_size), (FORWARD_OPEN, min(self.requested_size,
+                                                                                   STANDARD_CONNECTION_SIZE))]
+        path = self._connection_path()
+        for service, size in attempts:
+            # A new serial per Forward Open: after a reconnect the target may still hold the old
+            # connection until it times out, and refuses a duplicate (status 0x01, extended 0x0100)
+            self._serial = (self._serial + 1) & 0xFFFF
+            self._t_o_id = (self._t_o_id + 1) & 0xFFFFFFFF
+            if service == LARGE_FORWARD_OPEN:
+                parameters = struct.pack('<IIII', 2000000, 0x42000000 | size, 2000000, 0x42000000 | size)
+            else:
+                parameters = struct.pack('<IHIH', 2000000, 0x4200 | size, 2000000, 0x4200 | size)
+            request = (bytes((service, 2)) + CONNECTION_MANAGER_PATH +
+                       struct.pack('<BBIIHHIB3x', 0x0A, 0x0E, 0, self._t_o_id, self._serial, VENDOR_ID,
+                                   ORIGINATOR_SERIAL, 1) +
+                       parameters + bytes((0xA3, len(path) // 2)) + path)
+            _, status, extended, data = parse_reply(self._send_unconnected(request))
+            if status == 0:
+                self._o_t_id, = struct.unpack_from('<I', data)
+                self.connection_size = size
+                return
+            logging.info(f"EtherNet/IP {'Large ' if service == LARGE_FORWARD_OPEN else ''}Forward Open "
+                         f"of {size} bytes refused: status 0x{status:02X} {[hex(e) for e in extended]}")
+        raise CipError(f"Forward Open to {self.host} failed")
+
+    def _plan(self, tags):
+        """Group (name, elements, request) entries into packets that fit the connection both ways."""
+        budget = self.connection_size - SEQUENCE_BYTES
+        batches, batch, request_size, reply_size = [], [], 8, 6
+        for name, elements in tags:
+            request = read_tag_request(name, elements)
+            expected = self._reply_sizes.get((name, elements), 2 + 8 * elements)
+            add_request, add_reply = 2 + len(request), 2 + 4 + expected
+            if batch and (request_size + add_request > budget or reply_size + add_reply > budget):
+                batches.append(batch)
+                batch, request_size, reply_size = [], 8, 6
+            batch.append((name, elements, request))
+            request_size += add_request
+            reply_size += add_reply
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _read_fragmented(self, name, elements):
+        """Read a tag too large for one packet with Read Tag Fragmented."""
+        path = tag_path(name)
+        value = b''
+        while True:
+            request = bytes((READ_TAG_FRAGMENTED, len(path) // 2)) + path + struct.pack('<HI', elements, len(value))
+            _, status, _, reply = parse_reply(self._send_connected(request))
+            if status not in (0x00, 0x06):
+                raise CipError(f"Read Tag Fragmented {name} failed: status 0x{status:02X}")
+            header_length = 4 if struct.unpack_from('<H', reply)[0] == STRUCTURE_TYPE else 2
+            value += reply[header_length:]
+            if status == 0x00:
+                return reply[:header_length] + value
+
+    def read(self, tags):
+        """Read tags (names or (name, elements) pairs) and return name -> value.
+
+        Tags that fail come back as None and are logged.
+        """
+        tags = [(tag, 1) if isinstance(tag, str) else tuple(tag) for tag in tags]
+        values = {}
+        with self._lock:
+            if self._socket is None:
+                self.connect()
+            try:
+                for batch in self._plan(tags):
+                    values.update(self._read_batch(batch))
+            except (ConnectionError, socket.timeout) as e:
+                logging.warning(f"EtherNet/IP read from {self.host} failed ({e}), reconnecting")
+                self.close()
+                self.connect()
+                for batch in self._plan(tags):
+                    values.update(self._read_batch(batch))
+        return values
+
+    def _read_batch(self, batch):
+        if len(batch) == 1:
+            replies = [self._send_connected(batch[0][2])]
+        else:
+            _, status, _, data = parse_reply(self._send_connected(multiple_service_request([r for _, _, r in batch])))
+            if status not in (0x00, 0x1E):
+                raise CipError(f"Multiple Service Packet failed: status 0x{status:02X}")
+            replies = split_multiple_service(data)
+        values = {}
+        for (name, elements, _), reply in zip(batch, replies):
+            _, status, _, data = parse_reply(reply)
+            if status in TOO_LARGE_STATUSES:
+                data, status = self._read_fragmented(name, elements), 0
+            if status != 0:
+                self.stats['errors'] += 1
+                logging.warning(f"EtherNet/IP read of {name} failed: status 0x{status:02X} "
+                                f"{GENERAL_STATUS.get(status, 'Unknown error')}")
+                values[name] = None
+                continue
+            self._reply_sizes[(name, elements)] = len(data)
+            self.stats['tags'] += 1
+            values[name] = decode_value(data, elements)
+        return values
+
+
+class CipResponderStandIn:
+    """Local EtherNet/IP target stand-in for testing without a controller.
+
+    Accepts sessions, Forward Open (Large Forward Open only when large=True,
+    up to max_connection_size bytes), Read Tag, Read Tag Fragmented and
+    Multiple Service Packets over the connection. tags maps a name to
+    (type code, value bytes); request_delay simulates controller processing
+    time per packet.
+    """
+
+    def __init__(self, tags, host='127.0.0.1', port=0, max_connection_size=4002, large=True, request_delay=0.0):
+        self.tags = tags
+        self.max_connection_size = max_connection_size
+        self.large = large
+        self.request_delay = request_delay
+        self.packets = 0
+        responder = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                responder._serve(self.request)
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.address = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _serve(self, connection):
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        session = int.from_bytes(os.urandom(4), 'little') or 1
+        size = STANDARD_CONNECTION_SIZE
+        buffer = b''
+        while True:
+            while len(buffer) < ENCAPSULATION_HEADER.size or \
+                    len(buffer) < ENCAPSULATION_HEADER.size + struct.unpack_from('<H', buffer, 2)[0]:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    return
+                buffer += chunk
+            command, length, _, _, context, _ = ENCAPSULATION_HEADER.unpack_from(buffer)
+            data = buffer[ENCAPSULATION_HEADER.size:ENCAPSULATION_HEADER.size + length]
+            buffer = buffer[ENCAPSULATION_HEADER.size + length:]
+            if command == UNREGISTER_SESSION:
+                return
+            if command == REGISTER_SESSION:
+                reply = data
+            elif command == SEND_RR_DATA:
+                cip = data[16:]
+                reply_cip, granted = self._unconnected(cip)
+                if granted:
+                    size = granted
+                reply = struct.pack('<IHHHHHH', 0, 0, 2, 0, 0, 0x00B2, len(reply_cip)) + reply_cip
+            elif command == SEND_UNIT_DATA:
+                self.packets += 1
+                if self.request_delay:
+                    time.sleep(self.request_delay)
+                connection_id, = struct.unpack_from('<I', data, 12)
+                sequence, = struct.unpack_from('<H', data, 20)
+                reply_cip = self._message(data[22:], size - SEQUENCE_BYTES)
+                reply = struct.pack('<IHHHHIHHH', 0, 0, 2, 0x00A1, 4, connection_id, 0x00B1,
+                                    len(reply_cip) + SEQUENCE_BYTES, sequence) + reply_cip
+            else:
+                connection.sendall(ENCAPSULATION_HEADER.pack(command, 0, session, 0x01, context, 0))  # Invalid command
+                continue
+            connection.sendall(ENCAPSULATION_HEADER.pack(command, len(reply), session, 0, context, 0) + reply)
+
+    def _unconnected(self, cip):
+        service = cip[0]
+        data = cip[2 + cip[1] * 2:]
+        if service == FORWARD_CLOSE:
+            return bytes((service | 0x80, 0, 0, 0)) + data[2:10] + b'\x00\x00', None
+        if service not in (FORWARD_OPEN, LARGE_FORWARD_OPEN) or (service == LARGE_FORWARD_OPEN and not self.large):
+            return bytes((service | 0x80, 0, 0x08, 0)), None
+        if service == LARGE_FORWARD_OPEN:
+            size = struct.unpack_from('<I', data, 26)[0] & 0xFFFF  # O->T network connection parameters
+        else:
+            size = struct.unpack_from('<H', data, 26)[0] & 0x01FF
+        if size > (self.max_connection_size if service == LARGE_FORWARD_OPEN else 511):
+            return bytes((service | 0x80, 0, 0x01, 1)) + struct.pack('<H', 0x0109), None
+        t_o_id, serial, vendor, originator = struct.unpack_from('<IHHI', data, 6)
+        o_t_id = int.from_bytes(os.urandom(4), 'little')
+        reply = struct.pack('<IIHHIIIBB', o_t_id, t_o_id, serial, vendor, originator, 2000000, 2000000, 0, 0)
+        return bytes((service | 0x80, 0, 0, 0)) + reply, size
+
+    def _tag(self, path):
+        """Resolve a symbolic path to (type code, element size, value bytes, element index)."""
+        names, index, offset = [], 0, 0
+        while offset < len(path):
+            segment = path[offset]
+            if segment == 0x91:
+                length = path[offset + 1]
+                names.append(path[offset + 2:offset + 2 + length].decode('ascii'))
+                offset += 2 + length + length % 2
+            elif segment == 0x28:
+                index, offset = path[offset + 1], offset + 2
+            elif segment == 0x29:
+                index, offset = struct.unpack_from('<H', path, offset + 2)[0], offset + 4
+            else:
+                index, offset = struct.unpack_from('<I', path, offset + 2)[0], offset + 6
+        type_code, value = self.tags['.'.join(names)]
+        element = struct.calcsize(CIP_TYPES[type_code]) if type_code in CIP_TYPES else len(value)
+        return type_code, element, value, index
+
+    def _message(self, cip, room):
+        service, path_words = cip[0], cip[1]
+        path, data = cip[2:2 + path_words * 2], cip[2 + path_words * 2:]
+        if service == MULTIPLE_SERVICE_PACKET:
+            replies, used, failed = [], 6, False
+            for request in split_multiple_service(data):
+                reply = self._message(request, room)
+                if used + 2 + len(reply) > room:
+                    reply = bytes((request[0] | 0x80, 0, 0x11, 0))
+                if reply[2]:
+                    failed = True
+                used += 2 + len(reply)
+                replies.append(reply)
+            body = multiple_service_request(replies)[2 + len(MESSAGE_ROUTER_PATH):]
+            return bytes((MULTIPLE_SERVICE_PACKET | 0x80, 0, 0x1E if failed else 0, 0)) + body
+        if service not in (READ_TAG, READ_TAG_FRAGMENTED):
+            return bytes((service | 0x80, 0, 0x08, 0))
+        try:
+            type_code, element, value, index = self._tag(path)
+        except (KeyError, UnicodeDecodeError):
+            return bytes((service | 0x80, 0, 0x05, 0))
+        elements, = struct.unpack_from('<H', data)
+        value = value[index * element:(index + elements) * element]
+        type_header = struct.pack('<H', type_code) + (b'\x00\x00' if type_code == STRUCTURE_TYPE else b'')
+        start = struct.unpack_from('<I', data, 2)[0] if service == READ_TAG_FRAGMENTED else 0
+        chunk = value[start:start + room - 4 - len(type_header)]
+        status = 0x06 if start + len(chunk) < len(value) else 0x00
+        return bytes((service | 0x80, 0, status, 0)) + type_header + chunk
+
+
+def benchmark(tags=1000, rounds=20, request_delay=0.0005):
+    """Compare one Read Tag per packet with Multiple Service Packet batching, in tags/s."""
+    table = {}
+    for i in range(tags):
+        table[f"Tag{i}"] = (0xC4, struct.pack('<i', i)) if i % 2 else (0xCA, struct.pack('<f', i / 10))
+    table['Recipe'] = (0xC4, struct.pack('<2000i', *range(2000)))  # Larger than any connection
+    responder = CipResponderStandIn(table, request_delay=request_delay).start()
+    names = [f"Tag{i}" for i in range(tags)]
+
+    for size, large in ((4002, True), (504, False)):
+        responder.large = large
+        client = CipClient(*responder.address, connection_size=size).connect()
+        client.read(names)  # Learn reply sizes
+        client.stats['requests'] = client.stats['tags'] = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            values = client.read(names)
+        elapsed = time.perf_counter() - start
+        print(f"Batched, {client.connection_size}-byte connection: {client.stats['tags'] / elapsed:.0f} tags/s "
+              f"({client.stats['requests'] / rounds:.0f} packets per scan)")
+        client.close()
+
+    client = CipClient(*responder.address).connect()
+    client.stats['tags'] = 0
+    start = time.perf_counter()
+    for name in names[:tags // 4]:
+        client.read([name])
+    elapsed = time.perf_counter() - start
+    recipe = client.read([('Recipe', 2000)])['Recipe']
+    client.close()
+    responder.close()
+    print(f"One tag per packet: {client.stats['tags'] / elapsed:.0f} tags/s")
+    print(f"Sample: Tag1={values['Tag1']}, Tag2={values['Tag2']:.1f}, "
+          f"fragmented Recipe of {len(recipe)} elements ends {recipe[-1]}")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import threading
+import time
+
+import aiocoap  # For CoAP
+import aiocoap.resource
+
+
+class CoapObserver:
+    """CoAP client that subscribes with Observe instead of polling.
+
+    All resources share one aiocoap client context running on a background
+    asyncio loop, so many devices are multiplexed over a single socket.
+    Large representations are fetched with block-wise transfer (Block2),
+    which aiocoap reassembles before the callback sees them. If a device
+    ends an observation or stops answering, it is re-registered after
+    retry_delay seconds.
+    """
+
+    def __init__(self, retry_delay=5.0):
+        self.retry_delay = retry_delay
+        self.stats = {'requests': 0, 'notifications': 0, 'reregistrations': 0}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._context = None
+        self._tasks = {}
+
+    def start(self):
+        """Start the event loop and create the shared client context."""
+        self._thread.start()
+        self._context = self._run(aiocoap.Context.create_client_context())
+        return self
+
+    def _run(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def get(self, uri, timeout=30):
+        """Fetch a resource once (block-wise if large) and return its payload."""
+        async def fetch():
+            self.stats['requests'] += 1
+            response = await self._context.request(aiocoap.Message(code=aiocoap.GET, uri=uri)).response
+            if not response.code.is_successful():
+                raise IOError(f"CoAP GET {uri} failed: {response.code}")
+            return response.payload
+        return self._run(fetch(), timeout)
+
+    def observe(self, uri, callback):
+        """Subscribe to a resource; callback(uri, payload) runs on every notification."""
+        if uri in self._tasks:
+            raise ValueError(f"Already observing {uri}")
+        self._tasks[uri] = asyncio.run_coroutine_threadsafe(self._observe(uri, callback), self._loop)
+
+    async def _observe(self, uri, callback):
+        while True:
+            request = self._context.request(aiocoap.Message(code=aiocoap.GET, uri=uri, observe=0))
+            self.stats['requests'] += 1
+            try:
+                response = await request.response
+                self._notify(uri, response, callback)
+                async for response in request.observation:
+                    self._notify(uri, response, callback)
+                logging.info(f"CoAP observation of {uri} ended by the server")
+            except asyncio.CancelledError:
+                if request.observation is not None:
+                    request.observation.cancel()
+                raise
+            except Exception as e:
+                logging.warning(f"CoAP observation of {uri} failed: {e}")
+            self.stats['reregistrations'] += 1
+            await asyncio.sleep(self.retry_delay)
+
+    def _notify(self, uri, response, callback):
+        self.stats['notifications'] += 1
+        if response.code.is_successful():
+            callback(uri, response.payload)
+        else:
+            logging.warning(f"CoAP {uri} returned {response.code}")
+
+    def unobserve(self, uri):
+        """Cancel the subscription to one resource."""
+        task = self._tasks.pop(uri, None)
+        if task is not None:
+            self._loop.call_soon_threadsafe(task.cancel)
+
+    def close(self):
+        """Cancel every subscription and shut the shared context down."""
+        for uri in list(self._tasks):
+            self.unobserve(uri)
+        if self._context is not None:
+            self._run(self._context.shutdown(), timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class _CountingResource(aiocoap.resource.ObservableResource):
+    """Observable sensor value for the local benchmark server."""
+
+    def __init__(self, payload_size=8):
+        super().__init__()
+        self.value = 0
+        self.payload_size = payload_size
+        self.requests = 0
+
+    def set(self, value):
+        self.value = value
+        self.updated_state()
+
+    async def render_get(self, request):
+        self.requests += 1
+        return aiocoap.Message(payload=str(self.value).encode().ljust(self.payload_size, b' '))
+
+
+def benchmark(duration=3.0, update_interval=0.5, poll_interval=0.05, resources=10):
+    """Compare request counts for Observe and polling against a local aiocoap server.
+
+    Each sensor changes every update_interval seconds; a poller must ask
+    every poll_interval seconds to see changes with similar latency.
+    """
+    observed = [_CountingResource() for _ in range(resources)]
+    polled = [_CountingResource() for _ in range(resources)]
+    site = aiocoap.resource.Site()
+    for i in range(resources):
+        site.add_resource(['observed', str(i)], observed[i])
+        site.add_resource(['polled', str(i)], polled[i])
+    site.add_resource(['large'], _CountingResource(payload_size=8192))
+
+    client = CoapObserver().start()
+    server = client._run(aiocoap.Context.create_server_context(site, bind=('127.0.0.1', 56830)))
+    notifications = []
+    for i in range(resources):
+        client.observe(f"coap://127.0.0.1:56830/observed/{i}", lambda uri, payload: notifications.append(payload))
+
+    start = time.monotonic()
+    next_update = next_poll = start
+    polls = 0
+    while time.monotonic() - start < duration:
+        now = time.monotonic()
+        if now >= next_update:
+            for resource in observed + polled:
+                client._loop.call_soon_threadsafe(resource.set, resource.value + 1)
+            next_update += update_interval
+        if now >= next_poll:
+            for i in range(resources):
+                client.get(f"coap://127.0.0.1:56830/polled/{i}")
+                polls += 1
+            next_poll += poll_interval
+        time.sleep(0.001)
+
+    large = client.get("coap://127.0.0.1:56830/large")
+    for i in range(resources):
+        client.unobserve(f"coap://127.0.0.1:56830/observed/{i}")
+    client._run(server.shutdown(), timeout=10)
+    client.close()
+    print(f"Observe: {sum(r.requests for r in observed)} server renders, {resources} registrations, "
+          f"{len(notifications)} notifications received")
+    print(f"Polling: {polls} GET requests for the same {resources} sensors")
+    print(f"Block-wise GET of large resource: {len(large)} bytes")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,2 @@
+# The modules live at the top of the repository; tests/ imports them from here.
+collect_ignore = ['test_kivy.py']  # Kivy smoke test, run by hand
@@ -0,0 +1,235 @@
+import logging
+import socket
+import threading
+
+from fins.tcp import TCPFinsConnection, TCPFinsMessage  # Importing TCPFinsConnection from fins package
+from fins.fins_common import FinsCommandCode, FinsPLCMemoryAreas
+
+# Word memory areas that can be named in an address string such as "D100" or "CIO5"
+MEMORY_AREAS = {
+    'D': FinsPLCMemoryAreas().DATA_MEMORY_WORD,
+    'DM': FinsPLCMemoryAreas().DATA_MEMORY_WORD,
+    'CIO': FinsPLCMemoryAreas().CIO_WORD,
+    'W': FinsPLCMemoryAreas().WORK_WORD,
+    'H': FinsPLCMemoryAreas().HOLDING_WORD,
+    'A': FinsPLCMemoryAreas().AUXILIARY_WORD,
+}
+
+MAX_MULTIPLE_READ_ITEMS = 167  # CS/CJ limit for one multiple memory area read (0104) frame
+MAX_WRITE_WORDS = 996  # Words in one memory area write (0102) frame
+FINS_HEADER_LENGTH = 10  # ICF, RSV, GCT, DNA, DA1, DA2, SNA, SA1, SA2, SID
+TCP_HEADER_LENGTH = 16  # 'FINS', length, command, error code
+MAX_TCP_LENGTH = 8 + 2012  # Command and error code, then the largest FINS frame
+# Commands that only read, so sending them again after a lost connection has no side effects
+IDEMPOTENT_COMMANDS = {FinsCommandCode().MEMORY_AREA_READ, FinsCommandCode().MULTIPLE_MEMORY_AREA_READ,
+                       FinsCommandCode().CPU_UNIT_STATUS_READ, FinsCommandCode().CLOCK_READ}
+
+
+def parse_address(address):
+    """Split an address like "D100" or ("CIO", 5) into (memory area code, word)."""
+    if isinstance(address, tuple):
+        area, word = address
+    else:
+        area = address.rstrip('0123456789')
+        word = address[len(area):]
+    area = area.upper()
+    if area not in MEMORY_AREAS or word == '':
+        raise ValueError(f"Unsupported FINS address: {address}")
+    return MEMORY_AREAS[area], int(word)
+
+
+def build_multiple_read_text(addresses):
+    """Build the 0104 command text for a list of (area code, word) pairs."""
+    text = b''
+    for area_code, word in addresses:
+        text += area_code + word.to_bytes(2, 'big') + b'\x00'
+    return text
+
+
+def parse_multiple_read_response(response, count):
+    """Return the word values from a 0104 response frame."""
+    end_code = response[FINS_HEADER_LENGTH + 2:FINS_HEADER_LENGTH + 4]
+    if end_code != b'\x00\x00':
+        raise IOError(f"FINS multiple memory area read failed, end code {end_code.hex()}")
+    data = response[FINS_HEADER_LENGTH + 4:]
+    if len(data) < count * 3:
+        raise IOError(f"FINS response too short: expected {count} items, got {len(data) // 3}")
+    # Each item comes back as one area code byte followed by the word value
+    return [int.from_bytes(data[i * 3 + 1:i * 3 + 3], 'big') for i in range(count)]
+
+
+FINS_FRAME_SEND_ERROR = 3  # FINS/TCP command for "FINS frame send error notification"
+REPLY_COMMANDS = {0: 1}  # Client node address send (0) is answered with 1; FINS frames (2) with 2
+
+
+def plan_word_writes(values):
+    """Group {address: value} into runs of consecutive words in one area: [(first address, [values])].
+
+    Each run can go to the PLC as a single 0102 command. When two keys name
+    the same word (D100 and d100), the one that comes later in values wins.
+    """
+    runs = []
+    previous = None
+    for parsed, _, address, value in sorted((parse_address(address), order, address, int(value))
+                                            for order, (address, value) in enumerate(values.items())):
+        if previous == parsed:
+            runs[-1][1][-1] = value
+        elif (previous is not None and parsed[0] == previous[0] and parsed[1] == previous[1] + 1
+              and len(runs[-1][1]) < MAX_WRITE_WORDS):
+            runs[-1][1].append(value)
+        else:
+            runs.append((address, [value]))
+        previous = parsed
+    return runs
+
+
+def _recv_exactly(sock, count):
+    data = bytearray()
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed by PLC")
+        data += chunk
+    return bytes(data)
+
+
+class FramedTCPFinsConnection(TCPFinsConnection):
+    """TCPFinsConnection that reads each reply by its FINS/TCP length field.
+
+    The fins package makes one recv() per reply, which can return part of a
+    frame, or the tail of a late reply followed by the next one. Here the
+    16-byte header is read first and then exactly the length it declares;
+    anything that does not parse raises ConnectionError so the caller drops
+    the socket rather than reading the next reply out of step.
+    """
+
+    def tcp_send_command(self, command, data=b''):
+        self.fins_socket.sendall(TCPFinsMessage(command, data).bytes())
+        header = _recv_exactly(self.fins_socket, TCP_HEADER_LENGTH)
+        length = int.from_bytes(header[4:8], 'big')
+        if header[:4] != b'FINS' or not 8 <= length <= MAX_TCP_LENGTH:
+            raise ConnectionError(f"Bad FINS/TCP header {header.hex()}")
+        if header[12:16] != b'\x00\x00\x00\x00':
+            raise ConnectionError(f"FINS/TCP error code {header[12:16].hex()}")
+        reply = int.from_bytes(header[8:12], 'big')
+        if reply == FINS_FRAME_SEND_ERROR:
+            raise ConnectionError("FINS frame send error notification from PLC")
+        if reply != REPLY_COMMANDS.get(command, command):  # Node address 0 -> 1, FINS frames come back as 2
+            raise ConnectionError(f"Unexpected FINS/TCP command {header[8:12].hex()} in reply to {command}")
+        response = TCPFinsMessage(0)
+        response.from_bytes(header + _recv_exactly(self.fins_socket, length - 8))
+        return response
+
+
+class FinsClientManager:
+    """Keep one persistent FINS/TCP connection per PLC (ip:port)."""
+
+    def __init__(self, timeout=2.0, connect_timeout=5.0):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._connections = {}  # (ip_address, port) -> TCPFinsConnection
+        self._locks = {}  # (ip_address, port) -> lock serialising requests on that socket
+        self._lock = threading.Lock()
+
+    def _open(self, ip_address, port):
+        connection = FramedTCPFinsConnection()
+        connection.BUFFER_SIZE = 4096  # Room for a full 0104 response
+        connection.fins_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        connection.fins_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.fins_socket.settimeout(self.timeout)  # connect() restores this for the node address exchange
+        connection.connect(ip_address, port, connection_timeout=self.connect_timeout)
+        logging.info(f"FINS connection established to {ip_address}:{port}")
+        return connection
+
+    def get_connection(self, ip_address, port=9600):
+        """Return the live connection for a PLC, connecting on first use."""
+        key = (ip_address, int(port))
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._connections:
+                self._connections[key] = self._open(*key)
+            return self._connections[key]
+
+    def execute(self, ip_address, port, command_code, text=b'', retry=None):
+        """Send one FINS command, reconnecting once if the socket has dropped.
+
+        The command is only sent again on the new connection when retry is
+        true, which defaults to read commands: a write that timed out may
+        already have been carried out by the PLC.
+        """
+        key = (ip_address, int(port))
+        if retry is None:
+            retry = command_code in IDEMPOTENT_COMMANDS
+        self.get_connection(*key)
+        with self._locks[key]:
+            for attempt in range(2 if retry else 1):
+                connection = self._connections.get(key)
+                try:
+                    if connection is None:
+                        connection = self._connections[key] = self._open(*key)
+                    response = connection.execute_fins_command_frame(
+                        connection.fins_command_frame(command_code, text))
+                    if not response:
+                        raise ConnectionError("connection closed by PLC")
+                    return response
+                except OSError as e:
+                    logging.warning(f"FINS connection to {ip_address}:{port} lost: {e}")
+                    self._drop(key)
+                    if attempt == 1 or not retry:
+                        raise
+
+    def read_multiple(self, ip_address, port, addresses):
+        """Read scattered DM/CIO/W/H/A words with as few 0104 round trips as possible.
+
+        addresses is a list of strings like "D100" or (area, word) tuples. Values
+        come back in the same order as the addresses.
+        """
+        parsed = [parse_address(address) for address in addresses]
+        values = []
+        for start in range(0, len(parsed), MAX_MULTIPLE_READ_ITEMS):
+            chunk = parsed[start:start + MAX_MULTIPLE_READ_ITEMS]
+            response = self.execute(ip_address, port, FinsCommandCode().MULTIPLE_MEMORY_AREA_READ,
+                                    build_multiple_read_text(chunk))
+            values.extend(parse_multiple_read_response(response, len(chunk)))
+        return values
+
+    def write_words(self, ip_address, port, address, values):
+        """Write consecutive words from an address like "D100" with one 0102 command.
+
+        A write that times out is not sent again (see execute).
+        """
+        area_code, word = parse_address(address)
+        if not values or any(not 0 <= value <= 0xFFFF for value in values):
+            raise ValueError(f"FINS word values must be 0-65535: {values}")
+        text = area_code + word.to_bytes(2, 'big') + b'\x00' + len(values).to_bytes(2, 'big')
+        text += b''.join(value.to_bytes(2, 'big') for value in values)
+        response = self.execute(ip_address, port, FinsCommandCode().MEMORY_AREA_WRITE, text)
+        end_code = response[FINS_HEADER_LENGTH + 2:FINS_HEADER_LENGTH + 4]
+        if end_code != b'\x00\x00':
+            raise IOError(f"FINS memory area write failed, end code {end_code.hex()}")
+
+    def write_many(self, ip_address, port, values):
+        """Write {address: value} words with one 0102 command per run of consecutive words."""
+        for address, words in plan_word_writes(values):
+            self.write_words(ip_address, port, address, words)
+
+    def _drop(self, key):
+        connection = self._connections.pop(key, None)
+        if connection is not None:
+            try:
+                connection.fins_socket.close()
+            except OSError:
+                pass
+
+    def close(self, ip_address, port=9600):
+        """Close the connection to one PLC."""
+        key = (ip_address, int(port))
+        with self._locks.get(key, self._lock):
+            self._drop(key)
+        logging.info(f"FINS connection to {ip_address}:{port} closed")
+
+    def close_all(self):
+        """Close every pooled connection."""
+        for ip_address, port in list(self._connections):
+            self.close(ip_address, port)
@@ -0,0 +1,259 @@
+import logging
+import select
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+from fins.fins_common import FinsCommandCode
+
+from fins_pool import (FINS_HEADER_LENGTH, MAX_MULTIPLE_READ_ITEMS, build_multiple_read_text,
+                       parse_address, parse_multiple_read_response)
+
+SID_OFFSET = 9  # Service ID position in the FINS header
+SOURCE_NODE_OFFSET = 7  # SA1: the responding node in a reply
+COMMAND_CODE_SLICE = slice(10, 12)
+
+
+class FinsUdpClient:
+    """Non-blocking FINS/UDP client that keeps many requests in flight.
+
+    Every request is tagged with its own Service ID (SID) and the reply is
+    matched back by SID, so up to max_in_flight commands can be outstanding
+    on one socket. Requests that get no reply within timeout are resent with
+    the same SID until retries runs out.
+    """
+
+    def __init__(self, ip_address, port=9600, dest_node=None, src_node=None,
+                 timeout=1.0, retries=2, max_in_flight=64):
+        if not 1 <= max_in_flight <= 255:
+            raise ValueError("max_in_flight must be between 1 and 255")
+        self.address = (ip_address, int(port))
+        # FINS/UDP node numbers default to the last octet of each IP address
+        self.dest_node = dest_node if dest_node is not None else int(ip_address.split('.')[-1]) & 0xFF
+        self.src_node = src_node
+        self.timeout = timeout
+        self.retries = retries
+        self.max_in_flight = max_in_flight
+        self.stats = {'sent': 0, 'received': 0, 'retransmits': 0, 'timeouts': 0, 'unmatched': 0, 'send_errors': 0}
+        self._socket = None
+        self._pending = {}  # sid -> [future, frame, deadline, attempts_left]
+        self._next_sid = 0
+        self._window = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Open the UDP socket and start the receive/retransmit thread."""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.connect(self.address)
+        if self.src_node is None:
+            self.src_node = int(self._socket.getsockname()[0].split('.')[-1]) & 0xFF
+        self._running = True
+        self._thread = threading.Thread(target=self._receive_loop, daemon=True)
+        self._thread.start()
+        logging.info(f"FINS/UDP client started for {self.address[0]}:{self.address[1]}")
+        return self
+
+    def close(self):
+        """Stop the client and fail any requests still in flight."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            for sid in list(self._pending):
+                self._finish(sid, exception=ConnectionError("FINS/UDP client closed"))
+        if self._socket is not None:
+            self._socket.close()
+        logging.info(f"FINS/UDP client for {self.address[0]}:{self.address[1]} closed")
+
+    def _allocate_sid(self):
+        for _ in range(255):
+            self._next_sid = self._next_sid % 255 + 1  # SID 0 is left unused
+            if self._next_sid not in self._pending:
+                return self._next_sid
+        raise RuntimeError("No free FINS Service ID")
+
+    def _frame(self, sid, command_code, text):
+        header = bytes([0x80, 0x00, 0x02, 0x00, self.dest_node, 0x00, 0x00, self.src_node, 0x00, sid])
+        return header + command_code + text
+
+    def send_command(self, command_code, text=b''):
+        """Send a FINS command and return a Future for the response frame.
+
+        Blocks only while max_in_flight requests are already outstanding.
+        If the datagram cannot be sent (an unreachable peer shows up as
+        ConnectionRefusedError on a connected UDP socket) the Future fails
+        with that error.
+        """
+        self._window.acquire()
+        future = Future()
+        with self._lock:
+            sid = self._allocate_sid()
+            frame = self._frame(sid, command_code, text)
+            self._pending[sid] = [future, frame, time.monotonic() + self.timeout, self.retries]
+            if self._send(sid, frame):
+                self.stats['sent'] += 1
+        return future
+
+    def _send(self, sid, frame):
+        """Send a request frame; on failure finish its SID with the error. Called with the lock held."""
+        try:
+            self._socket.send(frame)
+        except OSError as e:
+            self.stats['send_errors'] += 1
+            logging.warning(f"FINS/UDP send of SID {sid} to {self.address[0]} failed: {e}")
+            self._finish(sid, exception=e)
+            return False
+        return True
+
+    def request(self, command_code, text=b''):
+        """Send a FINS command and wait for its response frame."""
+        return self.send_command(command_code, text).result()
+
+    def read_multiple(self, addresses):
+        """Read scattered words using 0104 frames issued concurrently; returns a list of values."""
+        parsed = [parse_address(address) for address in addresses]
+        chunks = [parsed[i:i + MAX_MULTIPLE_READ_ITEMS] for i in range(0, len(parsed), MAX_MULTIPLE_READ_ITEMS)]
+        futures = [self.send_command(FinsCommandCode().MULTIPLE_MEMORY_AREA_READ, build_multiple_read_text(chunk))
+                   for chunk in chunks]
+        values = []
+        for future, chunk in zip(futures, chunks):
+            values.extend(parse_multiple_read_response(future.result(), len(chunk)))
+        return values
+
+    def _finish(self, sid, response=None, exception=None):
+        future = self._pending.pop(sid)[0]
+        self._window.release()
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(response)
+
+    def _receive_loop(self):
+        while self._running:
+            with self._lock:
+                deadlines = [entry[2] for entry in self._pending.values()]
+            wait = max(0.0, min(deadlines) - time.monotonic()) if deadlines else 0.1
+            readable, _, _ = select.select([self._socket], [], [], min(wait, 0.1))
+            if readable:
+                self._drain_socket()
+            self._check_timeouts()
+
+    def _drain_socket(self):
+        while True:
+            try:
+                response = self._socket.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logging.warning(f"FINS/UDP receive error from {self.address[0]}: {e}")
+                return
+            if len(response) <= FINS_HEADER_LENGTH:
+                continue
+            sid = response[SID_OFFSET]
+            with self._lock:
+                entry = self._pending.get(sid)
+                # A late reply to a failed request can carry a SID that has since been reused, so the
+                # responding node and command code must match the request too
+                if (entry is not None and response[SOURCE_NODE_OFFSET] == self.dest_node
+                        and response[COMMAND_CODE_SLICE] == entry[1][COMMAND_CODE_SLICE]):
+                    self.stats['received'] += 1
+                    self._finish(sid, response=response)
+                else:
+                    self.stats['unmatched'] += 1  # Late reply to a request that was already retried or failed
+
+    def _check_timeouts(self):
+        now = time.monotonic()
+        with self._lock:
+            for sid, entry in list(self._pending.items()):
+                if entry[2] > now:
+                    continue
+                if entry[3] > 0:
+                    entry[3] -= 1
+                    entry[2] = now + self.timeout
+                    if self._send(sid, entry[1]):
+                        self.stats['retransmits'] += 1
+                else:
+                    self.stats['timeouts'] += 1
+                    logging.warning(f"FINS/UDP request SID {sid} to {self.address[0]} timed out")
+                    self._finish(sid, exception=TimeoutError(f"FINS/UDP request SID {sid} timed out"))
+
+
+class FinsUdpResponder:
+    """Local FINS/UDP responder stand-in for testing without a PLC.
+
+    Answers 0104 multiple memory area reads with each word's address as its
+    value and echoes the request SID, swapping the node addresses like a PLC.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, drop_every=0):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self._socket.settimeout(0.1)
+        self.address = self._socket.getsockname()
+        self.drop_every = drop_every  # Drop every Nth request to exercise retransmits
+        self.requests = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        self._socket.close()
+
+    def _serve(self):
+        while self._running:
+            try:
+                frame, peer = self._socket.recvfrom(4096)
+            except socket.timeout:
+                continue
+            self.requests += 1
+            if self.drop_every and self.requests % self.drop_every == 0:
+                continue
+            header = bytes([0xC0, 0x00, 0x02, frame[6], frame[7], frame[8], frame[3], frame[4], frame[5], frame[9]])
+            command_code, text = frame[10:12], frame[12:]
+            data = b''
+            if command_code == FinsCommandCode().MULTIPLE_MEMORY_AREA_READ:
+                for i in range(0, len(text), 4):
+                    data += text[i:i + 1] + text[i + 1:i + 3]
+            self._socket.sendto(header + command_code + b'\x00\x00' + data, peer)
+
+
+def benchmark(requests=5000, in_flight=64):
+    """Measure round-trip latency and throughput against the local responder."""
+    responder = FinsUdpResponder().start()
+    client = FinsUdpClient(*responder.address, timeout=0.5, max_in_flight=in_flight).start()
+    text = build_multiple_read_text([parse_address('D100')])
+    command_code = FinsCommandCode().MULTIPLE_MEMORY_AREA_READ
+    try:
+        latencies = []
+        for _ in range(min(requests, 1000)):
+            start = time.perf_counter()
+            client.request(command_code, text)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        start = time.perf_counter()
+        futures = [client.send_command(command_code, text) for _ in range(requests)]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+    finally:
+        client.close()
+        responder.close()
+    print(f"Round-trip latency: median {latencies[len(latencies) // 2] * 1e6:.0f} us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f} us")
+    print(f"Throughput with {in_flight} in flight: {requests / elapsed:.0f} requests/s")
+    print(f"Client stats: {client.stats}")
+
+
+if __name__ == '__main__':
+    benchmark()
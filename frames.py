@@ -0,0 +1,197 @@
+import os
+import select
+import time
+
+import numpy as np
+import serial  # For serial communication
+
+CHARACTER_BITS = 10  # Start bit, 8 data bits, stop bit
+
+
+def character_time_ns(baudrate, bits=CHARACTER_BITS):
+    """Time one character occupies on the line, in nanoseconds."""
+    return bits * 1_000_000_000 // baudrate
+
+
+class Frame:
+    """Bytes that crossed a port, with time.monotonic_ns() stamps.
+
+    first_ns and last_ns are when the first and last byte were received
+    (for a received frame) or when the write started (for a sent one);
+    done_ns is when the write completed, after the output was drained if
+    the writer waited for that. A received frame that was passed on, as
+    by PortBridge, has done_ns set to when it was written to the other
+    port; frames that were only received have done_ns None.
+    fields holds decoded protocol fields when a decoder has seen the frame.
+    """
+
+    __slots__ = ('port', 'data', 'direction', 'first_ns', 'last_ns', 'done_ns', 'fields')
+
+    def __init__(self, port, data, direction='rx', first_ns=0, last_ns=0, done_ns=None):
+        self.port = port
+        self.data = data
+        self.direction = direction
+        self.first_ns = first_ns
+        self.last_ns = last_ns
+        self.done_ns = done_ns
+        self.fields = None
+
+    @property
+    def end_ns(self):
+        """When the frame was complete on this side: write completion or last byte received."""
+        return self.done_ns if self.done_ns is not None else self.last_ns
+
+    def timing(self, after=None):
+        """Short description of the frame's timing for log lines, relative to another frame if given."""
+        if self.done_ns is not None:
+            text = f"write {(self.done_ns - self.first_ns) / 1e6:.3f} ms"
+        else:
+            text = f"{len(self.data)} bytes over {(self.last_ns - self.first_ns) / 1e6:.3f} ms"
+        if after is not None:
+            text += f", {(self.first_ns - after.end_ns) / 1e6:.3f} ms after {after.direction}"
+        return text
+
+    def __repr__(self):
+        return (f"Frame({self.port}, {self.direction}, {self.data.hex(' ')}, first_ns={self.first_ns}, "
+                f"last_ns={self.last_ns}, done_ns={self.done_ns})")
+
+
+def _readable(ser, timeout):
+    """Wait up to timeout seconds for ser to have input; True if it has."""
+    fd = getattr(ser, 'fd', None)
+    if fd is not None:
+        return bool(select.select([fd], [], [], max(0.0, timeout))[0])
+    deadline = time.monotonic() + timeout
+    while not ser.in_waiting:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.0002)
+    return True
+
+
+def _read_available(ser):
+    fd = getattr(ser, 'fd', None)
+    if fd is not None:
+        return os.read(fd, 4096)
+    return ser.read(ser.in_waiting or 1)
+
+
+def read_frame(ser, timeout, gap_ns=None):
+    """Read one frame: wait up to timeout for a first byte, then collect until the line is quiet for gap_ns.
+
+    gap_ns defaults to 3.5 character times, but at least 2 ms so a USB
+    adapter's transfer scheduling is not taken for the end of the frame.
+    Returns None if nothing arrived. The first byte is dated back by the
+    character time of the bytes read along with it, but not to before the
+    call, so a response is never stamped ahead of the request written
+    just before it (a pty, or input already buffered, has no line time).
+    """
+    char_ns = character_time_ns(ser.baudrate)
+    if gap_ns is None:
+        gap_ns = max(35 * char_ns // 10, 2_000_000)
+    called_ns = time.monotonic_ns()
+    if not _readable(ser, timeout):
+        return None
+    data = bytearray(_read_available(ser))
+    last_ns = time.monotonic_ns()
+    first_ns = max(last_ns - (len(data) - 1) * char_ns, called_ns)
+    while _readable(ser, gap_ns / 1e9):
+        chunk = _read_available(ser)
+        if not chunk:
+            break
+        data += chunk
+        last_ns = time.monotonic_ns()
+    return Frame(ser.port, bytes(data), 'rx', first_ns, last_ns)
+
+
+def write_frame(ser, data, drain=True):
+    """Write data and return it as a sent Frame; with drain, done_ns is when the output has left the UART."""
+    first_ns = time.monotonic_ns()
+    ser.write(data)
+    last_ns = time.monotonic_ns()
+    if drain:
+        ser.flush()  # tcdrain on POSIX: returns once the bytes are on the wire
+    return Frame(ser.port, bytes(data), 'tx', first_ns, last_ns, time.monotonic_ns())
+
+
+class LatencyStats:
+    """Ring buffer of latencies in nanoseconds with a percentile report, for any pair of timestamps."""
+
+    def __init__(self, history=100000):
+        self.count = 0
+        self._values = np.zeros(history, dtype=np.int64)
+
+    def add(self, latency_ns):
+        self._values[self.count % len(self._values)] = latency_ns
+        self.count += 1
+
+    def add_exchange(self, request, response):
+        """Record the turnaround from the request's completion to the response's first byte."""
+        self.add(response.first_ns - request.end_ns)
+
+    def report(self):
+        """Latency percentiles in milliseconds, or only the count while there are no samples."""
+        count = min(self.count, len(self._values))
+        if not count:
+            return {'count': 0}
+        values = self._values[:count] / 1e6
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return {'count': self.count, 'min': float(values.min()), 'p50': float(p50), 'p90': float(p90),
+                'p99': float(p99), 'max': float(values.max())}
+
+
+def benchmark(frames=20000, size=16):
+    """Per-frame cost of timestamped reads and writes over a pty, against bare os.read/os.write."""
+    import tty  # Unix only, like the pty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    ser = serial.Serial(os.ttyname(slave), baudrate=115200, timeout=0)
+    payload = bytes(range(size))
+
+    start = time.perf_counter_ns()
+    for _ in range(frames):
+        os.write(master, payload)
+        select.select([ser.fd], [], [], 1.0)
+        os.read(ser.fd, 4096)
+    bare_rx = (time.perf_counter_ns() - start) / frames
+    start = time.perf_counter_ns()
+    for _ in range(frames):
+        os.write(master, payload)
+        read_frame(ser, 1.0, gap_ns=0)
+    framed_rx = (time.perf_counter_ns() - start) / frames
+
+    start = time.perf_counter_ns()
+    for _ in range(frames):
+        os.write(ser.fd, payload)
+        os.read(master, 4096)
+    bare_tx = (time.perf_counter_ns() - start) / frames
+    start = time.perf_counter_ns()
+    for _ in range(frames):
+        write_frame(ser, payload, drain=False)
+        os.read(master, 4096)
+    framed_tx = (time.perf_counter_ns() - start) / frames
+
+    stats = LatencyStats()
+    start = time.perf_counter_ns()
+    for _ in range(frames):
+        request = Frame('bench', payload, 'tx', 1, 2, 3)
+        response = Frame('bench', payload, 'rx', 10, 20)
+        stats.add_exchange(request, response)
+    bookkeeping = (time.perf_counter_ns() - start) / frames / 2
+    ser.close()
+    os.close(master)
+    os.close(slave)
+
+    budget = character_time_ns(115200) * size
+    print(f"{size}-byte frames over a pty, {frames} each:")
+    print(f"Receive: bare {bare_rx / 1e3:.1f} us, read_frame {framed_rx / 1e3:.1f} us "
+          f"(+{(framed_rx - bare_rx) / 1e3:.1f} us per frame)")
+    print(f"Send:    bare {bare_tx / 1e3:.1f} us, write_frame {framed_tx / 1e3:.1f} us "
+          f"(+{(framed_tx - bare_tx) / 1e3:.1f} us per frame)")
+    print(f"Frame object plus latency sample: {bookkeeping:.0f} ns per frame")
+    print(f"A {size}-byte frame takes {budget / 1e3:.0f} us on the wire at 115200 baud")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,188 @@
+import logging
+import time
+
+MAX_FRAME_LENGTH = 131  # Longest first Host Link frame, FCS and terminator included
+MAX_CONTINUATION_LENGTH = 128  # Longest frame after the first one of a multi-frame command
+MAX_ADDRESS = 9999  # Word addresses are sent as four decimal digits
+FIRST_RESPONSE_WORDS = 30  # Words that fit in a single-frame RD response
+MAX_READ_WORDS = 9999  # Largest word count an RD command accepts
+
+# C-mode header codes for word reads and writes, by memory area
+READ_HEADERS = {'CIO': 'RR', 'LR': 'RL', 'HR': 'RH', 'DM': 'RD', 'AR': 'RJ'}
+WRITE_HEADERS = {'CIO': 'WR', 'LR': 'WL', 'HR': 'WH', 'DM': 'WD', 'AR': 'WJ'}
+NO_END_CODE_HEADERS = {'TS'}  # Responses that echo data straight after the header code
+
+END_CODES = {
+    '00': 'Normal completion',
+    '01': 'Not executable in RUN mode',
+    '02': 'Not executable in MONITOR mode',
+    '04': 'Address over',
+    '13': 'FCS error',
+    '14': 'Format error',
+    '15': 'Entry number data error',
+    '18': 'Frame length error',
+    '19': 'Not executable',
+    '23': 'User memory protected',
+    'A3': 'Aborted due to FCS error in transmission data',
+    'A4': 'Aborted due to format error in transmission data',
+    'A5': 'Aborted due to entry number data error in transmission data',
+    'A8': 'Aborted due to frame length error in transmission data',
+}
+
+
+class HostLinkError(IOError):
+    """Raised when a Host Link frame is malformed or the PLC returns an error end code."""
+
+
+def compute_fcs(frame):
+    """Return the FCS of a frame: the XOR of every character, as two hex digits."""
+    fcs = 0
+    for char in frame.encode('ascii'):
+        fcs ^= char
+    return f"{fcs:02X}"
+
+
+def plan_dm_reads(addresses, max_words=FIRST_RESPONSE_WORDS):
+    """Group DM addresses into (start, count) reads no longer than max_words.
+
+    Addresses close enough to share one read are merged, so reading D100, D101
+    and D120 takes a single RD command instead of three.
+    """
+    reads = []
+    for address in sorted(set(addresses)):
+        if reads and address - reads[-1][0] < max_words:
+            reads[-1][1] = address - reads[-1][0] + 1
+        else:
+            reads.append([address, 1])
+    return [tuple(read) for read in reads]
+
+
+class HostLink:
+    """Host Link (C-mode and FINS) engine on top of an open pyserial port."""
+
+    def __init__(self, ser, unit=0, timeout=1.0):
+        self.ser = ser
+        self.unit = unit
+        self.timeout = timeout
+
+    def _read_frame(self):
+        """Read one frame up to its CR terminator."""
+        frame = b''
+        deadline = time.monotonic() + self.timeout
+        while not frame.endswith(b'\r'):
+            chunk = self.ser.read_until(b'\r')
+            frame += chunk
+            if not chunk and time.monotonic() > deadline:
+                raise HostLinkError(f"Host Link response timed out after {frame!r}")
+        return frame.decode('ascii')
+
+    def _send_frames(self, body, data, unit_size):
+        """Send a command, splitting data across frames on unit_size boundaries if needed."""
+        first = True
+        while True:
+            limit = MAX_FRAME_LENGTH if first else MAX_CONTINUATION_LENGTH
+            room = limit - len(body) - 4  # Leave room for FCS, '*' and CR
+            take = max(0, room // unit_size * unit_size)
+            body, data = body + data[:take], data[take:]
+            if not data:
+                self.ser.write((body + compute_fcs(body) + '*\r').encode('ascii'))
+                return
+            self.ser.write((body + compute_fcs(body) + '\r').encode('ascii'))
+            reply = self._read_frame()
+            if first and reply.startswith('@'):
+                self._check_response(reply[:-1], body[3:5])  # PLC rejected the first frame
+            first = False
+            body = ''
+
+    def _check_response(self, frame, header):
+        """Validate the FCS and end code of a response frame and return the frame body."""
+        if frame.endswith('*'):
+            frame = frame[:-1]
+        body, fcs = frame[:-2], frame[-2:]
+        if compute_fcs(body) != fcs:
+            raise HostLinkError(f"FCS mismatch in Host Link response {frame!r}")
+        if frame.startswith('@'):
+            if body[3:5] != header:
+                raise HostLinkError(f"Unexpected Host Link header {body[3:5]} for {header} command")
+            end_code = body[5:7]
+            if header not in NO_END_CODE_HEADERS and end_code != '00':
+                raise HostLinkError(f"Host Link {header} failed: {end_code} {END_CODES.get(end_code, 'Unknown error')}")
+        return body
+
+    def command(self, header, text='', data='', unit_size=4):
+        """Send a C-mode command and return the response data as a string.
+
+        text holds the fixed parameters; data holds repeated items (such as
+        words to write) that may be split across frames. Multi-frame
+        responses are collected by answering each intermediate frame with CR.
+        """
+        body = f"@{self.unit:02d}{header}{text}"
+        self.ser.reset_input_buffer()
+        self._send_frames(body, data, unit_size)
+        frame = self._read_frame()[:-1]
+        result = self._check_response(frame, header)[5 if header in NO_END_CODE_HEADERS else 7:]
+        while not frame.endswith('*'):
+            self.ser.write(b'\r')  # Request the next frame of a multi-frame response
+            frame = self._read_frame()[:-1]
+            result += self._check_response(frame, header)
+        logging.debug(f"Host Link {header} response: {result}")
+        return result
+
+    def read_words(self, area, start, count):
+        """Read count words from a memory area (CIO, LR, HR, DM or AR)."""
+        if not 1 <= count <= MAX_READ_WORDS:
+            raise ValueError(f"Word count must be between 1 and {MAX_READ_WORDS}")
+        if not 0 <= start <= MAX_ADDRESS:
+            raise ValueError(f"Start address must be between 0 and {MAX_ADDRESS}")
+        data = self.command(READ_HEADERS[area], f"{start:04d}{count:04d}")
+        if len(data) < count * 4:
+            raise HostLinkError(f"Expected {count} words, got {len(data) // 4}")
+        return [int(data[i:i + 4], 16) for i in range(0, count * 4, 4)]
+
+    def write_words(self, area, start, values):
+        """Write a list of word values to a memory area."""
+        if not 0 <= start <= MAX_ADDRESS:
+            raise ValueError(f"Start address must be between 0 and {MAX_ADDRESS}")
+        self.command(WRITE_HEADERS[area], f"{start:04d}", ''.join(f"{value & 0xFFFF:04X}" for value in values))
+
+    def read_dm(self, start, count):
+        """Read consecutive DM words (RD)."""
+        return self.read_words('DM', start, count)
+
+    def write_dm(self, start, values):
+        """Write consecutive DM words (WD)."""
+        self.write_words('DM', start, values)
+
+    def read_dm_batch(self, addresses, max_words=FIRST_RESPONSE_WORDS):
+        """Read scattered DM addresses with as few RD commands as possible.
+
+        Returns a dict of address -> value.
+        """
+        values = {}
+        wanted = set(addresses)
+        for start, count in plan_dm_reads(addresses, max_words):
+            for offset, value in enumerate(self.read_dm(start, count)):
+                if start + offset in wanted:
+                    values[start + offset] = value
+        return values
+
+    def read_status(self):
+        """Read the PLC operating status (MS) and return the raw status data."""
+        return self.command('MS')
+
+    def change_mode(self, mode):
+        """Change the PLC operating mode (SC): 0 PROGRAM, 2 MONITOR, 3 RUN."""
+        self.command('SC', f"{mode:02d}")
+
+    def test(self, text='HOSTLINK'):
+        """Run the TS echo test and return True when the PLC echoes the text back."""
+        return self.command('TS', text) == text
+
+    def fins(self, command_code, text=b'', response_wait=0):
+        """Send a FINS command over Host Link (FA) and return the response data bytes."""
+        params = f"{response_wait:X}" + '00' * 4  # Wait time, then ICF, DA2, SA2 and SID
+        response = self.command('FA', params + command_code.hex().upper(), text.hex().upper(), unit_size=2)
+        end_code = response[12:16]  # After ICF/DA2/SA2/SID and the echoed command code
+        if end_code != '0000':
+            raise HostLinkError(f"FINS over Host Link failed with end code {end_code}")
+        return bytes.fromhex(response[16:])
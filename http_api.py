@@ -0,0 +1,263 @@
+import hmac
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_BODY = 4 * 1024 * 1024  # Largest request body accepted
+
+
+class TagTable:
+    """Thread-safe tag values with a version number that changes on every update."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def update(self, values):
+        """Merge a dict of tag -> value, bumping the version only if something changed."""
+        with self._lock:
+            changed = False
+            for name, value in values.items():
+                if self._values.get(name, object()) != value:
+                    self._values[name] = value
+                    changed = True
+            if changed:
+                self.version += 1
+
+    def snapshot(self):
+        """Return (version, copy of all values)."""
+        with self._lock:
+            return self.version, dict(self._values)
+
+    def read(self, names):
+        with self._lock:
+            return {name: self._values.get(name) for name in names}
+
+
+class LatencyHistogram:
+    """Request latencies per endpoint in power-of-two microsecond buckets."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        bucket = max(1, int(seconds * 1e6)).bit_length()  # Bucket n holds [2**(n-1), 2**n) us
+        with self._lock:
+            counts = self._buckets.setdefault(endpoint, {})
+            counts[bucket] = counts.get(bucket, 0) + 1
+
+    def report(self):
+        """Return endpoint -> {'<N us': count} with buckets in ascending order."""
+        with self._lock:
+            return {endpoint: {f"<{2 ** bucket}us": counts[bucket] for bucket in sorted(counts)}
+                    for endpoint, counts in self._buckets.items()}
+
+
+class DeviceApiServer:
+    """Embedded HTTP/JSON API for reading tags, writing values and sending raw frames.
+
+    Endpoints (HTTP/1.1 with keep-alive):
+      GET  /tags               all tags; honours If-None-Match with the snapshot ETag
+      GET  /tags/<name>        one tag
+      POST /tags/read          {"tags": [...]} -> {"values": {...}}
+      PUT  /tags/<name>        {"value": v}
+      POST /tags/write         {"values": {name: value, ...}}
+      POST /frames             {"port": "COM3", "data": "<hex>"} -> {"response": "<hex>"}
+      GET  /stats              per-endpoint latency histograms
+    Reads go to on_read(names), which returns {name: value} from the
+    device, and the values are kept in the tag table; GET /tags reads every
+    tag the table holds. Without on_read the table only holds values
+    written through the API. Writes are passed to on_write({name: value})
+    once per request, so the device side can batch them, and frames to
+    on_frame(port, data), which may return response bytes.
+
+    The server listens on loopback unless given another host. With a token,
+    every request must send "Authorization: Bearer <token>"; without one,
+    reads are open and writes and frames are refused.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8080, tags=None, on_read=None, on_write=None, on_frame=None,
+                 token=None):
+        self.tags = tags if tags is not None else TagTable()
+        self.token = token
+        self.on_read = on_read
+        self.on_write = on_write
+        self.on_frame = on_frame
+        self.latency = LatencyHistogram()
+        self.epoch = f"{time.time_ns():x}"  # Keeps ETags from a previous run from matching
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logging.info(f"Device API listening on port {self.port}")
+        return self
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def read_values(self, names):
+        """Read tags from the device through on_read, if there is one, and record them in the tag table."""
+        names = list(names)
+        if self.on_read is not None and names:
+            self.tags.update(self.on_read(names))
+        return self.tags.read(names)
+
+    def write_values(self, values):
+        """Pass writes to on_write in one call, then record them in the tag table."""
+        if self.on_write is not None:
+            self.on_write(dict(values))
+        self.tags.update(values)
+
+    def authorized(self, header):
+        """True if an Authorization header value carries this server's token."""
+        if self.token is None or not header or not header.startswith('Bearer '):
+            return False
+        return hmac.compare_digest(header[len('Bearer '):].encode('utf-8'), self.token.encode('utf-8'))
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep connections open between requests
+            disable_nagle_algorithm = True  # Headers and body go out in separate writes
+
+            def log_message(self, format, *args):
+                logging.debug(f"HTTP {self.address_string()} {format % args}")
+
+            def _send_json(self, status, body, headers=None):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if self.close_connection:
+                    self.send_header('Connection', 'close')
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _read_body(self):
+                """Read the whole body up front so an error reply never leaves it in the keep-alive stream."""
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_BODY:
+                    self.close_connection = True  # The body cannot be skipped, so end the connection after replying
+                    return None
+                return self.rfile.read(length)
+
+            def _body(self):
+                return json.loads(self.raw_body or b'{}')
+
+            def _dispatch(self, method):
+                start = time.perf_counter()
+                path = self.path.split('?', 1)[0].rstrip('/')
+                endpoint = f"{method} {path}"
+                self.raw_body = self._read_body()
+                try:
+                    writing = method != 'GET' and path != '/tags/read'
+                    if self.raw_body is None:
+                        endpoint = 'rejected'
+                        self._send_json(413, {'error': f"Content-Length must be 0 to {MAX_BODY}"})
+                    elif (api.token is not None or writing) and not api.authorized(self.headers.get('Authorization')):
+                        endpoint = 'rejected'
+                        self._send_json(401 if api.token is not None else 403,
+                                        {'error': 'Missing or wrong token' if api.token is not None
+                                         else 'Writes need a server token'})
+                    elif method == 'GET' and path == '/tags':
+                        if api.on_read is not None:
+                            api.read_values(api.tags.snapshot()[1])
+                        version, values = api.tags.snapshot()
+                        etag = f'"{api.epoch}-{version}"'
+                        if self.headers.get('If-None-Match') == etag:
+                            self.send_response(304)
+                            self.send_header('ETag', etag)
+                            self.send_header('Content-Length', '0')
+                            self.end_headers()
+                        else:
+                            self._send_json(200, values, {'ETag': etag})
+                    elif method == 'GET' and path == '/stats':
+                        self._send_json(200, api.latency.report())
+                    elif method == 'GET' and path.startswith('/tags/'):
+                        endpoint = f"{method} /tags/<name>"
+                        name = path[len('/tags/'):]
+                        self._send_json(200, {name: api.read_values([name])[name]})
+                    elif method == 'POST' and path == '/tags/read':
+                        self._send_json(200, {'values': api.read_values(self._body()['tags'])})
+                    elif method == 'POST' and path == '/tags/write':
+                        api.write_values(self._body()['values'])
+                        self._send_json(200, {'ok': True})
+                    elif method == 'PUT' and path.startswith('/tags/'):
+                        endpoint = f"{method} /tags/<name>"
+                        api.write_values({path[len('/tags/'):]: self._body()['value']})
+                        self._send_json(200, {'ok': True})
+                    elif method == 'POST' and path == '/frames':
+                        body = self._body()
+                        if api.on_frame is None:
+                            self._send_json(501, {'error': 'No frame handler configured'})
+                        else:
+                            response = api.on_frame(body['port'], bytes.fromhex(body['data']))
+                            self._send_json(200, {'response': response.hex() if response else None})
+                    else:
+                        endpoint = 'unknown'
+                        self._send_json(404, {'error': f"No endpoint {method} {path}"})
+                except (ValueError, KeyError, TypeError) as e:
+                    self._send_json(400, {'error': str(e)})
+                except Exception as e:
+                    logging.error(f"Device API {endpoint} failed: {e}")
+                    self._send_json(500, {'error': str(e)})
+                api.latency.record(endpoint, time.perf_counter() - start)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+        return Handler
+
+
+def benchmark(tags=500, requests=2000):
+    """Exercise the API over one keep-alive connection and print latency histograms."""
+    import http.client
+    server = DeviceApiServer(host='127.0.0.1', port=0, token='benchmark').start()
+    server.tags.update({f"D{i}": i for i in range(tags)})
+    connection = http.client.HTTPConnection('127.0.0.1', server.port)
+    auth = {'Authorization': 'Bearer benchmark'}
+    names = json.dumps({'tags': [f"D{i}" for i in range(tags)]})
+    start = time.perf_counter()
+    etag = None
+    for i in range(requests):
+        connection.request('GET', '/tags', headers=dict(auth, **({'If-None-Match': etag} if etag else {})))
+        response = connection.getresponse()
+        response.read()
+        etag = response.getheader('ETag')
+        connection.request('POST', '/tags/read', body=names, headers=dict(auth, **{'Content-Type': 'application/json'}))
+        connection.getresponse().read()
+        if i % 10 == 0:
+            connection.request('POST', '/tags/write', body=json.dumps({'values': {'D0': i}}), headers=auth)
+            connection.getresponse().read()
+    elapsed = time.perf_counter() - start
+    connection.request('GET', '/stats', headers=auth)
+    stats = json.loads(connection.getresponse().read())
+    server.close()
+    print(f"{requests * 2 + requests // 10} requests on one connection in {elapsed:.2f} s")
+    for endpoint, histogram in stats.items():
+        print(f"  {endpoint}: {histogram}")
+
+
+if __name__ == '__main__':
+    benchmark()
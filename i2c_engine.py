@@ -0,0 +1,226 @@
+import logging
+import threading
+import time
+
+MAX_BLOCK = 32  # Largest block read, matching the SMBus block limit
+
+
+class Smbus2Backend:
+    """Combined I2C transactions through smbus2's i2c_rdwr, one SMBus per bus number."""
+
+    def __init__(self):
+        self._buses = {}
+
+    def _bus(self, bus):
+        if bus not in self._buses:
+            import smbus2  # For I2C
+            self._buses[bus] = smbus2.SMBus(bus)
+        return self._buses[bus]
+
+    def transfer(self, bus, address, messages):
+        """Run ('w', bytes) / ('r', length) messages as one transaction with repeated starts."""
+        from smbus2 import i2c_msg
+        msgs = [i2c_msg.write(address, data) if kind == 'w' else i2c_msg.read(address, data)
+                for kind, data in messages]
+        self._bus(bus).i2c_rdwr(*msgs)
+        return [bytes(msg) for msg, (kind, _) in zip(msgs, messages) if kind == 'r']
+
+    def close(self):
+        for smbus in self._buses.values():
+            smbus.close()
+        self._buses.clear()
+
+
+class PigpioBackend:
+    """Combined I2C transactions through pigpio's i2c_zip, one handle per bus/address."""
+
+    def __init__(self, pi):
+        self.pi = pi
+        self._handles = {}
+
+    def handle(self, bus, address):
+        """Return the cached pigpio handle for a device, opening it on first use."""
+        key = (bus, address)
+        if key not in self._handles:
+            self._handles[key] = self.pi.i2c_open(bus, address)
+        return self._handles[key]
+
+    def transfer(self, bus, address, messages):
+        commands = [2]  # Combined flag on: repeated start between messages
+        for kind, data in messages:
+            if kind == 'w':
+                commands += [7, len(data)] + list(data)
+            else:
+                commands += [6, data]
+        commands += [3, 0]  # Combined flag off, end
+        count, data = self.pi.i2c_zip(self.handle(bus, address), commands)
+        if count < 0:
+            raise IOError(f"pigpio i2c_zip failed on bus {bus} address 0x{address:02X}: {count}")
+        results, offset = [], 0
+        for kind, length in messages:
+            if kind == 'r':
+                results.append(bytes(data[offset:offset + length]))
+                offset += length
+        return results
+
+    def close(self):
+        for handle in self._handles.values():
+            self.pi.i2c_close(handle)
+        self._handles.clear()
+
+
+class FakeI2CDevice:
+    """In-process I2C device with a 256-byte register map and auto-incrementing pointer."""
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(256)
+        if registers:
+            for register, value in registers.items():
+                self.registers[register] = value
+        self.pointer = 0
+
+    def write(self, data):
+        if data:
+            self.pointer = data[0]
+            for value in data[1:]:
+                self.registers[self.pointer] = value
+                self.pointer = (self.pointer + 1) & 0xFF
+
+    def read(self, length):
+        data = bytes(self.registers[(self.pointer + i) & 0xFF] for i in range(length))
+        self.pointer = (self.pointer + length) & 0xFF
+        return data
+
+
+class FakeI2CBackend:
+    """Backend that routes transactions to FakeI2CDevice objects, for tests and benchmarks.
+
+    clock_hz simulates bus time (9 clocks per byte plus start/address
+    overhead per message and a fixed per-transaction setup cost).
+    """
+
+    def __init__(self, devices, clock_hz=400000, transaction_overhead=0.0001):
+        self.devices = devices  # (bus, address) -> FakeI2CDevice
+        self.clock_hz = clock_hz
+        self.transaction_overhead = transaction_overhead
+        self.transactions = 0
+
+    def transfer(self, bus, address, messages):
+        device = self.devices.get((bus, address))
+        if device is None:
+            raise IOError(f"No I2C device at bus {bus} address 0x{address:02X}")
+        self.transactions += 1
+        results, clocks = [], 0
+        for kind, data in messages:
+            if kind == 'w':
+                device.write(data)
+                clocks += 10 + 9 * len(data)
+            else:
+                results.append(device.read(data))
+                clocks += 10 + 9 * data
+        if self.clock_hz:
+            time.sleep(self.transaction_overhead + clocks / self.clock_hz)
+        return results
+
+    def close(self):
+        pass
+
+
+class I2CManager:
+    """Register-level I2C access that groups reads and writes into combined transactions."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _bus_lock(self, bus):
+        with self._lock:
+            return self._locks.setdefault(bus, threading.Lock())
+
+    def transaction(self, bus, address, operations):
+        """Run register operations in as few combined transactions as possible.
+
+        operations is a list of ('read', register, length) and
+        ('write', register, data) tuples. Reads longer than 32 bytes are split
+        into block reads at increasing register addresses, so a read may not
+        run past register 255. Returns the read results in order.
+        """
+        messages, lengths = [], []
+        for operation in operations:
+            if operation[0] == 'read':
+                _, register, length = operation
+                if not 0 <= register <= 0xFF or length < 1 or register + length > 0x100:
+                    raise ValueError(f"I2C read of {length} bytes from register {register} is outside registers 0-255")
+                parts = []
+                for offset in range(0, length, MAX_BLOCK):
+                    messages += [('w', bytes([register + offset])), ('r', min(MAX_BLOCK, length - offset))]
+                    parts.append(min(MAX_BLOCK, length - offset))
+                lengths.append(len(parts))
+            elif operation[0] == 'write':
+                _, register, data = operation
+                messages.append(('w', bytes([register]) + bytes(data)))
+            else:
+                raise ValueError(f"Unknown I2C operation: {operation[0]}")
+        with self._bus_lock(bus):
+            blocks = self.backend.transfer(bus, address, messages)
+        results = []
+        for parts in lengths:
+            results.append(b''.join(blocks[:parts]))
+            blocks = blocks[parts:]
+        return results
+
+    def read_registers(self, bus, address, register, length):
+        """Read length bytes starting at register."""
+        return self.transaction(bus, address, [('read', register, length)])[0]
+
+    def write_registers(self, bus, address, register, data):
+        """Write bytes starting at register."""
+        self.transaction(bus, address, [('write', register, data)])
+
+    def scan(self, bus, sensors):
+        """Read several sensors, one combined transaction per device.
+
+        sensors maps address -> list of (register, length). Returns
+        address -> list of bytes, or None for a device that did not answer.
+        """
+        readings = {}
+        for address, registers in sensors.items():
+            try:
+                readings[address] = self.transaction(bus, address, [('read', register, length)
+                                                                     for register, length in registers])
+            except IOError as e:
+                logging.warning(f"I2C read from bus {bus} address 0x{address:02X} failed: {e}")
+                readings[address] = None
+        return readings
+
+    def close(self):
+        self.backend.close()
+
+
+def benchmark(devices=16, registers_per_device=4, rounds=50):
+    """Compare per-register transactions with combined ones on the fake backend."""
+    backend = FakeI2CBackend({(1, 0x40 + i): FakeI2CDevice({r: r for r in range(256)}) for i in range(devices)})
+    manager = I2CManager(backend)
+    sensors = {0x40 + i: [(r * 8, 6) for r in range(registers_per_device)] for i in range(devices)}
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for address, registers in sensors.items():
+            for register, length in registers:
+                manager.read_registers(1, address, register, length)
+    separate, separate_transactions = time.perf_counter() - start, backend.transactions
+
+    backend.transactions = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        readings = manager.scan(1, sensors)
+    combined = time.perf_counter() - start
+    reads = rounds * devices * registers_per_device
+    print(f"Separate transactions: {reads / separate:.0f} register reads/s ({separate_transactions} transactions)")
+    print(f"Combined transactions: {reads / combined:.0f} register reads/s ({backend.transactions} transactions)")
+    print(f"Sample reading 0x40: {[r.hex() for r in readings[0x40]]}")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,453 @@
+import io
+import logging
+import os
+import select
+import threading
+import time
+
+import numpy as np
+
+# ISO 9141-2 / ISO 14230-2 timing in milliseconds. P4 and W4 are the values
+# the tester uses inside their allowed ranges (P4 5-20 ms, W4 25-50 ms).
+TIMING = {
+    'P1_MAX': 20,  # ECU inter-byte time within a response
+    'P2_MAX': 50,  # End of request to start of response
+    'P2_EXTENDED': 5000,  # P2 after a 0x78 "response pending" answer
+    'P3_MIN': 55,  # End of response to start of the next request
+    'P3_MAX': 5000,  # Session drops if no request arrives within this time
+    'P4': 5,  # Tester inter-byte gap within a request
+    'W1_MAX': 300,  # End of 5-baud address to sync byte
+    'W2_MAX': 20,  # Sync byte to keybyte 1
+    'W3_MAX': 20,  # Keybyte 1 to keybyte 2
+    'W4': 30,  # Keybyte 2 to inverted keybyte 2, and back to inverted address
+    'W5': 300,  # Bus idle before any init
+    'TINIL': 25,  # Fast init wake-up low time
+    'TWUP': 50,  # Fast init wake-up pattern length
+}
+KWP2000_KEYBYTES = {0x8F}  # Keybyte 2 values announcing KWP2000
+SPIN_NS = 1500000  # Spin the last 1.5 ms before a deadline; sleep() overshoots too much
+RESPONSE_PENDING = 0x78
+READ_POLL = 0.002  # Fixed read timeout on ports without a file descriptor to select() on
+
+
+class KLineError(IOError):
+    """Raised on K-line timeouts, echo mismatches, bad checksums and negative responses."""
+
+
+def wait_until(deadline_ns):
+    """Block until time.monotonic_ns() reaches deadline_ns, sleeping coarsely then spinning."""
+    remaining = deadline_ns - time.monotonic_ns()
+    if remaining > SPIN_NS:
+        time.sleep((remaining - SPIN_NS) / 1e9)
+    while time.monotonic_ns() < deadline_ns:
+        time.sleep(0)  # Release the GIL so reader threads are not held up while spinning
+
+
+def checksum(data):
+    return sum(data) & 0xFF
+
+
+def kwp_frame_length(header):
+    """Total KWP2000 frame length from its first bytes, or None if more header is needed."""
+    fmt = header[0]
+    addressed = fmt & 0xC0 != 0
+    header_length = 3 if addressed else 1
+    length = fmt & 0x3F
+    if length == 0:  # Length in a separate byte after the header
+        if len(header) <= header_length:
+            return None
+        return header_length + 1 + header[header_length] + 1
+    return header_length + length + 1
+
+
+def kwp_header_length(fmt):
+    return (3 if fmt & 0xC0 else 1) + (0 if fmt & 0x3F else 1)
+
+
+def _stats(values_ns):
+    if not len(values_ns):
+        return None
+    ordered = np.sort(np.asarray(values_ns, dtype=np.int64))
+    return {
+        'count': len(ordered),
+        'mean_us': float(ordered.mean()) / 1000,
+        'p99_us': float(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]) / 1000,
+        'max_us': float(ordered[-1]) / 1000,
+    }
+
+
+class _Ring:
+    """The latest samples (ns) in a fixed numpy buffer, so long sessions use constant memory."""
+
+    def __init__(self, size):
+        self.values = np.zeros(size, dtype=np.int64)
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def latest(self):
+        return self.values[:min(self.count, len(self.values))]
+
+
+class KLineSession:
+    """ISO 9141-2 / KWP2000 session on a K-line serial adapter.
+
+    Request bytes are scheduled at fixed offsets from the first byte on
+    time.monotonic_ns() (so pacing errors do not accumulate), each new
+    request starts P3_MIN after the last byte of the previous response, and
+    response ends are detected from the KWP2000 length or, for ISO 9141,
+    a P1_MAX gap. Adapters that loop back the tester's own bytes (echo=True)
+    have the echo checked and discarded. The last history pacing errors
+    (ns late per byte) and P3 gaps are kept in ring buffers for
+    timing_report(). Reads wait in select() on the port's file descriptor,
+    so the port timeout is not reconfigured for every byte.
+    """
+
+    def __init__(self, ser, protocol='kwp2000', target=0x33, source=0xF1, timing=None, echo=True, history=10000):
+        if protocol not in ('kwp2000', 'iso9141'):
+            raise ValueError("protocol must be 'kwp2000' or 'iso9141'")
+        self.ser = ser
+        self.protocol = protocol
+        self.target = target
+        self.source = source
+        self.timing = dict(TIMING, **(timing or {}))
+        self.echo = echo
+        self.keybytes = None
+        self.pacing_errors = _Ring(history)
+        self.p3_gaps = _Ring(history)
+        self._rx_end_ns = None
+        try:
+            self._fd = ser.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            self._fd = None  # e.g. Windows ports: poll with a fixed timeout instead
+
+    def _ns(self, name):
+        return self.timing[name] * 1000000
+
+    def _read_byte(self, deadline_ns):
+        """Read one byte before deadline_ns; return (byte, arrival ns) or (None, None)."""
+        while True:
+            remaining = deadline_ns - time.monotonic_ns()
+            if remaining <= 0:
+                return None, None
+            if self._fd is not None:
+                if not select.select([self._fd], [], [], remaining / 1e9)[0]:
+                    continue
+            elif self.ser.timeout != READ_POLL:  # Changing the timeout reconfigures the port, so only once
+                self.ser.timeout = READ_POLL
+            data = self.ser.read(1)
+            if data:
+                return data[0], time.monotonic_ns()
+
+    def _write_paced(self, frame):
+        """Write frame bytes P4 apart, starting no earlier than P3_MIN after the last response."""
+        if self._rx_end_ns is not None:
+            wait_until(self._rx_end_ns + self._ns('P3_MIN'))
+        self.ser.reset_input_buffer()
+        byte_ns = 10 * 1000000000 // self.ser.baudrate  # Start, 8 data and stop bit
+        start = time.monotonic_ns()
+        if self._rx_end_ns is not None:
+            gap = start - self._rx_end_ns
+            self.p3_gaps.append(gap)
+            if gap > self._ns('P3_MAX'):
+                logging.warning(f"K-line request {gap / 1e6:.0f} ms after the last response; session may have timed out")
+        for i, byte in enumerate(frame):
+            scheduled = start + i * (byte_ns + self._ns('P4'))
+            wait_until(scheduled)
+            self.pacing_errors.append(time.monotonic_ns() - scheduled)
+            self.ser.write(bytes((byte,)))
+        if self.echo:
+            echo = bytearray()
+            deadline = time.monotonic_ns() + self._ns('P1_MAX') + len(frame) * byte_ns
+            while len(echo) < len(frame):
+                byte, _ = self._read_byte(deadline)
+                if byte is None:
+                    break
+                echo.append(byte)
+            if bytes(echo) != bytes(frame):
+                raise KLineError(f"K-line echo {echo.hex()} does not match request {bytes(frame).hex()}")
+        return time.monotonic_ns()
+
+    def frame(self, data):
+        """Wrap service data in the protocol header and checksum."""
+        data = bytes(data)
+        if self.protocol == 'iso9141':
+            header = bytes((0x68, 0x6A, self.source))
+        elif len(data) <= 0x3F:
+            header = bytes((0xC0 | len(data), self.target, self.source))
+        else:
+            header = bytes((0xC0, self.target, self.source, len(data)))
+        return header + data + bytes((checksum(header + data),))
+
+    def _read_response(self, start_deadline_ns):
+        """Read one response frame; returns (frame bytes, ns of its last byte)."""
+        byte, last = self._read_byte(start_deadline_ns)
+        if byte is None:
+            raise KLineError("K-line response timed out (P2)")
+        frame = bytearray((byte,))
+        expected = None
+        while expected is None or len(frame) < expected:
+            if expected is None and self.protocol == 'kwp2000' and len(frame) >= kwp_header_length(frame[0]):
+                expected = kwp_frame_length(frame)
+                continue
+            byte, arrival = self._read_byte(last + self._ns('P1_MAX'))
+            if byte is None:
+                if self.protocol == 'iso9141':
+                    break  # A P1 gap ends ISO 9141 messages
+                raise KLineError(f"K-line response truncated after {frame.hex()} (P1)")
+            frame.append(byte)
+            last = arrival
+        if checksum(frame[:-1]) != frame[-1]:
+            raise KLineError(f"K-line checksum mismatch in {frame.hex()}")
+        return bytes(frame), last
+
+    def request(self, data):
+        """Send service data and return the response service data (header and checksum removed)."""
+        tx_end = self._write_paced(self.frame(data))
+        deadline = tx_end + self._ns('P2_MAX')
+        while True:
+            frame, self._rx_end_ns = self._read_response(deadline)
+            header = 3 if self.protocol == 'iso9141' else kwp_header_length(frame[0])
+            response = frame[header:-1]
+            if len(response) >= 3 and response[0] == 0x7F and response[2] == RESPONSE_PENDING:
+                deadline = self._rx_end_ns + self._ns('P2_EXTENDED')
+                continue
+            if response and response[0] == 0x7F:
+                if len(response) < 3:
+                    raise KLineError(f"Truncated negative response {response.hex()}")
+                raise KLineError(f"Negative response to service 0x{response[1]:02X}: 0x{response[2]:02X}")
+            return response
+
+    def fast_init(self):
+        """KWP2000 fast init: 25 ms low / 25 ms high wake-up, then StartCommunication.
+
+        The wake-up low pulse is a 0x00 byte sent at 360 baud (start bit plus
+        eight zero bits is 25 ms), which works on common USB K-line cables.
+        """
+        baudrate = self.ser.baudrate
+        time.sleep(self.timing['W5'] / 1000)
+        start = time.monotonic_ns()
+        self.ser.baudrate = 360
+        self.ser.write(b'\x00')
+        self.ser.flush()
+        self.ser.baudrate = baudrate
+        wait_until(start + self._ns('TWUP'))
+        self._rx_end_ns = None
+        response = self.request([0x81])
+        if response[0] != 0xC1:
+            raise KLineError(f"Unexpected StartCommunication response {response.hex()}")
+        self.keybytes = tuple(response[1:3])
+        logging.info(f"K-line fast init complete, keybytes {bytes(self.keybytes).hex()}")
+        return self.keybytes
+
+    def slow_init(self, address=0x33, method='break'):
+        """5-baud init: send the address at 5 baud, answer the keybytes and check the inverted address.
+
+        method='break' bit-bangs the address with the UART break condition and
+        works on any adapter; method='baud' writes it at 5 baud for adapters
+        whose driver accepts that rate.
+        """
+        baudrate = self.ser.baudrate
+        bit_ns = 200000000
+        time.sleep(self.timing['W5'] / 1000)
+        start = time.monotonic_ns()
+        if method == 'break':
+            bits = [0] + [(address >> i) & 1 for i in range(8)] + [1]
+            for i, bit in enumerate(bits):
+                wait_until(start + i * bit_ns)
+                self.ser.break_condition = not bit
+        elif method == 'baud':
+            self.ser.baudrate = 5
+            self.ser.write(bytes((address,)))
+            self.ser.flush()
+            self.ser.baudrate = baudrate
+        else:
+            raise ValueError("method must be 'break' or 'baud'")
+        wait_until(start + 10 * bit_ns)  # End of the stop bit
+        self.ser.reset_input_buffer()
+        sync, _ = self._read_byte(time.monotonic_ns() + self._ns('W1_MAX'))
+        if sync != 0x55:
+            raise KLineError(f"No sync byte after 5-baud address 0x{address:02X} (got {sync})")
+        kb1, _ = self._read_byte(time.monotonic_ns() + self._ns('W2_MAX') + 2000000)
+        kb2, arrival = self._read_byte(time.monotonic_ns() + self._ns('W3_MAX') + 2000000)
+        if kb1 is None or kb2 is None:
+            raise KLineError("Keybytes missing after sync byte")
+        wait_until(arrival + self._ns('W4'))
+        self.ser.write(bytes((kb2 ^ 0xFF,)))
+        if self.echo:
+            self._read_byte(time.monotonic_ns() + self._ns('P1_MAX'))
+        inverted, self._rx_end_ns = self._read_byte(time.monotonic_ns() + 2 * self._ns('W4'))
+        if inverted != address ^ 0xFF:
+            raise KLineError(f"ECU did not confirm address 0x{address:02X} (got {inverted})")
+        self.keybytes = (kb1, kb2)
+        self.protocol = 'kwp2000' if kb2 in KWP2000_KEYBYTES else 'iso9141'
+        logging.info(f"K-line slow init complete, keybytes {kb1:02X} {kb2:02X} ({self.protocol})")
+        return self.keybytes
+
+    def tester_present(self):
+        """Keep the session alive (send at least every P3_MAX)."""
+        return self.request([0x3E])
+
+    def timing_report(self):
+        """Pacing error per request byte and measured P3 gaps, in microseconds."""
+        return {'byte_pacing_error': _stats(self.pacing_errors.latest()), 'p3': _stats(self.p3_gaps.latest())}
+
+
+class KLineEcuStandIn:
+    """ECU on a pseudo-terminal that answers K-line requests and times the tester.
+
+    Echoes every received byte like a single-wire K-line, accepts fast init
+    (0x00 wake-up byte then StartCommunication) and 5-baud init (a lone
+    address byte), and answers mode 01 PIDs, tester present and
+    readDataByLocalIdentifier. Arrival times of the tester's bytes are
+    recorded so intervals can be checked from the bus side. Linux only.
+    """
+
+    def __init__(self, protocol='kwp2000', address=0x33, p1=0.002, p2=0.030, echo=True):
+        self.protocol = protocol
+        self.address = address
+        self.p1_ns = int(p1 * 1e9)
+        self.p2_ns = int(p2 * 1e9)
+        self.echo = echo
+        self.byte_intervals = []  # ns between tester bytes within a request
+        self.p3_gaps = []  # ns from our last response byte to the tester's next request
+        self.requests = 0
+        import tty  # Unix only, like the pty
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self._initialized = False
+        self._last_tx_ns = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        os.close(self._slave)
+        self._thread.join()
+        os.close(self._master)
+
+    def _send(self, data, start_ns):
+        for i, byte in enumerate(data):
+            wait_until(start_ns + i * self.p1_ns)
+            os.write(self._master, bytes((byte,)))
+        self._last_tx_ns = time.monotonic_ns()
+
+    def _answer(self, request):
+        self.requests += 1
+        sid = request[0]
+        if sid == 0x81:
+            return [0xC1, 0xEF, 0x8F]
+        if sid == 0x3E:
+            return [0x7E]
+        if sid == 0x01 and len(request) >= 2:
+            pid = request[1]
+            values = {0x00: [0x18, 0x18, 0x00, 0x00], 0x04: [0x66], 0x05: [0x5A],
+                      0x0C: [0x1A, 0xF8], 0x0D: [0x32]}
+            if pid in values:
+                return [0x41, pid] + values[pid]
+            return [0x7F, sid, 0x12]
+        if sid == 0x21 and len(request) >= 2:
+            return [0x61, request[1]] + list(range(16))
+        return [0x7F, sid, 0x11]
+
+    def _respond(self, data, start_ns):
+        if self.protocol == 'iso9141':
+            header = [0x48, 0x6B, 0x10]
+        else:
+            header = [0x80 | len(data), 0xF1, 0x10]
+        frame = header + data
+        self._send(frame + [checksum(frame)], start_ns)
+
+    def _request_complete(self, frame):
+        if self.protocol == 'iso9141':
+            return False  # Ended by the P1 gap instead
+        return len(frame) >= kwp_header_length(frame[0]) and len(frame) == kwp_frame_length(frame)
+
+    def _read(self, timeout_ns=None):
+        """Read one byte (with its arrival time), or (None, None) after timeout_ns of silence."""
+        import select
+        if timeout_ns is not None and not select.select([self._master], [], [], timeout_ns / 1e9)[0]:
+            return None, None
+        data = os.read(self._master, 1)
+        now = time.monotonic_ns()
+        if self.echo:
+            os.write(self._master, data)
+        return data[0], now
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                byte, arrival = self._read()
+                if self._last_tx_ns is not None:
+                    self.p3_gaps.append(arrival - self._last_tx_ns)
+                    self._last_tx_ns = None
+                if not self._initialized and byte == 0x00:
+                    continue  # Fast init wake-up pattern
+                if not self._initialized and byte == self.address:
+                    # 5-baud address: the byte takes 2 s on the wire, then W1
+                    wait_until(arrival + 2000000000 + 60000000)
+                    self._send([0x55, 0x08 if self.protocol == 'iso9141' else 0xEF], time.monotonic_ns())
+                    self._send([0x08 if self.protocol == 'iso9141' else 0x8F], time.monotonic_ns() + 5000000)
+                    self._read(500000000)  # Inverted keybyte 2
+                    wait_until(time.monotonic_ns() + 30000000)
+                    self._send([self.address ^ 0xFF], time.monotonic_ns())
+                    self._initialized = True
+                    continue
+                frame, last = [byte], arrival
+                while not self._request_complete(frame):
+                    byte, arrival = self._read(20000000)
+                    if byte is None:
+                        break
+                    self.byte_intervals.append(arrival - last)
+                    frame.append(byte)
+                    last = arrival
+                if checksum(frame[:-1]) != frame[-1]:
+                    logging.warning(f"K-line stand-in received bad checksum in {bytes(frame).hex()}")
+                    continue
+                header = 3 if self.protocol == 'iso9141' else kwp_header_length(frame[0])
+                self._initialized = True
+                self._respond(self._answer(frame[header:-1]), last + self.p2_ns)
+        except OSError:
+            pass
+
+
+def benchmark(requests=200, protocol='kwp2000'):
+    """Run requests against the pty ECU and report pacing jitter from both ends."""
+    import serial  # For serial communication
+    ecu = KLineEcuStandIn(protocol=protocol).start()
+    ser = serial.Serial(ecu.port, 10400, timeout=1)
+    session = KLineSession(ser, protocol=protocol)
+    if protocol == 'kwp2000':
+        session.fast_init()
+    else:
+        session.slow_init(method='baud')
+    start = time.perf_counter()
+    for i in range(requests):
+        session.request([0x01, 0x0C] if i % 2 else [0x21, 0x01])
+    elapsed = time.perf_counter() - start
+    report = session.timing_report()
+    ser.close()
+    ecu.close()
+
+    nominal_ns = 10 * 1000000000 // 10400 + session._ns('P4')
+    seen = _stats([abs(interval - nominal_ns) for interval in ecu.byte_intervals])
+    p3_seen = _stats(ecu.p3_gaps)
+    print(f"{requests} {protocol} requests in {elapsed:.2f} s ({requests / elapsed:.1f} requests/s)")
+    print(f"Tester byte pacing error: mean {report['byte_pacing_error']['mean_us']:.1f} us, "
+          f"p99 {report['byte_pacing_error']['p99_us']:.1f} us, max {report['byte_pacing_error']['max_us']:.1f} us")
+    print(f"Inter-byte jitter seen by ECU (nominal {nominal_ns / 1e6:.2f} ms): mean {seen['mean_us']:.1f} us, "
+          f"p99 {seen['p99_us']:.1f} us, max {seen['max_us']:.1f} us")
+    print(f"P3 seen by ECU (min {session.timing['P3_MIN']} ms): mean {p3_seen['mean_us'] / 1000:.2f} ms, "
+          f"max {p3_seen['max_us'] / 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    benchmark()
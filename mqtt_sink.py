@@ -0,0 +1,291 @@
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+
+import paho.mqtt.client as mqtt  # For MQTT
+
+from store_forward import Forwarder, mqtt_sender
+
+
+class MqttSink:
+    """Publish bridge data to MQTT through one persistent client.
+
+    Frames and tag values are queued, grouped by topic and published as JSON
+    arrays, so a burst of small messages costs one PUBLISH per topic instead
+    of one per value. At most max_inflight QoS 1 messages are awaiting PUBACK
+    at once, and the outbound queue is capped at max_queue entries: when it is
+    full, publish calls block for up to block_timeout seconds and then report
+    the message as dropped.
+
+    If a StoreAndForwardQueue is given as store, payloads are written to it
+    while the broker is unreachable (and while a backlog remains, to keep
+    ordering) and are drained to the broker in batches once it is back. With
+    a store the sink also starts while the broker is down, and close()
+    closes the store.
+    """
+
+    def __init__(self, host, port=1883, client_id='', qos=1,
+                 frame_topic='usbcommbridge/{port}/{direction}', tag_topic='usbcommbridge/{source}/{tag}',
+                 batch_size=100, batch_interval=0.05, max_inflight=20, max_queue=10000, block_timeout=1.0,
+                 store=None):
+        self.host = host
+        self.port = int(port)
+        self.qos = qos
+        self.frame_topic = frame_topic
+        self.tag_topic = tag_topic
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.block_timeout = block_timeout
+        self.max_inflight = max_inflight
+        self.store = store
+        self._forwarder = None
+        self.stats = {'queued': 0, 'dropped': 0, 'published': 0, 'messages': 0}
+        self._stats_lock = threading.Lock()  # stats are updated from caller threads and the publish thread
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._inflight = threading.BoundedSemaphore(max_inflight)
+        self._pending_mids = {}  # mid -> callback to run on PUBACK
+        self._early_acks = set()  # PUBACKs that arrived before publish() returned their mid
+        self._mid_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        try:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        except AttributeError:  # paho-mqtt 1.x
+            self.client = mqtt.Client(client_id=client_id)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.on_publish = self._on_publish
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+
+    def start(self):
+        """Connect (with automatic reconnects) and start the publishing thread."""
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        if self.store is not None:
+            self.client.connect_async(self.host, self.port)  # Messages wait in the store until the broker answers
+        else:
+            self.client.connect(self.host, self.port)
+        self.client.loop_start()
+        self._running = True
+        self._thread = threading.Thread(target=self._publish_loop, daemon=True)
+        self._thread.start()
+        if self.store is not None:
+            # A drain batch is one in-flight window, since each message is only deleted once its PUBACK arrives
+            self._forwarder = Forwarder(self.store, mqtt_sender(self.client, self.track, self.qos),
+                                        self.client.is_connected, batch_size=self.max_inflight).start()
+        return self
+
+    def close(self, flush_timeout=5.0):
+        """Flush what is queued, then disconnect."""
+        deadline = time.monotonic() + flush_timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        left = 0
+        while not self._queue.empty():
+            topic, record = self._queue.get_nowait()
+            if self.store is None or not self.store.put(topic, topic, json.dumps([record])):
+                left += 1
+        self._count('dropped', left)  # Still queued when the flush timed out
+        if self._forwarder is not None:
+            self._forwarder.stop()
+        while self._pending_mids and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.client.disconnect()
+        self.client.loop_stop()
+        if self.store is not None:
+            self.store.close()
+        logging.info(f"MQTT sink closed: {self.stats}")
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        logging.info(f"MQTT connected to {self.host}:{self.port} ({reason_code})")
+
+    def _on_disconnect(self, client, userdata, *args):
+        if self._running:
+            logging.warning(f"MQTT disconnected from {self.host}:{self.port}")
+
+    def _on_publish(self, client, userdata, mid, *args):
+        with self._mid_lock:
+            callback = self._pending_mids.pop(mid, None)
+            if callback is None:
+                self._early_acks.add(mid)
+                return
+        callback(mid)
+
+    def track(self, mid, callback):
+        """Call callback(mid) once paho reports mid as published (PUBACK for QoS 1, sent for QoS 0)."""
+        with self._mid_lock:
+            if mid not in self._early_acks:
+                self._pending_mids[mid] = callback
+                return
+            self._early_acks.discard(mid)
+        callback(mid)
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _enqueue(self, topic, record):
+        try:
+            self._queue.put((topic, record), timeout=self.block_timeout)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def publish_frame(self, port, data, direction='rx'):
+        """Queue a raw serial frame; returns False if it was dropped by backpressure."""
+        topic = self.frame_topic.format(port=port.strip('/').replace('/', '_'), direction=direction)
+        return self._enqueue(topic, {'ts': time.time(), 'data': bytes(data).hex()})
+
+    def publish_tags(self, source, tags):
+        """Queue decoded tag values from a dict of tag -> value."""
+        now = time.time()
+        for tag, value in tags.items():
+            if not self._enqueue(self.tag_topic.format(source=source, tag=tag), {'ts': now, 'value': value}):
+                return False
+        return True
+
+    def _next_batch(self):
+        """Collect up to batch_size queued records, waiting at most batch_interval."""
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _publish_loop(self):
+        while self._running:
+            grouped = {}
+            for topic, record in self._next_batch():
+                grouped.setdefault(topic, []).append(record)
+            for topic, records in grouped.items():
+                if self._publish(topic, json.dumps(records)):
+                    self._count('messages', len(records))
+                else:
+                    self._count('dropped', len(records))
+
+    def _acquire_slot(self):
+        """Wait for a PUBACK slot, giving up once close() has stopped the sink."""
+        while not self._inflight.acquire(timeout=0.1):
+            if not self._running:
+                return False
+        return True
+
+    def _publish(self, topic, payload):
+        """Publish one payload, or store it; returns False if it had to be dropped."""
+        if self.store is not None and (self.store.size > 0 or not self.client.is_connected()):
+            return self.store.put(topic, topic, payload)  # Broker unreachable or backlog pending
+        if self.qos > 0 and not self._acquire_slot():
+            # Closing while the broker has stopped acknowledging: keep the payload on disk if possible
+            return self.store.put(topic, topic, payload) if self.store is not None else False
+        info = self.client.publish(topic, payload, qos=self.qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS and info.rc != mqtt.MQTT_ERR_NO_CONN:  # NO_CONN is queued by paho
+            # paho did not take the message, so no PUBACK will come to free its slot
+            logging.error(f"MQTT publish to {topic} failed: {mqtt.error_string(info.rc)}")
+            if self.qos > 0:
+                self._inflight.release()
+            return self.store.put(topic, topic, payload) if self.store is not None else False
+        # QoS 0 mids are tracked too, so their on_publish calls are not left behind as early acks
+        self.track(info.mid, (lambda mid: self._inflight.release()) if self.qos > 0 else (lambda mid: None))
+        self._count('published')
+        return True
+
+
+class MqttBrokerStandIn:
+    """Minimal local MQTT 3.1.1 broker stand-in for benchmarking the sink.
+
+    Accepts one client at a time, acknowledges CONNECT, QoS 1 PUBLISH and
+    PINGREQ, and counts what it receives. It does not route messages.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = socket.socket()
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen()
+        self.address = self._server.getsockname()
+        self.publishes = 0
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _read_exact(conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def _handle(self, conn):
+        try:
+            while True:
+                packet_type = self._read_exact(conn, 1)[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = self._read_exact(conn, 1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = self._read_exact(conn, length)
+                kind = packet_type >> 4
+                if kind == 1:  # CONNECT
+                    conn.sendall(b'\x20\x02\x00\x00')
+                elif kind == 3:  # PUBLISH
+                    self.publishes += 1
+                    if (packet_type >> 1) & 0x03:
+                        topic_length = int.from_bytes(body[:2], 'big')
+                        conn.sendall(b'\x40\x02' + body[2 + topic_length:4 + topic_length])
+                elif kind == 12:  # PINGREQ
+                    conn.sendall(b'\xd0\x00')
+                elif kind == 14:  # DISCONNECT
+                    break
+        except (ConnectionError, OSError):
+            pass
+        conn.close()
+
+
+def benchmark(messages=50000):
+    """Measure sink throughput (messages/sec) against the local broker stand-in."""
+    broker = MqttBrokerStandIn().start()
+    sink = MqttSink(*broker.address).start()
+    start = time.perf_counter()
+    for i in range(messages):
+        sink.publish_tags('bench', {f"tag{i % 5}": i})
+    sink.close(flush_timeout=60)
+    elapsed = time.perf_counter() - start
+    broker.close()
+    print(f"{messages} messages in {elapsed:.2f} s: {messages / elapsed:.0f} messages/s "
+          f"({sink.stats['published']} PUBLISH packets, {broker.publishes} received by broker)")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,311 @@
+import logging
+import os
+import threading
+import time
+
+import obd  # For OBD-II communication
+from obd.protocols.protocol import Message
+
+MAX_PIDS_PER_REQUEST = 6  # SAE J1979 limit for one mode 01 request
+CAN_PROTOCOLS = {'6', '7', '8', '9'}  # ELM327 protocol numbers for ISO 15765-4 (CAN)
+
+
+def build_request(pids):
+    """Build the ELM327 command for one mode 01 request carrying several PIDs."""
+    if not 0 < len(pids) <= MAX_PIDS_PER_REQUEST:
+        raise ValueError(f"A mode 01 request carries 1 to {MAX_PIDS_PER_REQUEST} PIDs, got {len(pids)}")
+    return b'01' + b''.join(b'%02X' % pid for pid in pids)
+
+
+def decode_response(messages):
+    """Split mode 01 responses into per-PID values.
+
+    A multi-PID response carries one 0x41 byte followed by PID/data pairs in
+    any order; each pair is decoded with python-OBD's command for that PID.
+    Returns command name -> value.
+    """
+    values = {}
+    for message in messages or []:
+        data = message.data
+        if not data or data[0] != 0x41:
+            continue
+        offset = 1
+        while offset < len(data):
+            pid = data[offset]
+            if not obd.commands.has_pid(1, pid):
+                logging.warning(f"OBD response contains unknown PID 0x{pid:02X}, skipping the rest")
+                break
+            command = obd.commands[1][pid]
+            size = command.bytes - 1  # command.bytes counts the mode byte too
+            part = Message(message.frames)
+            part.ecu = message.ecu
+            part.data = bytearray([0x41]) + data[offset:offset + size]
+            response = command([part])
+            if not response.is_null():
+                values.setdefault(command.name, response.value)  # First ECU to answer wins
+            offset += size
+    return values
+
+
+class ObdEngine:
+    """Mode 01 polling that packs several PIDs into each request.
+
+    On CAN vehicles up to six PIDs are requested at once and the combined
+    answer is split per PID; on K-line and J1850 protocols, which only allow
+    one PID per request, batch_size drops to 1. PIDs are polled by a
+    background thread, each at its own rate, and the latest values are
+    kept in self.values and passed to on_values(values) after every request.
+    """
+
+    def __init__(self, portstr=None, baudrate=None, protocol=None, timeout=1.0, on_values=None, connection=None):
+        self.portstr = portstr
+        self.baudrate = baudrate
+        self.protocol = protocol
+        self.timeout = timeout
+        self.on_values = on_values
+        self.connection = connection
+        self.batch_size = MAX_PIDS_PER_REQUEST
+        self.values = {}
+        self.stats = {'requests': 0, 'pids': 0, 'errors': 0}
+        self._schedule = {}  # PID -> [interval, next due time]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def connect(self):
+        """Open the adapter (unless a connection was given) and pick the batch size."""
+        if self.connection is None:
+            self.connection = obd.OBD(self.portstr, baudrate=self.baudrate, protocol=self.protocol,
+                                      fast=False, timeout=self.timeout)
+        if not self.connection.is_connected():
+            raise ConnectionError(f"OBD adapter on {self.portstr} did not reach the vehicle: "
+                                  f"{self.connection.status()}")
+        if self.connection.protocol_id() not in CAN_PROTOCOLS:
+            self.batch_size = 1
+        logging.info(f"OBD connected using {self.connection.protocol_name()}, "
+                     f"{self.batch_size} PID(s) per request")
+        return self
+
+    def _pid(self, pid):
+        if isinstance(pid, str):
+            command = obd.commands[pid]
+            if command.mode != 1:
+                raise ValueError(f"{pid} is not a mode 01 command")
+            return command.pid
+        return pid
+
+    def add(self, pid, rate):
+        """Poll a PID (number or python-OBD command name) rate times per second."""
+        pid = self._pid(pid)
+        command = obd.commands[1][pid]
+        if not self.connection.supports(command):
+            logging.warning(f"Vehicle does not report support for {command.name}, polling it anyway")
+        with self._lock:
+            self._schedule[pid] = [1.0 / rate, time.monotonic()]
+
+    def remove(self, pid):
+        with self._lock:
+            self._schedule.pop(self._pid(pid), None)
+
+    def query(self, pids):
+        """Read PIDs now, batch_size per request, and return command name -> value."""
+        pids = [self._pid(pid) for pid in pids]
+        values = {}
+        for offset in range(0, len(pids), self.batch_size):
+            batch = pids[offset:offset + self.batch_size]
+            with self._lock:
+                messages = self.connection.interface.send_and_parse(build_request(batch))
+            self.stats['requests'] += 1
+            decoded = decode_response(messages)
+            if len(decoded) < len(batch):
+                self.stats['errors'] += len(batch) - len(decoded)
+            self.stats['pids'] += len(decoded)
+            values.update(decoded)
+        return values
+
+    def start(self):
+        """Start polling the added PIDs in the background."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        if self.connection is not None:
+            self.connection.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                due = sorted((next_due, pid) for pid, (_, next_due) in self._schedule.items() if next_due <= now)
+                next_wake = min((next_due for _, next_due in self._schedule.values()), default=now + 0.1)
+            if not due:
+                self._stop.wait(next_wake - now)
+                continue
+            pids = [pid for _, pid in due]  # Most overdue first
+            try:
+                values = self.query(pids)
+            except Exception as e:
+                logging.error(f"OBD poll failed: {e}")
+                self.stats['errors'] += 1
+                self._stop.wait(1.0)
+                continue
+            with self._lock:
+                for pid in pids:
+                    entry = self._schedule.get(pid)
+                    if entry is not None:
+                        entry[1] = max(entry[1] + entry[0], now)  # Skip missed slots instead of bursting
+            self.values.update(values)
+            if self.on_values is not None and values:
+                self.on_values(values)
+
+
+class Elm327StandIn:
+    """ELM327 adapter on a pseudo-terminal, answering like a CAN (11-bit) vehicle.
+
+    Handles the AT commands python-OBD sends while connecting and mode 01
+    requests with up to six PIDs, using ISO-TP multi-frame responses with
+    headers on. response_delay simulates the adapter and ECU turnaround per
+    request. Linux only.
+    """
+
+    VEHICLE = {
+        0x04: lambda t: [0x66],  # Engine load
+        0x05: lambda t: [0x5A],  # Coolant temperature
+        0x0B: lambda t: [0x21],  # Intake manifold pressure
+        0x0C: lambda t: list(int((800 + t * 100 % 2000) * 4).to_bytes(2, 'big')),  # RPM
+        0x0D: lambda t: [int(t * 10) % 120],  # Speed
+        0x0F: lambda t: [0x3C],  # Intake air temperature
+        0x10: lambda t: [0x01, 0xF4],  # MAF
+        0x11: lambda t: [0x40],  # Throttle position
+        0x1F: lambda t: list(int(t).to_bytes(2, 'big')),  # Run time
+        0x2F: lambda t: [0xB0],  # Fuel level
+        0x33: lambda t: [0x65],  # Barometric pressure
+        0x46: lambda t: [0x32],  # Ambient air temperature
+    }
+
+    def __init__(self, response_delay=0.01):
+        self.response_delay = response_delay
+        self.requests = 0
+        import tty  # Unix only, like the pty
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self._echo = True
+        self._start = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        os.close(self._slave)
+        self._thread.join()
+        os.close(self._master)
+
+    def _supported(self, base):
+        """Bitmap of supported PIDs base+1 .. base+32 (PID 0x00, 0x20, 0x40, ...)."""
+        bits = 0
+        for pid in self.VEHICLE:
+            if base < pid <= base + 32:
+                bits |= 1 << (32 - (pid - base))
+        if any(pid > base + 32 for pid in self.VEHICLE):
+            bits |= 1  # Next bitmap PID is supported
+        return list(bits.to_bytes(4, 'big'))
+
+    def _answer(self, command):
+        if command.startswith('AT'):
+            setting = command[2:].replace(' ', '')
+            if setting == 'Z':
+                self._echo = True
+                return ['ELM327 v1.5']
+            if setting.startswith('E'):
+                self._echo = setting == 'E1'
+            if setting == 'RV':
+                return ['12.6V']
+            if setting == 'DPN':
+                return ['A6']
+            return ['OK']
+        if len(command) < 4 or len(command) % 2 or command[:2] != '01':
+            return ['NO DATA']
+        self.requests += 1
+        if self.response_delay:
+            time.sleep(self.response_delay)
+        elapsed = time.monotonic() - self._start
+        payload = [0x41]
+        for i in range(2, len(command), 2):
+            pid = int(command[i:i + 2], 16)
+            if pid % 0x20 == 0 and pid <= 0x40:
+                payload += [pid] + self._supported(pid)
+            elif pid in self.VEHICLE:
+                payload += [pid] + self.VEHICLE[pid](elapsed)
+        if len(payload) == 1:
+            return ['NO DATA']
+        if len(payload) <= 7:
+            frames = [[len(payload)] + payload]
+        else:
+            frames = [[0x10 | len(payload) >> 8, len(payload) & 0xFF] + payload[:6]]
+            for sequence, offset in enumerate(range(6, len(payload), 7), start=1):
+                frames.append([0x20 | sequence & 0x0F] + payload[offset:offset + 7])
+        return ['7E8 ' + ' '.join(f"{byte:02X}" for byte in frame) for frame in frames]
+
+    def _run(self):
+        buffer = b''
+        while not self._stop.is_set():
+            try:
+                buffer += os.read(self._master, 256)
+            except OSError:
+                break
+            while b'\r' in buffer:
+                line, buffer = buffer.split(b'\r', 1)
+                command = line.decode('ascii', 'ignore').strip().upper()
+                reply = [command] if self._echo else []
+                if command:
+                    reply += self._answer(command)
+                os.write(self._master, ('\r'.join(reply) + '\r\r>').encode('ascii'))
+
+
+def benchmark(duration=3.0, response_delay=0.01):
+    """Compare single-PID and batched polling against the ELM327 stand-in."""
+    adapter = Elm327StandIn(response_delay=response_delay).start()
+    engine = ObdEngine(adapter.port, baudrate=38400).connect()
+    pids = ['RPM', 'SPEED', 'COOLANT_TEMP', 'ENGINE_LOAD', 'THROTTLE_POS', 'MAF',
+            'INTAKE_TEMP', 'INTAKE_PRESSURE', 'RUN_TIME', 'FUEL_LEVEL', 'BAROMETRIC_PRESSURE', 'AMBIANT_AIR_TEMP']
+
+    for batch_size in (1, MAX_PIDS_PER_REQUEST):
+        engine.batch_size = batch_size
+        engine.stats = {'requests': 0, 'pids': 0, 'errors': 0}
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            values = engine.query(pids)
+        elapsed = time.perf_counter() - start
+        print(f"{batch_size} PID(s) per request: {engine.stats['pids'] / elapsed:.0f} PIDs/s "
+              f"({engine.stats['requests'] / elapsed:.0f} requests/s, {engine.stats['errors']} missing)")
+    print(f"Sample: RPM={values.get('RPM')}, SPEED={values.get('SPEED')}")
+
+    for i, pid in enumerate(pids):
+        engine.add(pid, rate=20 if i < 2 else 2)  # Fast engine data, slow temperatures and levels
+    engine.stats = {'requests': 0, 'pids': 0, 'errors': 0}
+    engine.start()
+    time.sleep(duration)
+    engine.stop()
+    print(f"Background poll at 20 Hz x 2 + 2 Hz x {len(pids) - 2}: {engine.stats['pids'] / duration:.0f} PIDs/s "
+          f"in {engine.stats['requests']} requests")
+    engine.close()
+    adapter.close()
+
+
+if __name__ == '__main__':
+    benchmark()
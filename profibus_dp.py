@@ -0,0 +1,213 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pyprofibus  # For PROFIBUS
+
+from kline import wait_until
+
+# Compact 4 byte in/out station, enough for pyprofibus's dummy PHY.
+DUMMY_GSD = """#Profibus_DP
+GSD_Revision = 1
+Vendor_Name = "Dummy"
+Model_Name = "Dummy DP slave"
+Revision = "1"
+Ident_Number = 0x6666
+Protocol_Ident = 0
+Station_Type = 0
+Hardware_Release = "1"
+Software_Release = "1"
+9.6_supp = 1
+19.2_supp = 1
+1.5M_supp = 1
+MaxTsdr_9.6 = 60
+MaxTsdr_19.2 = 60
+MaxTsdr_1.5M = 150
+Implementation_Type = "dummy"
+Freeze_Mode_supp = 0
+Sync_Mode_supp = 0
+Auto_Baud_supp = 0
+Set_Slave_Add_supp = 0
+Min_Slave_Intervall = 1
+Modular_Station = 0
+Module = "4 bytes in/out" 0x33
+EndModule
+"""
+
+
+class ProfibusDpMaster:
+    """Cyclic PROFIBUS DP data exchange with process images as tag arrays.
+
+    config is a pyprofibus configuration file (or a loaded PbConf) listing
+    the PHY and slaves. Each slave gets a slice of two numpy uint8 process
+    images: self.inputs holds what it sends (its output_size in pyprofibus
+    terms) and self.outputs what the master sends it (its input_size).
+    Every cycle_time seconds the master sends the outputs to every slave in
+    data exchange and collects their inputs; cycle starts are scheduled on
+    time.monotonic_ns() from the first cycle so they do not drift, and a
+    cycle that overruns is counted and the schedule skips ahead.
+    """
+
+    def __init__(self, config, cycle_time=0.01, on_cycle=None, history=100000):
+        self.config = pyprofibus.PbConf.fromFile(config) if isinstance(config, str) else config
+        self.cycle_ns = int(cycle_time * 1e9)
+        self.on_cycle = on_cycle
+        self.slots = {}  # Slave name -> (address, input slice, output slice)
+        in_offset = out_offset = 0
+        for slave in self.config.slaveConfs:
+            self.slots[slave.name] = (slave.addr,
+                                      slice(in_offset, in_offset + slave.outputSize),
+                                      slice(out_offset, out_offset + slave.inputSize))
+            in_offset += slave.outputSize
+            out_offset += slave.inputSize
+        self.inputs = np.zeros(in_offset, dtype=np.uint8)
+        self.outputs = np.zeros(out_offset, dtype=np.uint8)
+        self.stats = {'cycles': 0, 'overruns': 0, 'missed': 0}
+        self._periods = np.zeros(history, dtype=np.int64)  # Ring buffer of start-to-start times
+        self._busy = np.zeros(history, dtype=np.int64)  # Ring buffer of exchange durations
+        self._master = None
+        self._descs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def input_tags(self, name):
+        """View of one slave's input bytes in the input process image."""
+        return self.inputs[self.slots[name][1]]
+
+    def output_tags(self, name):
+        """Writable view of one slave's output bytes in the output process image."""
+        return self.outputs[self.slots[name][2]]
+
+    def write_outputs(self, name, data):
+        with self._lock:
+            self.output_tags(name)[:] = np.frombuffer(bytes(data), dtype=np.uint8)
+
+    def snapshot(self):
+        """Consistent copies of (inputs, outputs) taken between cycles."""
+        with self._lock:
+            return self.inputs.copy(), self.outputs.copy()
+
+    def start(self):
+        """Create the DP master, register the slaves and start cycling."""
+        self._master = self.config.makeDPM()
+        for slave in self.config.slaveConfs:
+            desc = slave.makeDpSlaveDesc()
+            self._master.addSlave(desc)
+            self._descs[slave.addr] = desc
+        self._master.initialize()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logging.info(f"PROFIBUS DP master cycling {len(self._descs)} slaves every {self.cycle_ns / 1e6:.1f} ms")
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._master is not None:
+            self._master.destroy()
+            self._master = None
+
+    def _exchange(self, deadline):
+        """Run the master state machine until every connected slave has answered or deadline passes."""
+        connected = set()
+        with self._lock:
+            for address, desc in self._descs.items():
+                if desc.isConnected():
+                    desc.setMasterOutData(bytearray(self.outputs[self.slots[desc.name][2]].tobytes()))
+                    connected.add(address)
+        steps = 0
+        while (connected or steps < 2 * len(self._descs)) and time.monotonic_ns() < deadline:
+            desc = self._master.run()
+            steps += 1
+            if desc is None:
+                continue
+            data = desc.getMasterInData()
+            if data is not None:
+                with self._lock:
+                    self.inputs[self.slots[desc.name][1]] = np.frombuffer(bytes(data), dtype=np.uint8)
+                connected.discard(desc.slaveAddr)
+            elif not connected and steps >= 2 * len(self._descs):
+                break  # No slave in data exchange yet; initialisation continues next cycle
+        self.stats['missed'] += len(connected)
+
+    def _run(self):
+        first = time.monotonic_ns()
+        scheduled = first
+        previous = None
+        history = len(self._periods)
+        while not self._stop.is_set():
+            wait_until(scheduled)
+            start = time.monotonic_ns()
+            self._exchange(scheduled + self.cycle_ns)
+            end = time.monotonic_ns()
+            index = self.stats['cycles'] % history
+            self._periods[index] = start - previous if previous is not None else self.cycle_ns
+            self._busy[index] = end - start
+            self.stats['cycles'] += 1
+            previous = start
+            if self.on_cycle is not None:
+                self.on_cycle(self)
+            scheduled += self.cycle_ns
+            now = time.monotonic_ns()
+            if now > scheduled:
+                self.stats['overruns'] += 1
+                scheduled = first + -(-(now - first) // self.cycle_ns) * self.cycle_ns  # Next slot after now
+
+    def cycle_report(self):
+        """Cycle period and exchange time percentiles in milliseconds, plus counters."""
+        count = min(self.stats['cycles'], len(self._periods))
+        if count < 2:
+            return dict(self.stats)
+        periods = self._periods[:count] / 1e6
+        busy = self._busy[:count] / 1e6
+        target = self.cycle_ns / 1e6
+        report = dict(self.stats)
+        for label, values in (('period_ms', periods), ('exchange_ms', busy)):
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            report[label] = {'min': float(values.min()), 'p50': float(p50), 'p90': float(p90),
+                             'p99': float(p99), 'max': float(values.max())}
+        report['jitter_ms'] = float(np.abs(periods - target).max())
+        return report
+
+
+def benchmark(duration=3.0, cycle_time=0.002, slaves=4):
+    """Run the DP master against pyprofibus's dummy PHY and print the cycle-time distribution."""
+    with tempfile.TemporaryDirectory() as directory:
+        gsd = os.path.join(directory, 'dummy.gsd')
+        with open(gsd, 'w') as f:
+            f.write(DUMMY_GSD)
+        conf = os.path.join(directory, 'dummy.conf')
+        with open(conf, 'w') as f:
+            f.write("[PHY]\ntype = dummy_slave\nbaud = 1500000\n[DP]\nmaster_class = 1\nmaster_addr = 2\n")
+            for i in range(slaves):
+                f.write(f"[SLAVE_{i}]\nname = slave{8 + i}\naddr = {8 + i}\ngsd = {gsd}\n"
+                        "input_size = 4\noutput_size = 4\nwatchdog_ms = 0\n")
+        master = ProfibusDpMaster(conf, cycle_time=cycle_time)
+
+    def count_up(dp):
+        for name in dp.slots:
+            dp.output_tags(name)[:] += 1
+
+    master.on_cycle = count_up
+    master.start()
+    time.sleep(duration)
+    master.close()
+    report = master.cycle_report()
+    inputs, outputs = master.snapshot()
+    print(f"{report['cycles']} cycles of {slaves} slaves at {cycle_time * 1e3:.1f} ms: "
+          f"{report['overruns']} overruns, {report['missed']} missed slave answers")
+    print(f"Cycle period ms: {report['period_ms']}")
+    print(f"Exchange ms:     {report['exchange_ms']}")
+    print(f"Max deviation from target period: {report['jitter_ms']:.3f} ms")
+    print(f"Inputs {inputs.tobytes().hex()} (dummy PHY returns the inverted outputs {outputs.tobytes().hex()})")
+
+
+if __name__ == '__main__':
+    benchmark()
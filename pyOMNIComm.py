@@ -14,19 +14,33 @@ from kivy.core.window import Window
 from kivy.uix.spinner import Spinner
 import json
 import platform  # For OS detection
+import secrets  # For the device API token
+import threading
 import pigpio  # For I2C
 
 # import spidev  # For SPI
 
 import paho.mqtt.client as mqtt  # For MQTT
+from mqtt_sink import MqttSink  # Persistent, batched MQTT publishing
+from store_forward import StoreAndForwardQueue  # Holds MQTT messages on disk while the broker is down
+from canopen_manager import CANopenManager  # CANopen network with TPDO tag table
 import obd  # Updated import for OBD-II communication
+from obd_engine import ObdEngine  # Multi-PID batched OBD-II polling
+from kline import KLineSession  # ISO 9141 / KWP2000 timing on a K-line adapter
 
-import aiocoap  # For CoAP
+from coap_observer import CoapObserver  # CoAP Observe over one shared aiocoap client context
 import websocket  # For WebSocket
 #import pyLoRaWAN  # For LoRaWAN
 import pyprofibus  # For PROFIBUS
-import can  # For CAN communication
-from fins.tcp import TCPFinsConnection  # Importing TCPFinsConnection from fins package
+from profibus_dp import ProfibusDpMaster  # Cyclic DP data exchange with process images
+from can_ingest import CanIngest  # Filtered, batched CAN receive path
+from i2c_engine import I2CManager, PigpioBackend  # Combined I2C transactions
+from spi_engine import SpiEngine, SpidevBackend  # Chunked full-duplex SPI transfers
+from fins_pool import FinsClientManager  # Persistent FINS/TCP connections per PLC
+from cip_client import CipClient  # EtherNet/IP tag reads batched into Multiple Service Packets
+from serial_api import SerialApiEngine, ZWaveCodec, ZnpCodec  # Z-Wave / Zigbee USB stick framing
+from http_api import DeviceApiServer  # Embedded HTTP/JSON API for tags and raw frames
+from frames import read_frame, write_frame  # monotonic_ns-stamped serial frames
 
 # Set up logging
 logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -34,15 +48,34 @@ logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s
 class SmartHomeCommApp(App):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.fins_manager = FinsClientManager()  # Keeps one FINS connection per PLC alive
+        self.fins_target = None  # (ip, port) of the last FINS connection, where API tag writes go
+        self.device_api = None  # Set by connect_http
+        self.frame_lock = threading.Lock()  # One raw API frame on a serial port at a time
+        self.mqtt_sink = None  # Set by connect_mqtt
+        self.mqtt_store_path = 'store_forward.db'  # Where MQTT messages wait while the broker is down
+        self.canopen_manager = None  # Set by connect_canopen
+        self.can_ingest = None  # Set by connect_can
+        self.obd_engine = None  # Set by connect_obd
+        self.kline_session = None  # Set by connect_kline
+        self.profibus_master = None  # Set by connect_profibus
+        self.cip_client = None  # Set by connect_enip
+        self.coap_observer = None  # Created by the first connect_coap, then shared by every CoAP device
+        self.serial_api = None  # Set by connect_serial_api
+        self.spi_engines = {}  # Chip select -> SpiEngine, opened on first use
         if platform.system() == "Linux":  # Check if running on Raspberry Pi
             import smbus2  # For I2C
             self.pi = pigpio.pi()  # Initialize pigpio
-            self.i2c_bus = self.pi.i2c_open(1, 0x20)  # Open I2C bus 1 with address 0x20
+            self.i2c = I2CManager(PigpioBackend(self.pi))  # Caches one handle per bus/address
+            self.i2c_bus = self.i2c.backend.handle(1, 0x20)  # Open I2C bus 1 with address 0x20
         elif platform.system() == "Windows":  # Check if running on Windows
             logging.warning("I2C communication is not supported on Windows. Use a compatible library or method.")
+            self.i2c = None
             self.i2c_bus = None  # Placeholder for Windows
         else:
             logging.error("Unsupported OS for I2C communication.")
+            self.i2c = None
+            self.i2c_bus = None
 
     def build(self):
         self.title = "Smart Home Communication App"
@@ -134,7 +167,8 @@ class SmartHomeCommApp(App):
         if text in ['RS232', 'RS485']:  # Check if the selected protocol is a serial protocol
             self.show_serial_settings()  # Show serial settings layout
             self.connection_settings_layout.opacity = 1  # Show connection settings for serial protocols
-        elif text in ['FINS', 'Modbus RTU', 'CANOpen', 'MQTT']:  # Check if the selected protocol requires IP settings
+        elif text in ['FINS', 'Modbus RTU', 'CANOpen', 'MQTT', 'HTTP', 'CoAP', 'EtherNet/IP', 'CAN', 'OBD-II',
+                      'ISO 9141', 'KWP2000', 'PROFIBUS', 'Z-Wave', 'Zigbee', 'ZigBee']:  # Uses the IP/port fields
             self.connection_settings_layout.opacity = 1  # Show connection settings for IP protocols
         else:  # Hide settings for other protocols
             self.connection_settings_layout.opacity = 0  # Ensure settings are hidden for unsupported protocols
@@ -160,12 +194,20 @@ class SmartHomeCommApp(App):
         # Logic to handle connection when the button is pressed
         self.connect(instance)
 
-    def read_spi(self, address, num_bytes):
-        """Read bytes from SPI device.""" 
+    def spi_engine(self, address):
+        """Return the SPI engine for a chip select on bus 0, opening it on first use."""
+        if address not in self.spi_engines:
+            self.spi_engines[address] = SpiEngine(SpidevBackend(0, address))
+        return self.spi_engines[address]
+
+    def read_spi(self, address, num_bytes, buffer=None):
+        """Read bytes from SPI device, into buffer if one is given.""" 
         if platform.system() == "Linux":
-            # Implement SPI read using spidev or another method
-            logging.error("SPI read not implemented for Windows. Use a compatible library or method.")
-            return None
+            try:
+                return self.spi_engine(address).read(num_bytes, buffer)
+            except Exception as e:
+                logging.error(f"SPI read failed: {e}")
+                return None
         else:
             logging.error("SPI functionality not available on this OS.")
             return None
@@ -173,8 +215,10 @@ class SmartHomeCommApp(App):
     def write_spi(self, address, data):
         """Write bytes to SPI device.""" 
         if platform.system() == "Linux":
-            # Implement SPI write using spidev or another method
-            logging.error("SPI write not implemented for Windows. Use a compatible library or method.")
+            try:
+                self.spi_engine(address).write(data)
+            except Exception as e:
+                logging.error(f"SPI write failed: {e}")
         else:
             logging.error("SPI functionality not available on this OS.")
 
@@ -194,6 +238,24 @@ class SmartHomeCommApp(App):
             self.connect_canopen(ip_address, port)
         elif protocol == 'MQTT':
             self.connect_mqtt(ip_address, port)
+        elif protocol == 'HTTP':
+            self.connect_http(ip_address, port)
+        elif protocol == 'CoAP':
+            self.connect_coap(ip_address, port)
+        elif protocol == 'CAN':
+            self.connect_can(port)
+        elif protocol == 'OBD-II':
+            self.connect_obd(port)
+        elif protocol in ('ISO 9141', 'KWP2000'):
+            self.connect_kline(port, 'iso9141' if protocol == 'ISO 9141' else 'kwp2000')
+        elif protocol == 'PROFIBUS':
+            self.connect_profibus(port)
+        elif protocol == 'EtherNet/IP':
+            self.connect_enip(ip_address, port)
+        elif protocol == 'Z-Wave':
+            self.connect_serial_api(port, ZWaveCodec())
+        elif protocol in ('Zigbee', 'ZigBee'):
+            self.connect_serial_api(port, ZnpCodec())
         # Add additional protocols as needed
         else:
             logging.error("Selected protocol not implemented.")
@@ -202,8 +264,8 @@ class SmartHomeCommApp(App):
         logging.info(f"Connecting using FINS protocol to {ip_address}:{port}")
         # Example connection logic for FINS protocol
         try:
-            fins_connection = TCPFinsConnection()  # Create an instance of TCPFinsConnection
-            fins_connection.connect(ip_address, int(port))  # Establish the connection
+            self.fins_manager.get_connection(ip_address, int(port))  # Reuses the pooled connection if already open
+            self.fins_target = (ip_address, int(port))
 
             logging.info("FINS connection established successfully.")
         except Exception as e:
@@ -224,10 +286,10 @@ class SmartHomeCommApp(App):
         logging.info(f"Connecting using CANOpen protocol to {ip_address}:{port}")
         # Example connection logic for CANOpen protocol
         try:
-            import canopen  # Import the canopen module
-            canopen_connection = canopen.Network()  # Create an instance of the CANOpen network
-
-            canopen_connection.connect()
+            if self.canopen_manager is not None:
+                self.canopen_manager.disconnect()
+            # The port field names the CAN channel, e.g. can0
+            self.canopen_manager = CANopenManager(channel=port or 'can0').connect()
             logging.info("CANOpen connection established successfully.")
         except Exception as e:
             logging.error(f"Failed to connect using CANOpen protocol: {e}")
@@ -236,16 +298,186 @@ class SmartHomeCommApp(App):
         logging.info(f"Connecting using MQTT protocol to {ip_address}:{port}")
         # Example connection logic for MQTT protocol
         try:
-            mqtt_client = mqtt.Client()
-            mqtt_client.connect(ip_address, int(port))  # Pass the port as an integer
-            mqtt_client.loop_start()
+            if self.mqtt_sink is not None:
+                self.mqtt_sink.close()
+            # The port is parsed before the store opens, so a bad port does not leave the database open
+            self.mqtt_sink = MqttSink(ip_address, int(port),
+                                      store=StoreAndForwardQueue(self.mqtt_store_path) if self.mqtt_store_path else None
+                                      ).start()  # Keep the client for publishing
             logging.info("MQTT connection established successfully.")
         except Exception as e:
             logging.error(f"Failed to connect using MQTT protocol: {e}")
 
+    def connect_http(self, ip_address, port):
+        # The IP field is the address to listen on; blank keeps the API on this machine only
+        host = ip_address or '127.0.0.1'
+        logging.info(f"Starting device API on {host}:{port or 8080}")
+        try:
+            if self.device_api is not None:
+                self.device_api.close()
+            token = secrets.token_urlsafe(16)
+            self.device_api = DeviceApiServer(host, int(port or 8080), on_read=self.read_tags, on_write=self.write_tags,
+                                              on_frame=self.send_frame, token=token).start()
+            Popup(title="Device API", size_hint=(0.6, 0.3),
+                  content=Label(text=f"http://{host}:{self.device_api.port}/\n"
+                                     f"Authorization: Bearer {token}")).open()
+            logging.info("Device API started successfully.")
+        except Exception as e:
+            logging.error(f"Failed to start device API: {e}")
+
+    def read_tags(self, names):
+        """API tag reads: words such as D100 from the connected FINS PLC, batched into 0104 commands."""
+        if self.fins_target is None:
+            raise ValueError("Connect to a PLC with FINS before reading tags")
+        return dict(zip(names, self.fins_manager.read_multiple(*self.fins_target, names)))
+
+    def write_tags(self, values):
+        """API tag writes: words such as D100 on the connected FINS PLC, one 0102 command per consecutive run."""
+        if self.fins_target is None:
+            raise ValueError("Connect to a PLC with FINS before writing tags")
+        self.fins_manager.write_many(*self.fins_target, values)
+
+    def send_frame(self, port, data):
+        """API raw frame: write to a serial port and return the reply, or None on timeout."""
+        import serial  # For the API's serial ports
+        baudrate = int(getattr(self, 'baudrate_input', None) and self.baudrate_input.text or 9600)
+        with self.frame_lock, serial.Serial(port, baudrate, timeout=1) as ser:
+            write_frame(ser, data)
+            frame = read_frame(ser, 1)
+        return frame.data if frame is not None else None
+
+    def connect_can(self, channel):
+        logging.info(f"Connecting using CAN protocol on {channel}")
+        try:
+            if self.can_ingest is not None:
+                self.can_ingest.stop()
+            # The port field names the CAN channel, e.g. can0
+            self.can_ingest = CanIngest(channel=channel or 'can0').start()
+            logging.info("CAN connection established successfully.")
+        except Exception as e:
+            logging.error(f"Failed to connect using CAN protocol: {e}")
+
+    def connect_obd(self, port):
+        logging.info(f"Connecting using OBD-II protocol on {port}")
+        try:
+            if self.obd_engine is not None:
+                self.obd_engine.close()
+            # An empty port field lets python-OBD scan for the adapter
+            self.obd_engine = ObdEngine(port or None).connect()
+            logging.info("OBD-II connection established successfully.")
+        except Exception as e:
+            logging.error(f"Failed to connect using OBD-II protocol: {e}")
+
+    def connect_kline(self, port, protocol):
+        logging.info(f"Connecting using {protocol} on {port}")
+        try:
+            import serial  # For the K-line adapter
+            if self.kline_session is not None:
+                self.kline_session.ser.close()
+            self.kline_session = KLineSession(serial.Serial(port, 10400, timeout=1), protocol=protocol)
+            if protocol == 'kwp2000':
+                self.kline_session.fast_init()
+            else:
+                self.kline_session.slow_init()
+            logging.info(f"{protocol} connection established successfully.")
+        except Exception as e:
+            logging.error(f"Failed to connect using {protocol}: {e}")
+
+    def connect_profibus(self, config_file):
+        logging.info(f"Connecting using PROFIBUS DP with {config_file}")
+        try:
+            if self.profibus_master is not None:
+                self.profibus_master.close()
+            # The port field names the pyprofibus configuration file
+            self.profibus_master = ProfibusDpMaster(config_file or 'profibus.conf').start()
+            logging.info("PROFIBUS connection established successfully.")
+        except Exception as e:
+            logging.error(f"Failed to connect using PROFIBUS: {e}")
+
+    def connect_enip(self, ip_address, port):
+        logging.info(f"Connecting using EtherNet/IP protocol to {ip_address}:{port}")
+        try:
+            if self.cip_client is not None:
+                self.cip_client.close()
+            self.cip_client = CipClient(ip_address, int(port or 44818)).connect()  # Session stays open for reads
+            logging.info("EtherNet/IP connection established successfully.")
+        except Exception as e:
+            logging.error(f"Failed to connect using EtherNet/IP protocol: {e}")
+
+    def connect_coap(self, address, port):
+        # The IP field holds host/resource (or a full coap:// URI); each connect adds one observed resource
+        host, _, path = address.partition('/')
+        uri = address if address.startswith('coap') else f"coap://{host}:{port or 5683}/{path}"
+        logging.info(f"Observing CoAP resource {uri}")
+        try:
+            if self.coap_observer is None:
+                self.coap_observer = CoapObserver().start()
+            self.coap_observer.observe(uri, self.on_coap_notification)
+            logging.info("CoAP observation registered successfully.")
+        except Exception as e:
+            logging.error(f"Failed to observe CoAP resource {uri}: {e}")
+
+    def on_coap_notification(self, uri, payload):
+        logging.info(f"CoAP notification from {uri}: {payload[:64]!r}")
+        if self.mqtt_sink is not None:
+            self.mqtt_sink.publish_frame(uri, payload)
+
+    def connect_serial_api(self, port, codec):
+        logging.info(f"Connecting to {type(codec).__name__[:-5]} controller on {port}")
+        try:
+            import serial  # For the USB stick
+            if self.serial_api is not None:
+                self.serial_api.close()
+                self.serial_api.ser.close()
+            self.serial_api = SerialApiEngine(serial.Serial(port, 115200), codec, on_report=self.on_device_report).start()
+            logging.info("Controller connection established successfully.")
+        except Exception as e:
+            logging.error(f"Failed to connect to controller: {e}")
+
+    def on_device_report(self, frame_type, command, payload):
+        logging.info(f"Unsolicited report {command}: {payload.hex()}")
+        if self.mqtt_sink is not None:
+            self.mqtt_sink.publish_frame(self.serial_api.ser.port, payload)
+
     def disconnect(self, instance):
         logging.info("Disconnecting from device")
-        # Implement disconnection logic here
+        if self.device_api is not None:
+            self.device_api.close()  # Stop serving API requests before their connections go away
+            self.device_api = None
+        self.fins_manager.close_all()  # Close pooled FINS connections
+        self.fins_target = None
+        if self.mqtt_sink is not None:
+            self.mqtt_sink.close()  # Flush queued MQTT messages before disconnecting
+            self.mqtt_sink = None
+        if self.canopen_manager is not None:
+            self.canopen_manager.disconnect()  # Release the CAN bus
+            self.canopen_manager = None
+        if self.can_ingest is not None:
+            self.can_ingest.stop()  # Stop the CAN receive thread and close the bus
+            self.can_ingest = None
+        if self.obd_engine is not None:
+            self.obd_engine.close()  # Stop polling and release the adapter
+            self.obd_engine = None
+        if self.kline_session is not None:
+            self.kline_session.ser.close()  # Release the K-line adapter
+            self.kline_session = None
+        if self.profibus_master is not None:
+            self.profibus_master.close()  # Stop cycling and close the PHY
+            self.profibus_master = None
+        if self.cip_client is not None:
+            self.cip_client.close()  # Forward Close and unregister the session
+            self.cip_client = None
+        if self.coap_observer is not None:
+            self.coap_observer.close()  # Cancel every observation and shut the shared context down
+            self.coap_observer = None
+        if self.serial_api is not None:
+            self.serial_api.close()  # Stop the reader and fail outstanding callbacks
+            self.serial_api.ser.close()
+            self.serial_api = None
+        for engine in self.spi_engines.values():
+            engine.close()  # Release the spidev devices
+        self.spi_engines.clear()
+        # Implement disconnection logic for other protocols here
 
     def load_settings(self, instance):
         try:
@@ -256,6 +488,7 @@ class SmartHomeCommApp(App):
                 self.gateway_input.text = settings.get('gateway', '')
                 self.dns_input.text = settings.get('dns', '')
                 self.port_input.text = settings.get('port', '')
+                self.mqtt_store_path = settings.get('mqtt_store', self.mqtt_store_path)
                 logging.info("Settings loaded successfully.")
         except Exception as e:
             logging.error(f"Error loading settings: {e}")
@@ -267,6 +500,7 @@ class SmartHomeCommApp(App):
             'gateway': self.gateway_input.text,
             'dns': self.dns_input.text,
             'port': self.port_input.text,
+            'mqtt_store': self.mqtt_store_path,
         }
         try:
             with open('settings.json', 'w') as f:
@@ -0,0 +1,211 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from capture import CaptureWriter, iter_capture, torn_tail
+from frames import Frame, character_time_ns
+from kline import wait_until
+from port_bridge import open_port
+
+
+def capture_ports(path):
+    """(port, direction) -> frame count for everything in a capture file."""
+    counts = {}
+    for frame, _ in iter_capture(path):
+        key = (frame.port, frame.direction)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+class Replayer:
+    """Play recorded frames back into a serial port or a new pseudo-terminal.
+
+    Frames are taken from a capture file in order, keeping those whose
+    port is in ports and direction in directions (None keeps all), and
+    each is written when its offset from the first replayed frame, divided
+    by speed, has passed on time.monotonic_ns(). speed=None writes them as
+    fast as possible. Offsets use the wall-clock time of each frame, so
+    sessions appended to one capture keep their real spacing; idle
+    stretches longer than max_gap seconds are cut to max_gap.
+
+    Every frame is scheduled from the replay start rather than from the
+    previous write, so lateness does not accumulate: the drift recorded
+    for each frame (actual write start minus scheduled time) shows how far
+    the replay is off the original timing at that point, and drift_report()
+    summarises it. With target=None a pty is created and its name is in
+    self.port for the software under test to open; otherwise target is a
+    serial port opened with settings.
+
+    A capture cut short by a crash or power loss is replayed up to its last
+    complete frame; stats['torn_bytes'] says how much was left over.
+    """
+
+    def __init__(self, path, target=None, ports=None, directions=('rx',), speed=1.0, max_gap=5.0,
+                 settings=None, history=100000):
+        self.path = path
+        self.ports = set(ports) if ports else None
+        self.directions = set(directions) if directions else None
+        self.speed = speed
+        self.max_gap_ns = int(max_gap * 1e9) if max_gap else None
+        self.stats = {'frames': 0, 'bytes': 0, 'late': 0, 'torn_bytes': torn_tail(path)}
+        if self.stats['torn_bytes']:
+            logging.warning(f"{path} ends with {self.stats['torn_bytes']} bytes of a torn record; "
+                            f"replaying the complete frames before it")
+        self._drift = np.zeros(history, dtype=np.int64)
+        self._stop = threading.Event()
+        self._thread = None
+        self._master = self._slave = None
+        self.ser = None
+        if target is None:
+            import tty  # Unix only, like the pty
+            self._master, self._slave = os.openpty()
+            tty.setraw(self._master)
+            tty.setraw(self._slave)
+            self.port = os.ttyname(self._slave)
+        else:
+            self.ser = open_port(target, settings or {'baudrate': 115200})
+            self.port = target
+        # A pty has no line rate, so it is judged against the baud rate given in settings, if any
+        self.baudrate = self.ser.baudrate if self.ser is not None else (settings or {}).get('baudrate', 115200)
+
+    def _write(self, data):
+        if self.ser is None:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._master, view):]
+        else:
+            self.ser.write(data)
+
+    def frames(self):
+        """The capture's frames that this replayer will write, with wall-clock offsets, as a generator."""
+        for frame, offset_ns in iter_capture(self.path):
+            if self.ports is not None and frame.port not in self.ports:
+                continue
+            if self.directions is not None and frame.direction not in self.directions:
+                continue
+            yield frame, offset_ns
+
+    def run(self):
+        """Replay in the calling thread; returns drift_report()."""
+        start_ns = None
+        position_ns = 0  # Recorded time since the first frame, with long gaps cut
+        previous_ns = None
+        late_ns = character_time_ns(self.baudrate)
+        slot = len(self._drift)
+        for frame, offset_ns in self.frames():
+            if self._stop.is_set():
+                break
+            recorded_ns = frame.first_ns + offset_ns
+            if previous_ns is not None:
+                gap = recorded_ns - previous_ns
+                position_ns += min(gap, self.max_gap_ns) if self.max_gap_ns else gap
+            previous_ns = recorded_ns
+            if start_ns is None:
+                start_ns = time.monotonic_ns()
+            if self.speed:
+                scheduled_ns = start_ns + int(position_ns / self.speed)
+                wait_until(scheduled_ns)
+            else:
+                scheduled_ns = time.monotonic_ns()
+            written_ns = time.monotonic_ns()
+            self._write(frame.data)
+            drift = written_ns - scheduled_ns
+            self._drift[self.stats['frames'] % slot] = drift
+            if drift > late_ns:
+                self.stats['late'] += 1
+            self.stats['frames'] += 1
+            self.stats['bytes'] += len(frame.data)
+        self.stats['duration_s'] = (time.monotonic_ns() - start_ns) / 1e9 if start_ns is not None else 0.0
+        self.stats['recorded_s'] = position_ns / 1e9
+        report = self.drift_report()
+        logging.info(f"Replayed {self.stats['frames']} frames from {self.path} into {self.port}: {report}")
+        return report
+
+    def start(self):
+        """Replay in a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def close(self):
+        self._stop.set()
+        self.wait()
+        if self.ser is not None:
+            self.ser.close()
+        if self._master is not None:
+            os.close(self._slave)
+            os.close(self._master)
+
+    def drift_report(self):
+        """Write drift from the scaled original timing in milliseconds, plus counters.
+
+        'late' counts frames written more than one character time (at the
+        target's baud rate) after their slot.
+        """
+        count = min(self.stats['frames'], len(self._drift))
+        report = dict(self.stats)
+        if count:
+            drift = self._drift[:count] / 1e6
+            p50, p90, p99 = np.percentile(drift, [50, 90, 99])
+            report['drift_ms'] = {'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+                                  'max': float(drift.max()), 'last': float(drift[(self.stats['frames'] - 1) % len(self._drift)])}
+        return report
+
+
+def _record_session(path, frames=2000, baudrate=115200):
+    """Write a capture of a Modbus-like poll: 8-byte requests, 25-byte responses 2 ms later."""
+    char_ns = character_time_ns(baudrate, 11)
+    writer = CaptureWriter(path)
+    now = time.monotonic_ns()
+    for i in range(frames // 2):
+        request = bytes([1 + i % 8, 3, 0, 100, 0, 10, 0, 0])
+        response = bytes([1 + i % 8, 3, 20]) + bytes(22)
+        writer.write(Frame('/dev/ttyUSB0', request, 'tx', now, now + 7 * char_ns, now + 8 * char_ns))
+        now += 8 * char_ns + 2_000_000
+        writer.write(Frame('/dev/ttyUSB0', response, 'rx', now, now + 24 * char_ns))
+        now += 25 * char_ns + 1_750_000 + (i % 5) * 1_000_000
+    writer.close()
+
+
+def benchmark(frames=2000):
+    """Replay a recorded poll into a pty at 1x, 2x and full speed and report the timing drift."""
+    path = os.path.join(tempfile.mkdtemp(), 'session.ucbcap')
+    _record_session(path, frames)
+    print(f"Capture: {capture_ports(path)}")
+    for speed in (1.0, 2.0, None):
+        replayer = Replayer(path, directions=None, speed=speed)
+
+        def drain():
+            # The software under test would open replayer.port; here it is only read and discarded
+            slave = os.open(replayer.port, os.O_RDWR | os.O_NOCTTY)
+            try:
+                while os.read(slave, 4096):
+                    pass
+            except OSError:
+                pass  # Replayer closed the pty
+            os.close(slave)
+
+        reader = threading.Thread(target=drain, daemon=True)
+        reader.start()
+        replayer.run()
+        report = replayer.drift_report()
+        replayer.close()
+        reader.join(1.0)
+        label = f"{speed:g}x" if speed else "as fast as possible"
+        print(f"{label}: {report['frames']} frames in {report['duration_s']:.3f} s "
+              f"(recording spans {report['recorded_s']:.3f} s), {report['late']} late, drift ms {report['drift_ms']}")
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    benchmark()
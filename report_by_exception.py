@@ -0,0 +1,99 @@
+import time
+
+import numpy as np  # For vectorised change detection
+
+NOT_SENT = object()  # Last value of a non-numeric tag that has never been sent
+
+
+class ReportByException:
+    """Pass on tag values only when they change by more than a deadband.
+
+    One instance covers a whole register array. Each tag has its own
+    deadband, either absolute (in engineering units) or a percentage of the
+    last reported value. A percentage deadband is never narrower than
+    min_deadband, so a tag last reported at or near 0 does not report every
+    bit of noise. Each tag also has an optional max_silence in seconds after which
+    the value is reported again even if unchanged (a heartbeat). All checks
+    run as numpy array operations over the full array in one step.
+    """
+
+    def __init__(self, names, deadband=0.0, percent=False, max_silence=None, min_deadband=0.0):
+        self.names = list(names)
+        size = len(self.names)
+        self.deadband = np.broadcast_to(np.asarray(deadband, dtype=np.float64), (size,)).copy()
+        self.percent = np.broadcast_to(np.asarray(percent, dtype=bool), (size,)).copy()
+        self.min_deadband = np.broadcast_to(np.asarray(min_deadband, dtype=np.float64), (size,)).copy()
+        if max_silence is None:
+            max_silence = np.inf
+        self.max_silence = np.broadcast_to(np.asarray(max_silence, dtype=np.float64), (size,)).copy()
+        self.last_value = np.full(size, np.nan)
+        self.last_report = np.full(size, -np.inf)
+        self.stats = {'updates': 0, 'reported': 0}
+
+    def changed(self, values, now=None):
+        """Return a boolean mask of the tags to report, and remember them as reported."""
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != self.last_value.shape:
+            raise ValueError(f"Expected {self.last_value.size} values, got {values.size}")
+        if now is None:
+            now = time.monotonic()
+        threshold = np.where(self.percent, np.maximum(np.abs(self.last_value) * self.deadband / 100.0,
+                                                      self.min_deadband), self.deadband)
+        with np.errstate(invalid='ignore'):
+            mask = np.abs(values - self.last_value) > threshold
+        mask |= np.isnan(self.last_value)  # Never reported yet
+        mask |= (now - self.last_report) >= self.max_silence  # Heartbeat due
+        self.last_value[mask] = values[mask]
+        self.last_report[mask] = now
+        self.stats['updates'] += values.size
+        self.stats['reported'] += int(np.count_nonzero(mask))
+        return mask
+
+    def update(self, values, now=None):
+        """Return a dict of tag name -> value for the tags that should be reported."""
+        mask = self.changed(values, now)
+        indices = np.flatnonzero(mask)
+        reported = np.asarray(values)[indices].tolist()
+        return {self.names[i]: value for i, value in zip(indices.tolist(), reported)}
+
+    def reset(self):
+        """Forget the last reported values so the next update reports every tag."""
+        self.last_value.fill(np.nan)
+        self.last_report.fill(-np.inf)
+
+
+class ReportByExceptionSink:
+    """Traffic sink wrapper that forwards only the tag values worth reporting.
+
+    publish_tags() keeps one ReportByException per source and set of tag
+    names and passes on just the numeric tags that moved past their
+    deadband (or are due a heartbeat); other values are passed on when they
+    differ from the last one sent. Frames go straight through. The keyword arguments are those of
+    ReportByException and apply to every tag.
+    """
+
+    def __init__(self, sink, **options):
+        self.sink = sink
+        self.options = options
+        self.filters = {}  # (source, tag names) -> ReportByException
+        self.last_other = {}  # (source, tag name) -> last non-numeric value sent
+
+    def publish_frame(self, port, data, direction='rx'):
+        return self.sink.publish_frame(port, data, direction)
+
+    def publish_tags(self, source, tags):
+        numeric = {name: value for name, value in tags.items()
+                   if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        key = (source, tuple(numeric))
+        if key not in self.filters:
+            self.filters[key] = ReportByException(key[1], **self.options)
+        report = self.filters[key].update(list(numeric.values())) if numeric else {}
+        for name, value in tags.items():
+            if name not in numeric and self.last_other.get((source, name), NOT_SENT) != value:
+                self.last_other[source, name] = report[name] = value
+        if not report:
+            return True
+        return self.sink.publish_tags(source, report)
+
+    def close(self):
+        self.sink.close()
@@ -0,0 +1,456 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+ACK, NAK, CAN = 0x06, 0x15, 0x18
+BYTE_TIMEOUT = 0.15  # Z-Wave serial API: a frame's bytes must arrive within 150 ms of each other
+ACK_TIMEOUT = 1.6  # Z-Wave serial API: the other side must ACK a frame within 1600 ms
+
+
+class SerialApiError(IOError):
+    """Raised when a controller does not ACK, answer or confirm a command."""
+
+
+class ZWaveCodec:
+    """Z-Wave serial API frames: SOF, LEN, type, function ID, payload, XOR checksum.
+
+    Every data frame is answered with a single ACK, NAK or CAN byte.
+    Callbacks are controller requests for functions such as ZW_SendData
+    whose first payload byte is the callback ID given in the command.
+    """
+
+    SOF = 0x01
+    REQUEST, RESPONSE = 0x00, 0x01
+    acknowledged = True
+    callback_functions = {0x13, 0x14, 0x4A, 0x4B}  # SendData, SendDataMulti, AddNode, RemoveNode
+
+    def encode(self, command, payload=b''):
+        body = bytes((len(payload) + 3, self.REQUEST, command)) + bytes(payload)
+        return bytes((self.SOF,)) + body + bytes((self.checksum(body),))
+
+    @staticmethod
+    def checksum(body):
+        value = 0xFF
+        for byte in body:
+            value ^= byte
+        return value
+
+    def frame_length(self, buffer):
+        return buffer[1] + 2 if len(buffer) >= 2 else None
+
+    def decode(self, frame):
+        """Return (frame type, function ID, payload), or raise ValueError on a bad checksum."""
+        if self.checksum(frame[1:-1]) != frame[-1]:
+            raise ValueError(f"Checksum mismatch in Z-Wave frame {frame.hex()}")
+        return frame[2], frame[3], frame[4:-1]
+
+    def is_response(self, decoded, command):
+        return decoded[0] == self.RESPONSE and decoded[1] == command
+
+    def callback_id(self, decoded):
+        frame_type, command, payload = decoded
+        if frame_type == self.REQUEST and command in self.callback_functions and payload:
+            return payload[0]
+        return None
+
+
+class ZnpCodec:
+    """TI Z-Stack (ZNP) monitor and test frames for Zigbee sticks: SOF, LEN, CMD0, CMD1, data, FCS.
+
+    There is no ACK layer; SREQs are answered by an SRSP with the same
+    command, and AF_DATA_REQUEST is confirmed later by an AF_DATA_CONFIRM
+    carrying its transaction ID. Commands are (subsystem, command ID).
+    """
+
+    SOF = 0xFE
+    SREQ, AREQ, SRSP = 0x20, 0x40, 0x60
+    acknowledged = False
+    AF_DATA_REQUEST = (0x04, 0x01)
+    AF_DATA_CONFIRM = (0x04, 0x80)
+
+    def encode(self, command, payload=b''):
+        subsystem, command_id = command
+        body = bytes((len(payload), self.SREQ | subsystem, command_id)) + bytes(payload)
+        return bytes((self.SOF,)) + body + bytes((self.checksum(body),))
+
+    @staticmethod
+    def checksum(body):
+        value = 0
+        for byte in body:
+            value ^= byte
+        return value
+
+    def frame_length(self, buffer):
+        return buffer[1] + 5 if len(buffer) >= 2 else None
+
+    def decode(self, frame):
+        if self.checksum(frame[1:-1]) != frame[-1]:
+            raise ValueError(f"FCS mismatch in ZNP frame {frame.hex()}")
+        return frame[2] & 0xE0, (frame[2] & 0x1F, frame[3]), frame[4:-1]
+
+    def is_response(self, decoded, command):
+        return decoded[0] == self.SRSP and decoded[1] == command
+
+    def callback_id(self, decoded):
+        frame_type, command, payload = decoded
+        if frame_type == self.AREQ and command == self.AF_DATA_CONFIRM and len(payload) >= 3:
+            return payload[2]  # Status, endpoint, transaction ID
+        return None
+
+
+class SerialApiEngine:
+    """Frame engine for Z-Wave and Zigbee USB controllers on a serial port.
+
+    A reader thread parses frames, ACKs (or NAKs) them immediately and
+    routes them: the response to the command in progress completes that
+    command, frames carrying a known callback ID complete the matching
+    Future, and everything else is queued for on_report(frame_type,
+    command, payload) on a separate thread so slow handlers never delay an
+    ACK. Commands go out one at a time up to their response, but up to
+    max_pending commands may be waiting for callbacks at once. Unacked
+    frames are retransmitted after 100 ms + n * 1 s, up to retries times.
+    """
+
+    def __init__(self, ser, codec=None, on_report=None, max_pending=8, retries=3,
+                 response_timeout=ACK_TIMEOUT, callback_timeout=65.0):
+        self.ser = ser
+        self.codec = codec or ZWaveCodec()
+        self.on_report = on_report
+        self.retries = retries
+        self.response_timeout = response_timeout
+        self.callback_timeout = callback_timeout
+        self.stats = {'sent': 0, 'retransmits': 0, 'naks_sent': 0, 'responses': 0,
+                      'callbacks': 0, 'reports': 0, 'discarded': 0}
+        self._write_lock = threading.Lock()
+        self._request_lock = threading.Lock()
+        self._window = threading.BoundedSemaphore(max_pending)
+        self._ack = threading.Event()
+        self._ack_byte = None
+        self._response = None
+        self._response_command = None
+        self._callbacks = {}  # Callback ID -> (Future, deadline)
+        self._callback_lock = threading.Lock()
+        self._next_id = 0
+        self._reports = queue.Queue()
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        self._running = True
+        self.ser.timeout = 0.05
+        self._threads = [threading.Thread(target=self._read_loop, daemon=True),
+                         threading.Thread(target=self._report_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def close(self):
+        self._running = False
+        self._reports.put(None)
+        for thread in self._threads:
+            thread.join()
+        with self._callback_lock:
+            for future, _ in self._callbacks.values():
+                future.set_exception(SerialApiError("Serial API engine closed"))
+            self._callbacks.clear()
+
+    def _write(self, data):
+        with self._write_lock:
+            self.ser.write(data)
+
+    def request(self, command, payload=b'', expect_response=True):
+        """Send a command, wait for its ACK and (if expected) its response; return the response payload."""
+        frame = self.codec.encode(command, payload)
+        with self._request_lock:
+            for attempt in range(self.retries + 1):
+                self._response = Future() if expect_response else None
+                self._response_command = command
+                self._ack.clear()
+                self._write(frame)
+                self.stats['sent'] += 1
+                if self.codec.acknowledged:
+                    if not self._ack.wait(ACK_TIMEOUT) or self._ack_byte != ACK:
+                        self.stats['retransmits'] += 1
+                        time.sleep(0.1 + attempt * 1.0)
+                        continue
+                if not expect_response:
+                    return None
+                try:
+                    return self._response.result(self.response_timeout)
+                except FutureTimeoutError:
+                    raise SerialApiError(f"No response to command {command} within {self.response_timeout} s")
+                finally:
+                    self._response = None
+            raise SerialApiError(f"Command {command} not acknowledged after {self.retries + 1} attempts")
+
+    def request_with_callback(self, command, build_payload):
+        """Send a command whose payload carries a callback ID.
+
+        build_payload(callback_id) returns the payload. Returns (response
+        payload, Future) where the Future completes with the callback
+        payload. Blocks while max_pending callbacks are outstanding.
+        """
+        self._window.acquire()
+        future = Future()
+        with self._callback_lock:
+            for _ in range(255):
+                self._next_id = self._next_id % 255 + 1  # IDs 1..255; 0 means "no callback"
+                if self._next_id not in self._callbacks:
+                    break
+            callback_id = future.callback_id = self._next_id
+            self._callbacks[callback_id] = (future, time.monotonic() + self.callback_timeout)
+        try:
+            response = self.request(command, build_payload(callback_id))
+        except Exception:
+            with self._callback_lock:
+                self._callbacks.pop(callback_id, None)
+            self._window.release()
+            raise
+        future.add_done_callback(lambda _: self._window.release())
+        return response, future
+
+    def cancel_callback(self, callback_id, reason):
+        with self._callback_lock:
+            entry = self._callbacks.pop(callback_id, None)
+        if entry is not None:
+            entry[0].set_exception(SerialApiError(reason))
+
+    def send_data(self, node_id, data, tx_options=0x25):
+        """Z-Wave ZW_SendData; returns a Future for the transmit status callback payload."""
+        payload = lambda callback_id: bytes((node_id, len(data))) + bytes(data) + bytes((tx_options, callback_id))
+        response, future = self.request_with_callback(0x13, payload)
+        if not response or response[0] == 0:
+            self.cancel_callback(future.callback_id, "Controller refused ZW_SendData (queue full)")
+        return future
+
+    def af_data_request(self, address, endpoint, cluster, data, source_endpoint=1, radius=0x1E):
+        """Zigbee (ZNP) AF_DATA_REQUEST; returns a Future for the AF_DATA_CONFIRM payload."""
+        payload = lambda transaction_id: (address.to_bytes(2, 'little') + bytes((endpoint, source_endpoint)) +
+                                          cluster.to_bytes(2, 'little') +
+                                          bytes((transaction_id, 0, radius, len(data))) + bytes(data))
+        response, future = self.request_with_callback(ZnpCodec.AF_DATA_REQUEST, payload)
+        if not response or response[0] != 0:
+            self.cancel_callback(future.callback_id, f"AF_DATA_REQUEST refused: status {response[:1].hex()}")
+        return future
+
+    def _read_loop(self):
+        buffer = bytearray()
+        last_byte = time.monotonic()
+        while self._running:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                logging.error(f"Serial API read failed: {e}")
+                break
+            now = time.monotonic()
+            if not data:
+                if buffer and now - last_byte > BYTE_TIMEOUT:
+                    logging.warning(f"Discarding incomplete serial API frame {bytes(buffer).hex()}")
+                    self.stats['discarded'] += 1
+                    buffer.clear()
+                self._expire_callbacks(now)
+                continue
+            buffer += data
+            last_byte = now
+            self._parse(buffer)
+
+    def _parse(self, buffer):
+        while buffer:
+            if self.codec.acknowledged and buffer[0] in (ACK, NAK, CAN):
+                self._ack_byte = buffer.pop(0)
+                self._ack.set()
+                continue
+            if buffer[0] != self.codec.SOF:
+                buffer.pop(0)
+                self.stats['discarded'] += 1
+                continue
+            length = self.codec.frame_length(buffer)
+            if length is None or len(buffer) < length:
+                return
+            frame = bytes(buffer[:length])
+            del buffer[:length]
+            try:
+                decoded = self.codec.decode(frame)
+            except ValueError as e:
+                logging.warning(str(e))
+                if self.codec.acknowledged:
+                    self._write(bytes((NAK,)))
+                    self.stats['naks_sent'] += 1
+                continue
+            if self.codec.acknowledged:
+                self._write(bytes((ACK,)))  # ACK before any routing so handlers cannot delay it
+            self._route(decoded)
+
+    def _route(self, decoded):
+        response = self._response
+        if response is not None and self.codec.is_response(decoded, self._response_command):
+            self.stats['responses'] += 1
+            response.set_result(decoded[2])
+            return
+        callback_id = self.codec.callback_id(decoded)
+        if callback_id is not None:
+            with self._callback_lock:
+                entry = self._callbacks.pop(callback_id, None)
+            if entry is not None:
+                self.stats['callbacks'] += 1
+                entry[0].set_result(decoded[2])
+                return
+        self.stats['reports'] += 1
+        self._reports.put(decoded)
+
+    def _expire_callbacks(self, now):
+        with self._callback_lock:
+            expired = [callback_id for callback_id, (_, deadline) in self._callbacks.items() if deadline < now]
+        for callback_id in expired:
+            self.cancel_callback(callback_id, f"No callback for ID {callback_id} within {self.callback_timeout} s")
+
+    def _report_loop(self):
+        while True:
+            decoded = self._reports.get()
+            if decoded is None:
+                return
+            if self.on_report is not None:
+                try:
+                    self.on_report(*decoded)
+                except Exception as e:
+                    logging.error(f"Serial API report handler failed: {e}")
+
+
+class ZWaveControllerStandIn:
+    """Z-Wave controller on a pseudo-terminal, for tests and benchmarks.
+
+    ACKs host frames, answers ZW_GetVersion and ZW_SendData (queueing up to
+    queue_size transmissions that each take airtime seconds before their
+    callback), and sends an unsolicited ApplicationCommandHandler report
+    every report_interval seconds. Output is paced at baudrate. Linux only.
+    """
+
+    def __init__(self, airtime=0.004, queue_size=16, report_interval=0.01, baudrate=115200):
+        self.airtime = airtime
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.byte_time = 10 / baudrate
+        self.codec = ZWaveCodec()
+        self.stats = {'frames': 0, 'acks_received': 0, 'refused': 0, 'reports': 0}
+        import tty  # Unix only, like the pty
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self._radio = queue.Queue()
+        self._write_lock = threading.Lock()
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        self._running = True
+        self._threads = [threading.Thread(target=target, daemon=True)
+                         for target in (self._serve, self._transmit, self._report)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def close(self):
+        self._running = False
+        self._radio.put(None)
+        os.close(self._slave)
+        for thread in self._threads:
+            thread.join()
+        os.close(self._master)
+
+    def _write(self, data):
+        with self._write_lock:
+            time.sleep(len(data) * self.byte_time)
+            os.write(self._master, data)
+
+    def _frame(self, frame_type, command, payload):
+        body = bytes((len(payload) + 3, frame_type, command)) + bytes(payload)
+        return bytes((ZWaveCodec.SOF,)) + body + bytes((ZWaveCodec.checksum(body),))
+
+    def _serve(self):
+        buffer = bytearray()
+        while self._running:
+            try:
+                buffer += os.read(self._master, 256)
+            except OSError:
+                return
+            while buffer:
+                if buffer[0] in (ACK, NAK, CAN):
+                    self.stats['acks_received'] += buffer[0] == ACK
+                    buffer.pop(0)
+                    continue
+                if buffer[0] != ZWaveCodec.SOF:
+                    buffer.pop(0)
+                    continue
+                if len(buffer) < 2 or len(buffer) < buffer[1] + 2:
+                    break
+                frame = bytes(buffer[:buffer[1] + 2])
+                del buffer[:buffer[1] + 2]
+                try:
+                    _, command, payload = self.codec.decode(frame)
+                except ValueError:
+                    self._write(bytes((NAK,)))
+                    continue
+                self.stats['frames'] += 1
+                self._write(bytes((ACK,)))
+                if command == 0x15:  # ZW_GetVersion
+                    self._write(self._frame(ZWaveCodec.RESPONSE, command, b'Z-Wave 7.18\x00\x07'))
+                elif command == 0x13:  # ZW_SendData
+                    if self._radio.qsize() >= self.queue_size:
+                        self.stats['refused'] += 1
+                        self._write(self._frame(ZWaveCodec.RESPONSE, command, b'\x00'))
+                    else:
+                        self._write(self._frame(ZWaveCodec.RESPONSE, command, b'\x01'))
+                        self._radio.put(payload[-1])
+
+    def _transmit(self):
+        while True:
+            callback_id = self._radio.get()
+            if callback_id is None or not self._running:
+                return
+            time.sleep(self.airtime)
+            self._write(self._frame(ZWaveCodec.REQUEST, 0x13, bytes((callback_id, 0x00, 0x00, 0x02))))
+
+    def _report(self):
+        value = 0
+        while self._running:
+            time.sleep(self.report_interval)
+            value = (value + 1) & 0xFF
+            # ApplicationCommandHandler: status, node 5, SENSOR_MULTILEVEL_REPORT
+            self._write(self._frame(ZWaveCodec.REQUEST, 0x04, bytes((0x00, 0x05, 0x04, 0x31, 0x05, 0x01, value))))
+            self.stats['reports'] += 1
+
+
+def benchmark(commands=500):
+    """Measure ZW_SendData commands/s against the pty controller, waiting per command and pipelined."""
+    import serial  # For serial communication
+    controller = ZWaveControllerStandIn().start()
+    reports = []
+    engine = SerialApiEngine(serial.Serial(controller.port, 115200), on_report=lambda *frame: reports.append(frame))
+    engine.start()
+    version = engine.request(0x15)
+
+    start = time.perf_counter()
+    for i in range(commands):
+        engine.send_data(2 + i % 10, b'\x25\x01\xFF').result(5)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    futures = [engine.send_data(2 + i % 10, b'\x25\x01\xFF') for i in range(commands)]
+    statuses = [future.result(5)[1] for future in futures]
+    pipelined = time.perf_counter() - start
+    engine.close()
+    engine.ser.close()
+    controller.close()
+    print(f"Controller version: {version[:-2].decode()}")
+    print(f"Waiting for each callback: {commands / sequential:.0f} commands/s")
+    print(f"Pipelined with callback IDs: {commands / pipelined:.0f} commands/s "
+          f"({statuses.count(0)} of {commands} transmitted OK)")
+    print(f"Unsolicited reports routed: {len(reports)}, engine stats: {engine.stats}")
+
+
+if __name__ == '__main__':
+    benchmark()
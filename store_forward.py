@@ -0,0 +1,198 @@
+import logging
+import sqlite3
+import threading
+import time
+
+
+class StoreAndForwardQueue:
+    """Durable outbound queue between the bridge and its network sinks.
+
+    Messages are appended to a SQLite database in WAL mode, so they survive
+    a broker or upstream outage and a restart of the bridge. Delivery drains
+    the oldest messages in batches and only deletes what the sink accepted,
+    so replay keeps the original order for every source. max_bytes caps the
+    stored payload size; once reached, the oldest messages are discarded
+    (overflow='drop_oldest') or new ones are refused (overflow='reject').
+    A put larger than the whole quota is always refused.
+    """
+
+    def __init__(self, path='store_forward.db', max_bytes=100 * 1024 * 1024, overflow='drop_oldest'):
+        if overflow not in ('drop_oldest', 'reject'):
+            raise ValueError("overflow must be 'drop_oldest' or 'reject'")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+        self.stats = {'stored': 0, 'delivered': 0, 'discarded': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")  # Only takes effect on a new database
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, source TEXT, topic TEXT, payload BLOB, ts REAL)")
+        self.size = self._db.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM messages").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def put(self, source, topic, payload):
+        """Store one message; returns False if it was refused by the quota."""
+        return self.put_many([(source, topic, payload)]) == 1
+
+    def put_many(self, messages):
+        """Store (source, topic, payload) tuples in one transaction; returns how many were kept."""
+        now = time.time()
+        rows = [(source, topic, payload if isinstance(payload, bytes) else str(payload).encode('utf-8'), now)
+                for source, topic, payload in messages]
+        incoming = sum(len(row[2]) for row in rows)
+        with self._lock:
+            if incoming > self.max_bytes:
+                # Making room would empty the whole store and still not fit
+                self.stats['rejected'] += len(rows)
+                logging.warning(f"Store-and-forward put of {incoming} bytes exceeds the {self.max_bytes}-byte quota, "
+                                f"rejected {len(rows)} messages")
+                return 0
+            if self.size + incoming > self.max_bytes and self.overflow == 'reject':
+                self.stats['rejected'] += len(rows)
+                logging.warning(f"Store-and-forward queue full, rejected {len(rows)} messages")
+                return 0
+            self._db.execute("BEGIN")
+            if self.size + incoming > self.max_bytes:
+                self._discard_oldest(self.size + incoming - self.max_bytes)
+            self._db.executemany("INSERT INTO messages (source, topic, payload, ts) VALUES (?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+            self.size += incoming
+            self.stats['stored'] += len(rows)
+        return len(rows)
+
+    def _discard_oldest(self, excess):
+        """Delete the oldest messages until at least excess payload bytes are freed."""
+        freed, last_id, count = 0, None, 0
+        for message_id, length in self._db.execute("SELECT id, LENGTH(payload) FROM messages ORDER BY id"):
+            freed += length
+            last_id = message_id
+            count += 1
+            if freed >= excess:
+                break
+        if last_id is not None:
+            self._db.execute("DELETE FROM messages WHERE id <= ?", (last_id,))
+            self.size -= freed
+            self.stats['discarded'] += count
+            logging.warning(f"Store-and-forward quota reached, discarded {count} oldest messages")
+
+    def peek(self, batch_size=500):
+        """Return the oldest batch as (id, source, topic, payload, ts) tuples without removing it."""
+        with self._lock:
+            return self._db.execute("SELECT id, source, topic, payload, ts FROM messages ORDER BY id LIMIT ?",
+                                    (batch_size,)).fetchall()
+
+    def ack(self, batch):
+        """Remove delivered messages (a prefix of what peek returned)."""
+        if not batch:
+            return
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE id <= ?", (batch[-1][0],))
+            self.size -= sum(len(row[3]) for row in batch)
+            self.stats['delivered'] += len(batch)
+
+    def drain(self, send_batch, batch_size=500):
+        """Deliver queued messages in order until the queue is empty or the sink fails.
+
+        send_batch receives a list of (id, source, topic, payload, ts) tuples and
+        returns how many of them, from the front of the list, were delivered.
+        Returns the number of messages delivered.
+        """
+        delivered = 0
+        while True:
+            batch = self.peek(batch_size)
+            if not batch:
+                break
+            try:
+                sent = send_batch(batch)
+            except Exception as e:
+                logging.error(f"Store-and-forward delivery failed: {e}")
+                sent = 0
+            self.ack(batch[:sent])
+            delivered += sent
+            if sent < len(batch):
+                break  # Link is down again; keep the rest for the next drain
+        if delivered:
+            self.compact()
+        return delivered
+
+    def compact(self):
+        """Give freed pages back to the filesystem and fold the WAL into the database."""
+        with self._lock:
+            self._db.execute("PRAGMA incremental_vacuum")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class Forwarder:
+    """Background thread that drains a StoreAndForwardQueue whenever the link is up."""
+
+    def __init__(self, store, send_batch, is_connected, batch_size=500, interval=1.0):
+        self.store = store
+        self.send_batch = send_batch
+        self.is_connected = is_connected
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.is_connected():
+                self.store.drain(self.send_batch, self.batch_size)
+            self._stop.wait(self.interval)
+
+
+def mqtt_sender(client, track, qos=1, timeout=10.0):
+    """Build a send_batch callable that publishes stored messages with a paho client.
+
+    publish() returning success only means paho has queued the message in
+    memory, so a message counts as delivered once its PUBACK arrives:
+    track(mid, callback) must call callback(mid) from paho's on_publish, as
+    MqttSink.track does. send_batch waits up to timeout for the batch and
+    returns the length of the acknowledged prefix; the rest stays stored
+    and is sent again on the next drain.
+    """
+    def send_batch(batch):
+        if not client.is_connected():
+            return 0
+        acked = set()
+        done = threading.Condition()
+
+        def acknowledge(mid):
+            with done:
+                acked.add(mid)
+                done.notify_all()
+
+        mids = []
+        for _, _, topic, payload, _ in batch:
+            info = client.publish(topic, payload, qos=qos)
+            if info.rc != 0:
+                break
+            mids.append(info.mid)
+            track(info.mid, acknowledge)
+        deadline = time.monotonic() + timeout
+        with done:
+            while not acked.issuperset(mids) and time.monotonic() < deadline:
+                done.wait(max(0.0, deadline - time.monotonic()))
+            sent = 0
+            while sent < len(mids) and mids[sent] in acked:
+                sent += 1
+        return sent
+    return send_batch
@@ -0,0 +1,29 @@
+"""Frames and file damage shared by the capture and archive tests."""
+import os
+
+from frames import Frame
+
+
+def make_frames(count, start=0):
+    frames = []
+    for i in range(start, start + count):
+        first_ns = 1_000_000_000 + i * 1_000_000
+        frames.append(Frame(f"COM{i % 3}", bytes([i & 0xFF]) * (1 + i % 7), 'tx' if i % 2 else 'rx',
+                            first_ns, first_ns + 500_000, first_ns + 600_000 if i % 2 else None))
+    return frames
+
+
+def summary(frame):
+    return frame.port, frame.data, frame.direction, frame.first_ns, frame.last_ns, frame.done_ns
+
+
+def write_all(writer, frames):
+    for frame in frames:
+        writer.write(frame)
+    writer.close()
+
+
+def tear(path, count):
+    """Cut count bytes off the end of a file, as a crash in the middle of a write would leave it."""
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - count)
@@ -0,0 +1,60 @@
+import os
+
+from archive import ArchiveReader, ArchiveWriter, index_path, load_index
+from capture import MAGIC, read_capture, torn_tail
+from recordings import make_frames, summary, tear, write_all
+
+
+def test_archive_round_trip_and_seek(tmp_path):
+    path = str(tmp_path / 'traffic.ucbarc')
+    frames = make_frames(1000)
+    write_all(ArchiveWriter(path, stride=64), frames)
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 1000
+        assert len(reader.index) == -(-1000 // 64)
+        assert [summary(frame) for _, frame, _ in reader] == [summary(frame) for frame in frames]
+        number, frame, _ = reader.frame(777)
+        assert number == 777 and summary(frame) == summary(frames[777])
+        first_wall = next(iter(reader))[2]
+        number, _, wall = next(reader.seek_time(first_wall + 500 * 1_000_000))
+        assert number == 500 and wall == first_wall + 500 * 1_000_000
+
+
+def test_archive_append_after_torn_tail(tmp_path):
+    path = str(tmp_path / 'traffic.ucbarc')
+    frames = make_frames(300)
+    write_all(ArchiveWriter(path, stride=64), frames)
+    tear(path, 2)
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 299
+
+    more = make_frames(100, start=300)
+    write_all(ArchiveWriter(path, stride=64), more)
+    assert torn_tail(path) == 0
+    with ArchiveReader(path) as reader:
+        items = list(reader)
+    assert [number for number, _, _ in items] == list(range(399))
+    assert [summary(frame) for _, frame, _ in items] == [summary(frame) for frame in frames[:-1] + more]
+    _, index = load_index(path)
+    assert list(index['offset']) == sorted(index['offset']) and index['offset'][-1] < os.path.getsize(path)
+
+
+def test_reader_does_not_rewrite_missing_index(tmp_path):
+    path = str(tmp_path / 'traffic.ucbarc')
+    write_all(ArchiveWriter(path, stride=16), make_frames(100))
+    os.remove(index_path(path))
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 100
+    assert not os.path.exists(index_path(path))
+    with ArchiveReader(path, rebuild=True) as reader:
+        assert len(reader) == 100
+    assert os.path.exists(index_path(path))
+
+
+def test_archive_is_a_capture(tmp_path):
+    path = str(tmp_path / 'traffic.ucbarc')
+    frames = make_frames(100)
+    write_all(ArchiveWriter(path, stride=16), frames)
+    with open(path, 'rb') as f:
+        assert f.read(len(MAGIC)) == MAGIC
+    assert [summary(frame) for frame in read_capture(path)] == [summary(frame) for frame in frames]
@@ -0,0 +1,105 @@
+import pytest
+
+from bus_sniffer import BusSniffer, decode_frame, decode_hostlink, decode_modbus, hostlink_frame, modbus_crc, modbus_frame
+from frames import Frame
+
+MS = 1_000_000
+
+
+def test_modbus_crc():
+    assert modbus_crc(bytes.fromhex('01030000000a')) == 0xCDC5
+    assert modbus_frame(1, 3, bytes.fromhex('0000000a')) == bytes.fromhex('01030000000ac5cd')
+
+
+def test_decode_modbus():
+    request = decode_modbus(modbus_frame(7, 3, bytes([0, 100, 0, 2])))
+    assert request == {'protocol': 'modbus', 'unit': 7, 'function': 3, 'kind': 'request', 'address': 100, 'count': 2}
+    response = decode_modbus(modbus_frame(7, 3, bytes([4, 0, 1, 0, 2])))
+    assert response['kind'] == 'response' and response['byte_count'] == 4
+    exception = decode_modbus(modbus_frame(7, 0x83, b'\x02'))
+    assert exception['function'] == 3 and exception['exception'] == 2
+    assert decode_modbus(modbus_frame(7, 3, bytes([0, 100, 0, 2]))[:-1] + b'\x00') is None
+
+
+@pytest.mark.parametrize('header, text, kind, end_code', [
+    ('RD', '01000002', 'request', None),
+    ('RD', '0000010002', 'response', '00'),
+    ('RD', '15', 'response', '15'),
+    ('WD', '0100BEEF', 'request', None),
+    ('WD', 'A3', 'response', 'A3'),
+    ('MS', '', 'request', None),
+    ('SC', '02', None, None),  # Same shape both ways: left to the conversation
+])
+def test_decode_hostlink(header, text, kind, end_code):
+    fields = decode_hostlink(hostlink_frame(3, header, text))
+    assert fields['unit'] == 3 and fields['header'] == header and fields['fcs_ok']
+    assert fields['kind'] == kind and fields.get('end_code') == end_code
+    assert fields.get('exception') == (end_code if end_code not in (None, '00') else None)
+
+
+def test_glued_hostlink_frames_do_not_decode_as_one():
+    glued = hostlink_frame(0, 'RD', '01000002') + hostlink_frame(0, 'RD', '0000010002')
+    assert decode_frame(glued) is None
+
+
+def rx(data, first_ns, last_ns=None):
+    return Frame('COM1', data, 'rx', first_ns, last_ns if last_ns is not None else first_ns + len(data) * 87_000)
+
+
+def run(sniffer, bursts):
+    """Feed bursts through reassembly and decoding as the decoder thread would; return the pairs seen."""
+    pairs = []
+    sniffer.on_transaction = lambda request, response, latency_ns: pairs.append((request.data, response.data,
+                                                                                latency_ns))
+    for burst in bursts:
+        for part in sniffer._reassemble(burst):
+            sniffer.process(part)
+    sniffer._release_held(None)
+    return pairs
+
+
+@pytest.fixture
+def sniffer():
+    return BusSniffer('COM1', 115200)
+
+
+def test_request_and_response_pair(sniffer):
+    request, response = modbus_frame(1, 3, bytes([0, 0, 0, 1])), modbus_frame(1, 3, bytes([2, 0, 9]))
+    pairs = run(sniffer, [rx(request, 0, 1 * MS), rx(response, 3 * MS)])
+    assert pairs == [(request, response, 2 * MS)]
+    assert sniffer.stats['transactions'] == 1 and sniffer.stats['decoded'] == 2
+
+
+def test_glued_frames_are_split_and_paired(sniffer):
+    request, response = modbus_frame(1, 3, bytes([0, 0, 0, 1])), modbus_frame(1, 3, bytes([2, 0, 9]))
+    pairs = run(sniffer, [rx(request + response, 0)])
+    assert [pair[:2] for pair in pairs] == [(request, response)]
+    assert sniffer.stats['resynced'] == 1
+
+
+def test_frame_cut_by_a_late_wakeup_is_merged(sniffer):
+    request = hostlink_frame(0, 'RD', '01000002')
+    response = hostlink_frame(0, 'RD', '0000010002')
+    pairs = run(sniffer, [rx(request, 0), rx(response[:5], 5 * MS), rx(response[5:], 7 * MS)])
+    assert [pair[:2] for pair in pairs] == [(request, response)]
+    assert sniffer.stats['merged'] == 1 and sniffer.stats['undecoded'] == 0
+
+
+def test_exception_response_counted(sniffer):
+    pairs = run(sniffer, [rx(hostlink_frame(0, 'WD', '01000001'), 0), rx(hostlink_frame(0, 'WD', '13'), 5 * MS),
+                          rx(modbus_frame(2, 6, bytes([0, 1, 0, 5])), 10 * MS), rx(modbus_frame(2, 0x86, b'\x02'), 15 * MS)])
+    assert len(pairs) == 2 and sniffer.stats['exceptions'] == 2
+
+
+def test_unanswered_request_expires(sniffer):
+    request = modbus_frame(1, 3, bytes([0, 0, 0, 1]))
+    late = modbus_frame(1, 3, bytes([2, 0, 9]))
+    pairs = run(sniffer, [rx(request, 0), rx(late, 2_000 * MS)])
+    assert pairs == []
+    assert sniffer.stats['unanswered'] == 1 and sniffer.stats['unmatched'] == 1
+
+
+def test_noise_is_reported_as_undecoded(sniffer):
+    run(sniffer, [rx(b'\x00\xff\x13\x37\x42', 0)])
+    assert sniffer.stats['undecoded'] == 1
+    assert sniffer.drop_report()['undecoded'] == 1
@@ -0,0 +1,43 @@
+import pytest
+
+from capture import CaptureError, CaptureWriter, iter_capture, read_capture, torn_tail
+from recordings import make_frames, summary, tear, write_all
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / 'traffic.ucbcap')
+    frames = make_frames(200)
+    write_all(CaptureWriter(path), frames)
+    assert [summary(frame) for frame in read_capture(path)] == [summary(frame) for frame in frames]
+    assert torn_tail(path) == 0
+    offsets = {offset for _, offset in iter_capture(path)}
+    assert len(offsets) == 1  # One session, one wall-clock offset
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not a capture file')
+    with pytest.raises(CaptureError):
+        list(read_capture(str(path)))
+
+
+def test_capture_torn_tail_is_skipped_then_cut_before_appending(tmp_path):
+    path = str(tmp_path / 'traffic.ucbcap')
+    frames = make_frames(50)
+    write_all(CaptureWriter(path), frames)
+    tear(path, 3)
+    assert torn_tail(path) > 0
+    assert [summary(frame) for frame in read_capture(path)] == [summary(frame) for frame in frames[:-1]]
+
+    more = make_frames(10, start=50)
+    write_all(CaptureWriter(path), more)
+    assert torn_tail(path) == 0
+    assert [summary(frame) for frame in read_capture(path)] == [summary(frame) for frame in frames[:-1] + more]
+
+
+def test_capture_torn_header(tmp_path):
+    path = str(tmp_path / 'traffic.ucbcap')
+    write_all(CaptureWriter(path), make_frames(5))
+    with open(path, 'ab') as f:
+        f.write(b'\x01\x02\x03')  # Part of the next record header
+    assert len(list(read_capture(path))) == 5
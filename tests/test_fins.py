@@ -0,0 +1,115 @@
+import socket
+import struct
+
+import pytest
+
+from fins.fins_common import FinsCommandCode
+
+from fins_pool import (MAX_WRITE_WORDS, FramedTCPFinsConnection, build_multiple_read_text, parse_address,
+                       parse_multiple_read_response, plan_word_writes)
+from fins_udp import FinsUdpClient, FinsUdpResponder
+
+
+def tcp_message(command, body, error=0):
+    return b'FINS' + struct.pack('>III', 8 + len(body), command, error) + body
+
+
+def response_frame(data, end_code=b'\x00\x00'):
+    return bytes([0xC0, 0x00, 0x02, 0x00, 0x00, 0x00, 0x00, 0x01, 0x00, 0x01]) + b'\x01\x04' + end_code + data
+
+
+@pytest.fixture
+def connection():
+    connection = FramedTCPFinsConnection()
+    connection.fins_socket.close()
+    connection.fins_socket, plc = socket.socketpair()
+    connection.fins_socket.settimeout(1)
+    yield connection, plc
+    plc.close()
+
+
+def test_parse_address():
+    assert parse_address('D100') == (b'\x82', 100)
+    assert parse_address(('cio', 5)) == (b'\xb0', 5)
+    with pytest.raises(ValueError):
+        parse_address('X12')
+
+
+def test_multiple_read_round_trip():
+    text = build_multiple_read_text([parse_address('D100'), parse_address('CIO5')])
+    assert text == b'\x82\x00\x64\x00\xb0\x00\x05\x00'
+    response = response_frame(b'\x82\x12\x34\xb0\x00\x07')
+    assert parse_multiple_read_response(response, 2) == [0x1234, 7]
+    with pytest.raises(IOError):
+        parse_multiple_read_response(response_frame(b'', end_code=b'\x11\x01'), 2)
+
+
+def test_word_writes_grouped_into_runs():
+    runs = plan_word_writes({'D101': 2, 'CIO5': 9, 'D100': 1, 'D103': 4, 'd101': 7})
+    assert runs == [('D100', [1, 7]), ('D103', [4]), ('CIO5', [9])]
+    runs = plan_word_writes({f"D{i}": i for i in range(MAX_WRITE_WORDS + 1)})
+    assert [(address, len(words)) for address, words in runs] == [('D0', MAX_WRITE_WORDS), (f"D{MAX_WRITE_WORDS}", 1)]
+
+
+def test_reply_split_across_reads(connection):
+    connection, plc = connection
+    frame = response_frame(b'\x82\x00\x2a')
+    message = tcp_message(2, frame)
+    plc.sendall(message[:5])  # Arrives in pieces, header included
+    plc.sendall(message[5:19])
+    plc.sendall(message[19:])
+    assert connection.fins_frame_send(b'request') == frame
+    assert plc.recv(100) == tcp_message(2, b'request')
+
+
+def test_two_replies_in_one_read_stay_apart(connection):
+    connection, plc = connection
+    first, second = response_frame(b'\x82\x00\x01'), response_frame(b'\x82\x00\x02')
+    plc.sendall(tcp_message(2, first) + tcp_message(2, second))
+    assert connection.fins_frame_send(b'a') == first
+    assert connection.fins_frame_send(b'b') == second
+
+
+@pytest.mark.parametrize('reply', [
+    b'XXXX' + bytes(12),  # Not FINS/TCP at all
+    tcp_message(2, b'', error=1),  # FINS/TCP error code
+    tcp_message(3, response_frame(b'')),  # Frame send error notification
+    tcp_message(1, response_frame(b'')),  # Wrong reply command
+    b'FINS' + struct.pack('>III', 1 << 20, 2, 0),  # Declared length far too long
+])
+def test_bad_reply_raises_connection_error(connection, reply):
+    connection, plc = connection
+    plc.sendall(reply)
+    with pytest.raises(ConnectionError):
+        connection.fins_frame_send(b'request')
+
+
+def test_udp_read_multiple():
+    responder = FinsUdpResponder().start()
+    client = FinsUdpClient(*responder.address, timeout=0.2).start()
+    try:
+        assert client.read_multiple(['D7', 'D300', 'CIO1']) == [7, 300, 1]
+    finally:
+        client.close()
+        responder.close()
+    assert client.stats['timeouts'] == 0
+
+
+def test_udp_reply_must_match_node_and_command():
+    client = FinsUdpClient('10.0.0.5', src_node=1)
+    client._socket, plc = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    client._socket.setblocking(False)
+    try:
+        future = client.send_command(FinsCommandCode().MULTIPLE_MEMORY_AREA_READ, b'\x82\x00\x09\x00')
+        request = plc.recv(100)
+        header = bytes([0xC0, 0x00, 0x02, 0x00, 0x01, 0x00, 0x00, 0x05, 0x00, request[9]])
+        plc.send(header[:7] + b'\x06' + header[8:] + b'\x01\x04\x00\x00\x82\x00\x09')  # Another node
+        plc.send(header + b'\x01\x01\x00\x00\x00\x09')  # Another command
+        client._drain_socket()
+        assert not future.done() and client.stats['unmatched'] == 2
+        plc.send(header + b'\x01\x04\x00\x00\x82\x00\x09')
+        client._drain_socket()
+        assert parse_multiple_read_response(future.result(0), 1) == [9]
+    finally:
+        client._socket.close()
+        plc.close()
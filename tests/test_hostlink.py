@@ -0,0 +1,84 @@
+import pytest
+
+from hostlink import (MAX_CONTINUATION_LENGTH, MAX_FRAME_LENGTH, HostLink, HostLinkError, compute_fcs,
+                      plan_dm_reads)
+
+
+def frame(body, last=True):
+    return body + compute_fcs(body) + ('*\r' if last else '\r')
+
+
+class ScriptedPort:
+    """Serial port stand-in: records what is written and answers from a list of reply frames."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.written = []
+        self.waiting = b''
+
+    def reset_input_buffer(self):
+        pass
+
+    def write(self, data):
+        self.written.append(data.decode('ascii'))
+        if self.replies:
+            self.waiting = self.replies.pop(0).encode('ascii')
+
+    def read_until(self, terminator):
+        data, self.waiting = self.waiting, b''
+        return data
+
+
+def test_fcs():
+    assert compute_fcs('@00RD00000001') == '57'
+
+
+def test_plan_dm_reads_merges_nearby_addresses():
+    assert plan_dm_reads([100, 101, 120, 200]) == [(100, 21), (200, 1)]
+    assert plan_dm_reads([0, 29, 30], max_words=30) == [(0, 30), (30, 1)]
+
+
+def test_read_words():
+    port = ScriptedPort([frame('@00RD00' + '0001' + 'BEEF')])
+    assert HostLink(port).read_words('DM', 100, 2) == [1, 0xBEEF]
+    assert port.written == [frame('@00RD01000002')]
+
+
+def test_multi_frame_response_is_collected():
+    first = frame('@00RD00' + '0001' * 30, last=False)
+    port = ScriptedPort([first, frame('0002' * 2)])
+    assert HostLink(port).read_words('DM', 0, 32) == [1] * 30 + [2, 2]
+    assert port.written[1] == '\r'  # Asks for the next frame
+
+
+def test_error_end_code_raises():
+    port = ScriptedPort([frame('@00RD15')])
+    with pytest.raises(HostLinkError, match='15'):
+        HostLink(port).read_words('DM', 0, 1)
+
+
+def test_fcs_mismatch_raises():
+    port = ScriptedPort(['@00RD00000100*\r'])
+    with pytest.raises(HostLinkError, match='FCS'):
+        HostLink(port).read_words('DM', 0, 1)
+
+
+def test_long_write_respects_frame_limits():
+    # Intermediate frames are acknowledged with a bare delimiter frame, the last with the end code
+    port = ScriptedPort([frame('', last=False)] * 3 + [frame('@00WD00')])
+    HostLink(port).write_dm(100, list(range(100)))
+    lengths = [len(sent) for sent in port.written]
+    assert len(lengths) == 4
+    assert lengths[0] <= MAX_FRAME_LENGTH
+    assert all(length <= MAX_CONTINUATION_LENGTH for length in lengths[1:])
+    data = ''.join(sent[:-3] for sent in port.written[:-1]) + port.written[-1][:-4]
+    assert data[len('@00WD0100'):] == ''.join(f"{value:04X}" for value in range(100))
+
+
+@pytest.mark.parametrize('start', [-1, 10000])
+def test_start_address_out_of_range(start):
+    link = HostLink(ScriptedPort([]))
+    with pytest.raises(ValueError):
+        link.read_words('DM', start, 1)
+    with pytest.raises(ValueError):
+        link.write_words('DM', start, [1])
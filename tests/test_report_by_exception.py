@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from report_by_exception import ReportByException, ReportByExceptionSink
+
+
+def test_first_update_reports_everything():
+    rbe = ReportByException(['a', 'b'], deadband=1.0)
+    assert rbe.update([5, 6], now=0) == {'a': 5, 'b': 6}
+
+
+def test_absolute_deadband():
+    rbe = ReportByException(['a', 'b'], deadband=[1.0, 10.0])
+    rbe.update([0, 0], now=0)
+    assert rbe.update([0.5, 5], now=1) == {}
+    assert rbe.update([1.5, 10.5], now=2) == {'a': 1.5, 'b': 10.5}
+    assert rbe.update([1.0, 10.5], now=3) == {}  # Measured from the last reported value
+
+
+def test_percent_deadband():
+    rbe = ReportByException(['a'], deadband=10.0, percent=True)
+    rbe.update([100], now=0)
+    assert rbe.update([109], now=1) == {}
+    assert rbe.update([111], now=2) == {'a': 111}
+
+
+def test_percent_deadband_floor_near_zero():
+    noisy = ReportByException(['a'], deadband=10.0, percent=True)
+    floored = ReportByException(['a'], deadband=10.0, percent=True, min_deadband=0.5)
+    for rbe in (noisy, floored):
+        rbe.update([0], now=0)
+    assert noisy.update([0.01], now=1) == {'a': 0.01}  # 10% of 0 is 0: every change reported
+    assert floored.update([0.01], now=1) == {}
+    assert floored.update([0.6], now=2) == {'a': 0.6}
+
+
+def test_heartbeat():
+    rbe = ReportByException(['a'], deadband=1.0, max_silence=5.0)
+    rbe.update([1], now=0)
+    assert rbe.update([1], now=4.9) == {}
+    assert rbe.update([1], now=5.0) == {'a': 1}
+
+
+def test_wrong_size_rejected():
+    rbe = ReportByException(['a', 'b'])
+    with pytest.raises(ValueError):
+        rbe.changed(np.zeros(3))
+
+
+class RecordingSink:
+    def __init__(self):
+        self.frames, self.tags, self.closed = [], [], False
+
+    def publish_frame(self, port, data, direction='rx'):
+        self.frames.append((port, data, direction))
+
+    def publish_tags(self, source, tags):
+        self.tags.append((source, tags))
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def test_sink_forwards_only_changes():
+    inner = RecordingSink()
+    sink = ReportByExceptionSink(inner, deadband=1.0)
+    sink.publish_tags('COM3', {'DM0': 10, 'DM1': 20, 'state': 'run'})
+    sink.publish_tags('COM3', {'DM0': 10, 'DM1': 25, 'state': 'run'})
+    sink.publish_tags('COM3', {'DM0': 10, 'DM1': 25, 'state': 'run'})
+    sink.publish_tags('COM3', {'DM0': 10, 'DM1': 25, 'state': 'stop'})
+    assert inner.tags == [('COM3', {'DM0': 10, 'DM1': 20, 'state': 'run'}),
+                          ('COM3', {'DM1': 25}),
+                          ('COM3', {'state': 'stop'})]
+
+
+def test_sink_keeps_sources_apart_and_passes_frames():
+    inner = RecordingSink()
+    sink = ReportByExceptionSink(inner)
+    sink.publish_tags('COM3', {'DM0': 1})
+    sink.publish_tags('COM4', {'DM0': 1})
+    sink.publish_frame('COM3', b'\x01', 'tx')
+    sink.close()
+    assert [source for source, _ in inner.tags] == ['COM3', 'COM4']
+    assert inner.frames == [('COM3', b'\x01', 'tx')] and inner.closed
@@ -0,0 +1,116 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from store_forward import StoreAndForwardQueue, mqtt_sender
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = StoreAndForwardQueue(str(tmp_path / 'queue.db'), max_bytes=1000)
+    yield store
+    store.close()
+
+
+def payloads(rows):
+    return [row[3] for row in rows]
+
+
+def test_drain_keeps_order_and_unacked_messages(store):
+    store.put_many([('COM3', 't', f"m{i}".encode()) for i in range(5)])
+    delivered = []
+
+    def accept_two(batch):
+        delivered.extend(payloads(batch[:2]))
+        return 2
+
+    assert store.drain(accept_two, batch_size=3) == 2
+    assert delivered == [b'm0', b'm1']
+    assert payloads(store.peek()) == [b'm2', b'm3', b'm4']
+    assert store.drain(lambda batch: len(batch)) == 3
+    assert len(store) == 0 and store.size == 0
+
+
+def test_failed_send_keeps_everything(store):
+    store.put('COM3', 't', b'x')
+
+    def broken(batch):
+        raise OSError("link down")
+
+    assert store.drain(broken) == 0
+    assert len(store) == 1
+
+
+def test_quota_drops_oldest_and_rejects_oversize(store):
+    for i in range(4):
+        store.put('COM3', 't', bytes([i]) * 300)
+    assert [row[3][0] for row in store.peek()] == [1, 2, 3]
+    assert not store.put('COM3', 't', bytes(1001))  # Larger than the whole quota
+    assert len(store) == 3 and store.stats['rejected'] == 1
+
+
+def test_reject_overflow(tmp_path):
+    store = StoreAndForwardQueue(str(tmp_path / 'queue.db'), max_bytes=500, overflow='reject')
+    assert store.put('COM3', 't', bytes(400))
+    assert not store.put('COM3', 't', bytes(200))
+    assert len(store) == 1
+    store.close()
+
+
+class FakeClient:
+    """paho stand-in: publish() hands out mids, and acks holds the mids whose PUBACK will arrive."""
+
+    def __init__(self, acks, connected=True, refuse_from=None):
+        self.acks = set(acks)
+        self.connected = connected
+        self.refuse_from = refuse_from
+        self.published = []
+        self.callbacks = {}
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, payload, qos=0):
+        mid = len(self.published) + 1
+        if self.refuse_from is not None and mid >= self.refuse_from:
+            return SimpleNamespace(rc=4, mid=mid)
+        self.published.append(payload)
+        return SimpleNamespace(rc=0, mid=mid)
+
+    def track(self, mid, callback):
+        if mid in self.acks:
+            threading.Timer(0.01 * (10 - mid), callback, (mid,)).start()  # PUBACKs arrive out of order
+
+
+BATCH = [(i, 'COM3', 't', f"m{i}".encode(), 0.0) for i in range(1, 6)]
+
+
+@pytest.mark.parametrize('acks, expected', [
+    ({1, 2, 3, 4, 5}, 5),
+    ({1, 2, 4, 5}, 2),  # Only the acknowledged prefix counts as delivered
+    ({2, 3, 4, 5}, 0),
+])
+def test_mqtt_sender_counts_acknowledged_prefix(acks, expected):
+    client = FakeClient(acks)
+    send_batch = mqtt_sender(client, client.track, timeout=0.3)
+    assert send_batch(BATCH) == expected
+    assert len(client.published) == 5
+
+
+def test_mqtt_sender_stops_at_refused_publish():
+    client = FakeClient({1, 2, 3, 4, 5}, refuse_from=3)
+    assert mqtt_sender(client, client.track, timeout=0.3)(BATCH) == 2
+
+
+def test_mqtt_sender_offline():
+    client = FakeClient(set(), connected=False)
+    assert mqtt_sender(client, client.track)(BATCH) == 0
+    assert client.published == []
+
+
+def test_drain_through_mqtt_sender_redelivers_unacked(store):
+    store.put_many([('COM3', 't', f"m{i}".encode()) for i in range(1, 6)])
+    client = FakeClient({1, 2, 4, 5})
+    assert store.drain(mqtt_sender(client, client.track, timeout=0.3)) == 2
+    assert payloads(store.peek()) == [b'm3', b'm4', b'm5']
@@ -0,0 +1,285 @@
+import argparse
+import datetime
+import mmap
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from archive import ArchiveReader, ArchiveWriter, index_path, parse_time, scan_records
+from bus_sniffer import decode_frame, modbus_frame
+from capture import MAGIC, CaptureError
+from frames import Frame
+
+SLACK_NS = 1_000_000_000  # How far out of time order concurrent writers may leave frames, as in scan_records
+PRESENT = object()  # Field condition that only asks for the field to be there
+
+
+def parse_condition(text):
+    """'unit=7' -> ('unit', 7), 'header=RD' -> ('header', 'RD'), 'exception' -> ('exception', PRESENT)."""
+    key, sep, value = text.partition('=')
+    if not sep:
+        return key, PRESENT
+    try:
+        return key, int(value, 0)
+    except ValueError:
+        return key, value
+
+
+def parse_pattern(text):
+    """Bytes for a hex pattern such as '01 83' or '0183'."""
+    return bytes.fromhex(text.replace('0x', '').replace(' ', ''))
+
+
+def open_capture(path):
+    """mmap a capture or archive file for scanning."""
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[:len(MAGIC)] != MAGIC:
+        data.close()
+        raise CaptureError(f"{path} is not a capture file")
+    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+        data.madvise(mmap.MADV_SEQUENTIAL)  # Larger read-ahead for the one pass over the file
+    return data
+
+
+def frames(path, ports=None, directions=None, since=None, until=None, pattern=None):
+    """Source stage: (number, Frame, wall ns) for frames passing the header and byte pattern predicates.
+
+    since and until are wall-clock ns or text for parse_time. When the
+    file is an archive with an index, since and until bound the scan to
+    the checkpoints around the window, and with a pattern only the
+    checkpoint segments in which mmap.find sees it are walked record by
+    record; everything else is skipped at memory-search speed.
+    """
+    data = open_capture(path)
+    try:
+        index = None
+        if os.path.exists(index_path(path)):
+            with ArchiveReader(path) as reader:
+                if len(reader.index):
+                    index = reader.index.copy()
+        if index is not None:
+            reference_ns = int(index['wall_ns'][0])
+        elif isinstance(since, str) or isinstance(until, str):
+            reference_ns = next((wall for _, _, wall in scan_records(data)), time.time_ns())
+        else:
+            reference_ns = None
+        since_ns = parse_time(since, reference_ns) if isinstance(since, str) else since
+        until_ns = parse_time(until, reference_ns) if isinstance(until, str) else until
+        if index is None:
+            yield from scan_records(data, len(MAGIC), -1, ports, directions, since_ns, until_ns, pattern)
+            return
+        first = 0
+        if since_ns is not None:
+            first = max(0, int(np.searchsorted(index['wall_ns'], since_ns, side='right')) - 1)
+        last = len(index)
+        if until_ns is not None:
+            last = max(first + 1, int(np.searchsorted(index['wall_ns'], until_ns + SLACK_NS, side='right')))
+        offsets = index['offset']
+        if first == 0:
+            # Frames before the first checkpoint, numbered from the start of the file
+            yield from scan_records(data, len(MAGIC), -1, ports, directions, since_ns, until_ns, pattern,
+                                    end=int(offsets[0]))
+        entry = first
+        while entry < last:
+            start = int(offsets[entry])
+            if pattern is not None:
+                hit = data.find(pattern, start)
+                if hit < 0:
+                    return
+                entry = int(np.searchsorted(offsets, hit, side='right')) - 1
+                if entry >= last:
+                    return
+                start = int(offsets[entry])
+            end = int(offsets[entry + 1]) if entry + 1 < len(offsets) else None
+            yield from scan_records(data, start, int(index['frame'][entry]) - 1, ports, directions, since_ns,
+                                    until_ns, pattern, end=end)
+            entry += 1
+    finally:
+        data.close()
+
+
+def _modbus_prefilter(conditions):
+    """Raw-byte test equivalent to the Modbus header conditions, so most frames are never decoded."""
+    unit = conditions.get('unit')
+    function = conditions.get('function')
+    exception = 'exception' in conditions
+
+    def candidate(data):
+        if len(data) < 4:
+            return False
+        if unit is not None and data[0] != unit:
+            return False
+        if function is not None and data[1] & 0x7F != function:
+            return False
+        return not exception or data[1] & 0x80
+
+    return candidate
+
+
+def _modbus_pattern(conditions):
+    """Bytes every frame meeting the conditions starts with, when the Modbus header is pinned down enough to be worth a search."""
+    unit, function = conditions.get('unit'), conditions.get('function')
+    if conditions.get('protocol') != 'modbus' or not isinstance(unit, int) or not isinstance(function, int):
+        return None
+    if 'exception' in conditions:
+        return bytes([unit, function | 0x80])
+    return None
+
+
+def with_fields(items, conditions):
+    """Keep frames whose decoded fields (bus_sniffer.decode_frame) meet every condition.
+
+    exception and end_code are set for Modbus exception responses and for
+    Host Link responses whose shape the decoder knows (word reads and
+    writes, MS and MM); Host Link end codes are the two-character text,
+    so exception=15 and exception=A3 both match as written.
+    """
+    conditions = dict(conditions)
+    prefilter = _modbus_prefilter(conditions) if conditions.get('protocol') == 'modbus' else None
+    for item in items:
+        frame = item[1]
+        if prefilter is not None and not prefilter(frame.data):
+            continue
+        fields = frame.fields = decode_frame(frame.data)
+        if fields is None:
+            continue
+        for key, value in conditions.items():
+            actual = fields.get(key)
+            if actual is None or (value is not PRESENT and actual != value and str(actual) != str(value)):
+                break
+        else:
+            yield item
+
+
+def query(path, ports=None, directions=None, since=None, until=None, pattern=None, conditions=(), limit=None):
+    """The filter pipeline as one generator of (number, Frame, wall ns); memory use does not grow with the file."""
+    if pattern is None and conditions:
+        pattern = _modbus_pattern(dict(conditions))
+    items = frames(path, ports, directions, since, until, pattern)
+    if conditions:
+        items = with_fields(items, conditions)
+    for count, item in enumerate(items):
+        if limit is not None and count >= limit:
+            items.close()
+            return
+        yield item
+
+
+def format_item(number, frame, wall_ns):
+    moment = datetime.datetime.fromtimestamp(wall_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    fields = ''
+    if frame.fields:
+        fields = '  ' + ' '.join(f"{key}={value}" for key, value in frame.fields.items() if value is not None)
+    return f"{moment} #{number} {frame.port} {frame.direction} {frame.data.hex(' ')}{fields}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Search a USB COMM BRIDGE capture or archive.",
+        epilog="Example, Modbus unit 7 FC3 exceptions after 10:42: "
+               "traffic_query.py traffic.ucbarc --since 10:42 --field protocol=modbus "
+               "--field unit=7 --field function=3 --field exception. "
+               "Host Link error responses: --field protocol=hostlink --field exception")
+    parser.add_argument('path', nargs='?', help="capture or archive file")
+    parser.add_argument('--port', action='append', help="recorded port name (repeatable)")
+    parser.add_argument('--direction', choices=['rx', 'tx'], action='append', help="rx or tx (repeatable)")
+    parser.add_argument('--since', help="start time, e.g. 10:42:17.300 or 2024-05-01T10:42:17")
+    parser.add_argument('--until', help="end time, same forms as --since")
+    parser.add_argument('--pattern', type=parse_pattern, help="hex bytes the frame must contain, e.g. '01 83'")
+    parser.add_argument('--text', help="ASCII text the frame must contain")
+    parser.add_argument('--field', action='append', default=[], type=parse_condition,
+                        help="decoded field condition: key=value, or key alone to require it "
+                             "(protocol, unit, function, exception, end_code, header, kind, ...); "
+                             "exception and end_code cover Modbus and Host Link responses")
+    parser.add_argument('--limit', type=int, help="stop after this many matches")
+    parser.add_argument('--count', action='store_true', help="print only the number of matches")
+    parser.add_argument('--benchmark', action='store_true', help="run the scan benchmark and exit")
+    args = parser.parse_args(argv)
+    if args.benchmark:
+        benchmark()
+        return 0
+    if not args.path:
+        parser.error("path is required")
+    pattern = args.pattern or (args.text.encode('ascii') if args.text else None)
+    try:
+        items = query(args.path, args.port, args.direction, args.since, args.until, pattern, args.field, args.limit)
+        if args.count:
+            print(sum(1 for _ in items))
+        else:
+            for item in items:
+                print(format_item(*item))
+    except BrokenPipeError:
+        pass  # Output piped into head
+    except (OSError, ValueError) as e:
+        print(f"traffic_query: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def benchmark(frames_total=3_000_000):
+    """Scan a multi-million-frame archive with several queries and compare with reading the file raw."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'traffic.ucbarc')
+    writer = ArchiveWriter(path)
+    now = time.monotonic_ns()
+    conversation = []
+    for unit in range(1, 11):
+        conversation.append(('tx', modbus_frame(unit, 3, bytes([0, 100, 0, 10]))))
+        conversation.append(('rx', modbus_frame(unit, 3, bytes([20]) + bytes(range(20)))))
+    exception = modbus_frame(7, 0x83, b'\x02')
+    for i in range(frames_total):
+        direction, data = conversation[i % len(conversation)]
+        if i % 997 == 13 and data[0] == 7 and direction == 'rx':
+            data = exception
+        frame_ns = now + i * 500_000
+        writer.write(Frame('/dev/ttyUSB0' if i % 3 else '/dev/ttyUSB1', data, direction, frame_ns, frame_ns + 1_000_000))
+    writer.close()
+    size = os.path.getsize(path)
+    print(f"Archive: {frames_total} frames, {size / 1e6:.0f} MB")
+
+    start = time.perf_counter()
+    with open(path, 'rb', buffering=0) as f:
+        while f.readinto(bytearray(8 << 20)):
+            pass
+    raw_s = time.perf_counter() - start
+    print(f"Raw read (page cache): {size / raw_s / 1e6:.0f} MB/s")
+
+    with ArchiveReader(path) as reader:
+        first = int(reader.index['wall_ns'][0])
+    middle = datetime.datetime.fromtimestamp((first + frames_total * 250_000) / 1e9).strftime('%H:%M:%S.%f')[:-3]
+    late = datetime.datetime.fromtimestamp((first + frames_total * 260_000) / 1e9).strftime('%H:%M:%S.%f')[:-3]
+    queries = [
+        ("every frame", {}),
+        ("port ttyUSB1, rx only", {'ports': ['/dev/ttyUSB1'], 'directions': ['rx']}),
+        ("bytes '83 02' anywhere", {'pattern': b'\x83\x02'}),
+        ("Modbus unit 7 FC3 exceptions", {'conditions': [('protocol', 'modbus'), ('unit', 7), ('function', 3),
+                                                         ('exception', PRESENT)]}),
+        (f"{middle} to {late}", {'since': middle, 'until': late}),
+    ]
+    for label, kwargs in queries:
+        start = time.perf_counter()
+        matches = sum(1 for _ in query(path, **kwargs))
+        elapsed = time.perf_counter() - start
+        print(f"{label}: {matches} matches in {elapsed:.2f} s ({size / elapsed / 1e6:.0f} MB/s of archive, "
+              f"{frames_total / elapsed / 1e6:.2f} M frames/s)")
+
+    # tracemalloc slows the scan many times over, so memory is measured in separate runs over growing spans
+    for fraction in (0.05, 0.2):
+        until = datetime.datetime.fromtimestamp((first + int(frames_total * fraction) * 500_000) / 1e9)
+        tracemalloc.start()
+        scanned = sum(1 for _ in query(path, until=until.strftime('%H:%M:%S.%f')))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"Peak Python memory scanning {scanned} frames: {peak / 1e3:.0f} kB")
+    os.remove(path)
+    os.remove(index_path(path))
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
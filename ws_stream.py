@@ -0,0 +1,291 @@
+import asyncio
+import base64
+import collections
+import hashlib
+import hmac
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+POLICIES = ('drop_oldest', 'drop_newest', 'coalesce')
+MAX_PAYLOAD = 64 * 1024  # Largest client frame accepted; commands are small JSON
+CLOSE_TOO_BIG = 1009  # WebSocket close status: message too big
+
+
+class FrameTooLarge(IOError):
+    pass
+
+
+def encode_frame(payload, opcode=0x1, mask=False):
+    """Build one unfragmented WebSocket frame (clients must mask, servers must not)."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, (0x80 if mask else 0) | length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, (0x80 if mask else 0) | 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, (0x80 if mask else 0) | 127, length)
+    if not mask:
+        return header + payload
+    key = os.urandom(4)
+    return header + key + bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+
+
+async def read_frame(reader, max_payload=None):
+    """Read one frame and return (opcode, payload), unmasking if needed.
+
+    Raises FrameTooLarge before reading the payload when its length is over
+    max_payload.
+    """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    if max_payload is not None and length > max_payload:
+        raise FrameTooLarge(f"WebSocket frame of {length} bytes is over the {max_payload} byte limit")
+    key = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if key:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return first & 0x0F, payload
+
+
+class _Client:
+    """Per-client bounded buffer and counters."""
+
+    def __init__(self, writer, buffer_size):
+        self.writer = writer
+        self.buffer = collections.deque()
+        self.buffer_size = buffer_size
+        self.ready = asyncio.Event()
+        self.ports = None  # None means every port
+        self.dropped = 0
+        self.sent = 0
+
+
+class WebSocketStreamServer:
+    """Stream framed data from bridged ports to many WebSocket clients.
+
+    publish_frame() may be called from any thread (for example a serial reader).
+    Each message is encoded once and queued for every subscribed client in a
+    bounded buffer; a client that falls behind loses data according to
+    policy: 'drop_oldest' discards its oldest queued message, 'drop_newest'
+    discards the new one, and 'coalesce' collapses its buffer to the latest
+    message per port, then drops the oldest of those if there are more
+    ports than buffer_size. Clients send JSON commands back:
+    {"subscribe": ["COM3"]} limits the stream to some ports, and
+    {"port": "COM3", "write": "48656c6c6f", "token": "..."} passes hex bytes
+    to on_command. Writes are refused unless the server has a token and the
+    command carries it. Browsers always send an Origin header, so a
+    handshake whose Origin is not in allowed_origins is refused with 403;
+    otherwise any web page open on this machine could read the traffic.
+    Clients that are not browsers send no Origin and are let in. The
+    server listens on loopback unless given another host, and closes a
+    connection with status 1009 when a client frame is over max_payload
+    bytes.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, buffer_size=256, policy='drop_oldest', on_command=None,
+                 token=None, max_payload=MAX_PAYLOAD, allowed_origins=()):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        self.host = host
+        self.port = port
+        self.buffer_size = buffer_size
+        self.policy = policy
+        self.on_command = on_command
+        self.token = token
+        self.max_payload = max_payload
+        self.allowed_origins = {origin.rstrip('/').lower() for origin in allowed_origins}
+        self.clients = set()
+        self.stats = {'published': 0, 'dropped': 0, 'commands': 0, 'refused': 0, 'oversized': 0, 'forbidden': 0}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._server = None
+
+    def start(self):
+        """Start listening on a background event loop."""
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, self.host, self.port), self._loop).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"WebSocket stream server listening on {self.host}:{self.port}")
+        return self
+
+    def close(self):
+        async def shutdown():
+            self._server.close()
+            for client in list(self.clients):
+                client.writer.close()
+            await self._server.wait_closed()
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        logging.info(f"WebSocket stream server closed: {self.stats}")
+
+    def publish_frame(self, port, data, direction='rx'):
+        """Queue a frame from a bridged port for every subscribed client (thread-safe)."""
+        message = json.dumps({'port': port, 'dir': direction, 'ts': time.time(), 'data': bytes(data).hex()})
+        self._loop.call_soon_threadsafe(self._fan_out, port, encode_frame(message.encode('utf-8')))
+
+    def _fan_out(self, port, frame):
+        self.stats['published'] += 1
+        for client in self.clients:
+            if client.ports is not None and port not in client.ports:
+                continue
+            if len(client.buffer) >= client.buffer_size:
+                if self.policy == 'drop_newest':
+                    client.dropped += 1
+                    self.stats['dropped'] += 1
+                    continue
+                queued = len(client.buffer)
+                if self.policy == 'drop_oldest':
+                    client.buffer.popleft()
+                else:
+                    latest = {}
+                    for queued_port, queued_frame in client.buffer:
+                        latest[queued_port] = queued_frame
+                    latest.pop(port, None)
+                    client.buffer = collections.deque(latest.items())
+                    while len(client.buffer) >= client.buffer_size:
+                        client.buffer.popleft()  # More ports than room: the oldest port's latest goes too
+                client.dropped += queued - len(client.buffer)
+                self.stats['dropped'] += queued - len(client.buffer)
+            client.buffer.append((port, frame))
+            client.ready.set()
+
+    async def _handshake(self, reader, writer):
+        request = await reader.readuntil(b'\r\n\r\n')
+        headers = {}
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if key is None:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+        origin = headers.get('origin')
+        if origin is not None and origin.rstrip('/').lower() not in self.allowed_origins:
+            self.stats['forbidden'] += 1
+            logging.warning(f"WebSocket connection from origin {origin} refused")
+            writer.write(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n')
+            return False
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      f'Sec-WebSocket-Accept: {accept}\r\n\r\n').encode())
+        await writer.drain()
+        return True
+
+    async def _handle(self, reader, writer):
+        try:
+            if not await self._handshake(reader, writer):
+                writer.close()
+                return
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        client = _Client(writer, self.buffer_size)
+        self.clients.add(client)
+        sender = asyncio.ensure_future(self._send_loop(client))
+        try:
+            while True:
+                opcode, payload = await read_frame(reader, self.max_payload)
+                if opcode == 0x8:  # Close
+                    writer.write(encode_frame(payload[:2], opcode=0x8))
+                    break
+                if opcode == 0x9:  # Ping
+                    writer.write(encode_frame(payload, opcode=0xA))
+                elif opcode in (0x1, 0x2):
+                    self._command(client, payload)
+        except FrameTooLarge as e:
+            self.stats['oversized'] += 1
+            logging.warning(f"Closing WebSocket client: {e}")
+            writer.write(encode_frame(struct.pack('!H', CLOSE_TOO_BIG), opcode=0x8))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+            writer.close()
+
+    def _command(self, client, payload):
+        try:
+            command = json.loads(payload)
+            if 'subscribe' in command:
+                client.ports = set(command['subscribe']) if command['subscribe'] else None
+            if 'write' in command:
+                if not self._authorized(command.get('token')):
+                    self.stats['refused'] += 1
+                    logging.warning(f"WebSocket write to {command.get('port')} refused: missing or wrong token")
+                    return
+                self.stats['commands'] += 1
+                if self.on_command is not None:
+                    self.on_command(command['port'], bytes.fromhex(command['write']))
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Invalid WebSocket command {payload[:80]!r}: {e}")
+
+    def _authorized(self, token):
+        if self.token is None or not isinstance(token, str):
+            return False
+        return hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    async def _send_loop(self, client):
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                while client.buffer:
+                    client.writer.write(client.buffer.popleft()[1])
+                    client.sent += 1
+                await client.writer.drain()  # Waits while this client's socket is backed up
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+
+def benchmark(clients=300, messages=2000, payload_size=64):
+    """Measure fan-out of bridged frames to many local WebSocket clients."""
+    server = WebSocketStreamServer(host='127.0.0.1', port=0, buffer_size=messages).start()
+
+    async def run_clients():
+        connections = []
+        for _ in range(clients):
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            key = base64.b64encode(os.urandom(16)).decode()
+            writer.write(f"GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+            await reader.readuntil(b'\r\n\r\n')
+            connections.append((reader, writer))
+        while len(server.clients) < clients:
+            await asyncio.sleep(0.01)
+
+        async def receive(reader):
+            for _ in range(messages):
+                await read_frame(reader)
+
+        start = time.perf_counter()
+        payload = bytes(payload_size)
+        for _ in range(messages):
+            server.publish_frame('COM3', payload)
+        await asyncio.gather(*(receive(reader) for reader, _ in connections))
+        elapsed = time.perf_counter() - start
+        for _, writer in connections:
+            writer.write(encode_frame(b'\x03\xe8', opcode=0x8, mask=True))
+            writer.close()
+        return elapsed
+
+    elapsed = asyncio.run(run_clients())
+    server.close()
+    delivered = clients * messages
+    print(f"{messages} frames to {clients} clients: {delivered} deliveries in {elapsed:.2f} s "
+          f"({delivered / elapsed:.0f} deliveries/s, {server.stats['dropped']} dropped)")
+
+
+if __name__ == '__main__':
+    benchmark()